@@ -0,0 +1,304 @@
+import os
+import logging
+import json
+import time
+import threading
+
+import numpy as np
+
+from numpy_vector_store import _normalize
+
+logger = logging.getLogger(__name__)
+
+
+def _kmeans(vectors, k, iterations=15, seed=0):
+    """Spherical k-means on L2-normalized vectors; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        updated = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+        updated[present] = sums
+        centroids = _normalize(updated)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over a NumpyVectorStore.
+
+    Rows are clustered into ``n_lists`` cells with spherical k-means; a query
+    only scores the rows in its ``n_probe`` closest cells, trading recall for
+    speed. The index is keyed by store row, so inserts are assigned to a cell as
+    they arrive, deletes are handled by the store's tombstones, and compaction
+    remaps the assignments. Below ``min_vectors`` live rows (or before training)
+    the store falls back to exact search.
+
+    Training, and retraining once the corpus has grown fourfold, runs on a
+    background thread and takes the store's lock only to copy a sample and to
+    swap the result in, so searches and inserts continue meanwhile. With
+    ``path`` the index is saved once ``save_every`` rows were assigned since
+    the last save (see ``needs_save``) and on compaction; rows added after the
+    last save are assigned again when the store is loaded.
+    """
+
+    def __init__(self, n_lists=0, n_probe=8, min_vectors=50000, path=None, sample_size=100000, seed=0, save_every=10000):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_vectors = min_vectors
+        self.path = path
+        self.sample_size = sample_size
+        self.seed = seed
+        self.save_every = save_every
+        self.centroids = None
+        self.trained_on = 0
+        self.unsaved = 0
+        self._assignments = np.full(0, -1, dtype=np.int32)
+        self._order = None
+        self._offsets = None
+        self._remaps = 0
+        self._trainer = None
+        self.load()
+
+    @property
+    def ready(self):
+        return self.centroids is not None
+
+    def active(self, live_count):
+        return self.ready and live_count >= self.min_vectors
+
+    # Persistence
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            self.centroids = data["centroids"]
+            self._assignments = data["assignments"].astype(np.int32)
+            self.trained_on = int(data["trained_on"])
+        self._order = None
+
+    def save(self):
+        """Write the centroids and assignments to ``path``. Callers hold the store's lock."""
+        if not self.path or not self.ready:
+            return
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, assignments=self._assignments, trained_on=self.trained_on)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+    def needs_save(self):
+        return bool(self.path) and self.save_every is not None and self.unsaved >= self.save_every
+
+    def reset(self):
+        self._remaps += 1
+        self.centroids = None
+        self.trained_on = 0
+        self._assignments = np.full(0, -1, dtype=np.int32)
+        self._order = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Maintenance
+
+    def _resize(self, count):
+        if len(self._assignments) < count:
+            grown = np.full(max(count, 2 * len(self._assignments)), -1, dtype=np.int32)
+            grown[: len(self._assignments)] = self._assignments
+            self._assignments = grown
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _assign_rows(self, store, rows, centroids):
+        assignments = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), 65536):
+            block = rows[start:start + 65536]
+            assignments[start:start + len(block)] = np.argmax(store._vectors(block) @ centroids.T, axis=1)
+        return assignments
+
+    def train(self, store):
+        """Cluster a sample of the store's live rows and assign every row to a cell.
+
+        Only the sample is copied under the store's lock. Clustering and the
+        assignment of the rows present at the start run outside it; rows added
+        meanwhile are assigned when the result is swapped in. A compaction
+        while training renumbers the rows, so training starts over.
+        """
+        while not self._train(store):
+            logger.info("Retraining IVF index: the store was compacted while it trained")
+
+    def _train(self, store):
+        """Train once; return False if the rows were renumbered meanwhile and the result was dropped."""
+        with store._lock:
+            count = store._count
+            live = np.flatnonzero(store._alive[:count])
+            if len(live) == 0:
+                return True
+            remaps = self._remaps
+            n_lists = self.n_lists or int(max(1, min(len(live) // 39, 4 * np.sqrt(len(live)))))
+            rng = np.random.default_rng(self.seed)
+            sample = np.sort(rng.choice(live, min(len(live), max(self.sample_size, n_lists)), replace=False))
+            vectors = np.array(store._vectors(sample))
+        started = time.time()
+        centroids = _kmeans(vectors, n_lists, seed=self.seed)
+        try:
+            # Rows below ``count`` are only moved by a compaction, detected below, so they are read without the lock.
+            assignments = self._assign_rows(store, np.arange(count), centroids)
+        except IndexError:
+            # A compaction shrank the matrix under the read.
+            assignments = None
+        with store._lock:
+            if self._remaps != remaps or assignments is None:
+                return False
+            added = np.arange(count, store._count)
+            self.centroids = centroids
+            self._assignments = np.concatenate([assignments, self._assign_rows(store, added, centroids)])
+            self.trained_on = len(live)
+            self._order = None
+            self.save()
+        logger.info(f"Trained IVF index with {n_lists} lists on {len(sample)} of {len(live)} vectors in {time.time() - started:.2f}s")
+        return True
+
+    def _train_in_background(self, store):
+        try:
+            self.train(store)
+        except Exception as e:
+            logger.error(f"IVF training failed: {str(e)}")
+
+    def join(self, timeout=None):
+        """Wait for a background training run, if any, to finish."""
+        trainer = self._trainer
+        if trainer is not None:
+            trainer.join(timeout)
+
+    def on_add(self, store, start, vectors):
+        """Assign newly inserted rows, training or retraining once the corpus is large enough.
+
+        Once trained, every new row is assigned, even while deletes keep the
+        corpus below ``min_vectors``, so no row is left out of its cell when
+        the corpus grows past it again. Callers hold the store's lock.
+        """
+        live_count = len(store)
+        if live_count >= self.min_vectors and (not self.ready or live_count > 4 * self.trained_on):
+            if self._trainer is None or not self._trainer.is_alive():
+                self._trainer = threading.Thread(
+                    target=self._train_in_background, args=(store,), name="ivf-train", daemon=True
+                )
+                self._trainer.start()
+        if not self.ready:
+            return
+        self._resize(start + len(vectors))
+        self._assignments[start:start + len(vectors)] = self._assign(vectors)
+        self._order = None
+        self.unsaved += len(vectors)
+
+    def assign_missing(self, store):
+        """Assign the live rows the loaded assignments lack, i.e. those added since the last save. Callers hold the store's lock."""
+        if not self.ready:
+            return
+        self._resize(store._count)
+        missing = np.flatnonzero(store._alive[:store._count] & (self._assignments[:store._count] < 0))
+        if len(missing):
+            self._assignments[missing] = self._assign_rows(store, missing, self.centroids)
+            self._order = None
+
+    def remap(self, keep):
+        self._remaps += 1
+        if self.ready:
+            self._assignments = self._assignments[keep]
+            self._order = None
+            self.save()
+
+    # Search
+
+    def candidates(self, query, count, n_probe=None):
+        """Return the store rows in the ``n_probe`` cells closest to ``query``."""
+        if self._order is None:
+            assignments = self._assignments[:count]
+            self._order = np.argsort(assignments, kind="stable")
+            self._offsets = np.searchsorted(assignments[self._order], np.arange(len(self.centroids) + 1))
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        return np.concatenate([self._order[self._offsets[p]:self._offsets[p + 1]] for p in probes])
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "lists": 0 if self.centroids is None else len(self.centroids),
+            "n_probe": self.n_probe,
+            "min_vectors": self.min_vectors,
+            "trained_on": self.trained_on,
+        }
+
+
+def recall_report(store, query_vectors, k=5, probes=(1, 2, 4, 8, 16, 32)):
+    """Compare IVF search against exact search on ``store`` for each ``n_probe`` setting.
+
+    Returns one row per setting with recall@k and mean per-query latency of
+    both searches, in milliseconds.
+    """
+    index = store.ann
+    query_vectors = _normalize(np.asarray(query_vectors, dtype=np.float32))
+
+    store.ann = None
+    started = time.perf_counter()
+    exact = [
+        {doc.id for doc, _ in store.similarity_search_with_score_by_vector(q, k=k)} for q in query_vectors
+    ]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(query_vectors)
+    store.ann = index
+
+    report = []
+    original_probe = index.n_probe
+    for n_probe in probes:
+        index.n_probe = n_probe
+        started = time.perf_counter()
+        approx = [
+            {doc.id for doc, _ in store.similarity_search_with_score_by_vector(q, k=k)} for q in query_vectors
+        ]
+        ann_ms = (time.perf_counter() - started) * 1000 / len(query_vectors)
+        recall = np.mean([len(a & e) / max(1, len(e)) for a, e in zip(approx, exact)])
+        report.append({
+            "n_probe": n_probe,
+            f"recall@{k}": round(float(recall), 4),
+            "exact_ms": round(exact_ms, 3),
+            "ann_ms": round(ann_ms, 3),
+        })
+    index.n_probe = original_probe
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from numpy_vector_store import NumpyVectorStore
+
+    parser = argparse.ArgumentParser(description="Report IVF recall@k against exact search on a synthetic corpus.")
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dtype", default="float32")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(args.clusters, args.dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, args.clusters, args.vectors)]
+    vectors += 0.5 * rng.normal(size=vectors.shape).astype(np.float32)
+    queries = centers[rng.integers(0, args.clusters, args.queries)]
+    queries += 0.5 * rng.normal(size=queries.shape).astype(np.float32)
+
+    store = NumpyVectorStore(
+        DeterministicFakeEmbedding(size=args.dim),
+        dtype=args.dtype,
+        ann=IVFIndex(min_vectors=1),
+    )
+    ids = [str(i) for i in range(args.vectors)]
+    store.add_vectors(vectors, ids, [{} for _ in ids], ids)
+    store.ann.join()
+    print(json.dumps(recall_report(store, queries, k=args.k), indent=2))
@@ -0,0 +1,417 @@
+"""Offline benchmark for ingest throughput and query latency.
+
+Generates synthetic PDF, CSV and XLSX corpora, then for each size runs
+``initialize_system`` and a concurrent ``process_query`` load in a fresh
+process against local fake embedding and chat models with configurable
+latency, so no API key or network is needed. A second fresh process then
+restarts on the index the first one left behind, to time the import, the
+time until ``initialize_system`` returns, and the first query. Results are
+written as JSON:
+
+    python benchmark.py --sizes small,medium --output results.json
+    python benchmark.py --sizes small --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import concurrent.futures
+
+SIZES = {
+    "small": {"pdf_pages": 100, "csv_rows": 5000, "xlsx_rows": 2000},
+    "medium": {"pdf_pages": 1000, "csv_rows": 50000, "xlsx_rows": 20000},
+    "large": {"pdf_pages": 10000, "csv_rows": 500000, "xlsx_rows": 200000},
+}
+PAGES_PER_PDF = 50
+SETTINGS = (
+    "TABLE_ENGINE", "RETRIEVAL_MODE", "VECTOR_STORE_DTYPE", "VECTOR_SEARCH_MODE", "LOADER_WORKERS",
+    "QUERY_WORKERS", "QUERY_QUEUE_SIZE", "STREAM_INGEST_THRESHOLD_BYTES",
+)
+
+_WORDS = (
+    "invoice shipment warehouse quarterly revenue forecast supplier contract audit policy "
+    "customer region margin inventory freight compliance budget payroll vendor ledger "
+    "account balance tariff pallet order return refund discount schedule report summary"
+).split()
+_REGIONS = ["North", "South", "East", "West", "Central"]
+
+
+# Corpus generation
+
+def _sentence(rng):
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 16))).capitalize() + "."
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one page of Helvetica text per list of lines in ``pages``."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def _table_rows(rng, count):
+    for i in range(count):
+        yield [f"SKU-{i:07d}", rng.choice(_WORDS), rng.choice(_REGIONS), rng.randint(1, 500), round(rng.uniform(1, 1000), 2)]
+
+
+def generate_corpus(directory, pdf_pages, csv_rows, xlsx_rows, seed=0):
+    """Write a deterministic synthetic corpus into ``directory``; return file counts and total bytes."""
+    import csv
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    headers = ["sku", "product", "region", "quantity", "price"]
+    files = {"pdf": 0, "csv": 0, "xlsx": 0}
+
+    for start in range(0, pdf_pages, PAGES_PER_PDF):
+        pages = [[_sentence(rng) for _ in range(40)] for _ in range(min(PAGES_PER_PDF, pdf_pages - start))]
+        write_pdf(os.path.join(directory, f"report_{start // PAGES_PER_PDF:04d}.pdf"), pages)
+        files["pdf"] += 1
+    if csv_rows:
+        with open(os.path.join(directory, "orders.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            writer.writerows(_table_rows(rng, csv_rows))
+        files["csv"] += 1
+    if xlsx_rows:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("inventory")
+        sheet.append(headers)
+        for row in _table_rows(rng, xlsx_rows):
+            sheet.append(row)
+        workbook.save(os.path.join(directory, "inventory.xlsx"))
+        files["xlsx"] += 1
+
+    total = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return {"files": files, "bytes": total}
+
+
+def generate_queries(count, seed=1):
+    rng = random.Random(seed)
+    templates = [
+        "What does the {a} report say about {b}?",
+        "Summarize the {a} and {b} figures for the {r} region.",
+        "How many units of {a} were ordered in {r}?",
+        "Which {a} entries mention {b}?",
+    ]
+    return [
+        rng.choice(templates).format(a=rng.choice(_WORDS), b=rng.choice(_WORDS), r=rng.choice(_REGIONS)) + f" (#{i})"
+        for i in range(count)
+    ]
+
+
+# Fake models
+
+def fake_models(embedding_latency, llm_latency, dimensions=256):
+    """Return (embeddings, chat model) classes that answer locally after a fixed per-call latency."""
+    import numpy as np
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class HashingEmbeddings(Embeddings):
+        """Deterministic bag-of-words feature-hashing embeddings."""
+
+        def _embed(self, text):
+            vector = np.zeros(dimensions, dtype=np.float32)
+            for token in text.lower().split():
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                vector[int.from_bytes(digest[:4], "little") % dimensions] += 1 if digest[4] & 1 else -1
+            norm = np.linalg.norm(vector)
+            return (vector / norm if norm else vector).tolist()
+
+        def embed_documents(self, texts):
+            time.sleep(embedding_latency)
+            return [self._embed(text) for text in texts]
+
+        def embed_query(self, text):
+            time.sleep(embedding_latency)
+            return self._embed(text)
+
+    class LatencyChatModel(BaseChatModel):
+        """Chat model that waits a fixed time and answers with a summary of its prompt."""
+
+        @property
+        def _llm_type(self):
+            return "benchmark-fake"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(llm_latency)
+            prompt = messages[-1].content
+            content = f"Answer drawn from {len(prompt)} characters of context."
+            usage = {"input_tokens": len(prompt) // 4, "output_tokens": 8, "total_tokens": len(prompt) // 4 + 8}
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            # The latency is spent before the first token; the rest follow at once, one word each.
+            time.sleep(llm_latency)
+            prompt = messages[-1].content
+            words = f"Answer drawn from {len(prompt)} characters of context.".split(" ")
+            for i, word in enumerate(words):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    return (
+        lambda *args, **kwargs: HashingEmbeddings(),
+        lambda *args, **kwargs: LatencyChatModel(),
+    )
+
+
+# Runs
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_one(config):
+    """Ingest the corpus and run the query load in this process; return the measurements."""
+    import rag_service
+
+    embeddings, chat = fake_models(config["embedding_latency_ms"] / 1000, config["llm_latency_ms"] / 1000)
+    rag_service.OpenAIEmbeddings = embeddings
+    rag_service.ChatOpenAI = chat
+
+    started = time.perf_counter()
+    rag_service.initialize_system()
+    ingest_seconds = time.perf_counter() - started
+    documents = sum(timing.get("documents", 0) for timing in rag_service._load_timings)
+    chunks = len(rag_service._vector_store)
+
+    queries = generate_queries(config["queries"])
+    latencies, outcomes = [], {"ok": 0, "timed_out": 0, "rejected": 0, "failed": 0}
+
+    def ask(query):
+        began = time.perf_counter()
+        try:
+            result = rag_service.process_query(query, timeout=config["timeout"])
+        except rag_service.QueryRejected:
+            return "rejected", None
+        elapsed = (time.perf_counter() - began) * 1000
+        if result.get("timed_out"):
+            return "timed_out", elapsed
+        return ("ok" if result.get("success") else "failed"), elapsed
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+        for outcome, elapsed in executor.map(ask, queries):
+            outcomes[outcome] += 1
+            if elapsed is not None:
+                latencies.append(elapsed)
+    query_seconds = time.perf_counter() - started
+
+    return {
+        "ingest": {
+            "seconds": round(ingest_seconds, 3),
+            "documents": documents,
+            "chunks": chunks,
+            "docs_per_second": round(documents / ingest_seconds, 1) if ingest_seconds else None,
+            "chunks_per_second": round(chunks / ingest_seconds, 1) if ingest_seconds else None,
+            "tables": rag_service._table_store.stats()["tables"],
+        },
+        "query": {
+            "queries": len(queries),
+            "concurrency": config["concurrency"],
+            "seconds": round(query_seconds, 3),
+            "queries_per_second": round(len(queries) / query_seconds, 1) if query_seconds else None,
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            **outcomes,
+        },
+        "context": {
+            name: rag_service.get_stats()["context"][name] for name in ("avg_candidate_tokens", "avg_tokens")
+        },
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "loader_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def run_startup(config):
+    """Start again on the index left by ``run_one`` and time the import, readiness and the first query."""
+    started = time.perf_counter()
+    import rag_service
+    import_seconds = time.perf_counter() - started
+
+    embeddings, chat = fake_models(config["embedding_latency_ms"] / 1000, config["llm_latency_ms"] / 1000)
+    rag_service.OpenAIEmbeddings = embeddings
+    rag_service.ChatOpenAI = chat
+
+    started = time.perf_counter()
+    rag_service.initialize_system()
+    ready_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rag_service.process_query(generate_queries(1)[0], timeout=config["timeout"])
+    first_query_ms = (time.perf_counter() - started) * 1000
+
+    startup = rag_service.get_stats()["startup"]
+    return {
+        "mode": startup.get("mode"),
+        "chunks": startup.get("chunks"),
+        "import_seconds": round(import_seconds, 3),
+        "ready_seconds": round(ready_seconds, 3),
+        "first_query_ms": round(first_query_ms, 1),
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+    }
+
+
+def _run_child(flag, config, env):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), flag, json.dumps(config)],
+        env=env, stdout=subprocess.PIPE, check=True, text=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_size(size, args):
+    """Generate the corpus for ``size`` and benchmark it in a fresh interpreter."""
+    with tempfile.TemporaryDirectory(prefix=f"genie-bench-{size}-") as root:
+        spec = dict(SIZES[size])
+        for file_type in ("pdf", "csv", "xlsx"):
+            if file_type not in args.types:
+                spec["pdf_pages" if file_type == "pdf" else f"{file_type}_rows"] = 0
+        print(f"[{size}] generating corpus {spec}", file=sys.stderr)
+        corpus = generate_corpus(os.path.join(root, "docs"), **spec)
+        config = {
+            "queries": args.queries,
+            "concurrency": args.concurrency,
+            "timeout": args.timeout,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+        }
+        env = dict(os.environ, DOCS_DIRECTORY=os.path.join(root, "docs"), STORAGE_DIRECTORY=os.path.join(root, "storage"))
+        env.setdefault("LOG_LEVEL", "WARNING")
+        print(f"[{size}] ingesting {corpus['bytes'] / 1e6:.1f} MB and running {args.queries} queries", file=sys.stderr)
+        result = _run_child("--run-one", config, env)
+        print(f"[{size}] restarting on the persisted index", file=sys.stderr)
+        result["startup"] = _run_child("--run-startup", config, env)
+        result["ingest"]["mb_per_second"] = round(corpus["bytes"] / 1e6 / result["ingest"]["seconds"], 2)
+        return {"size": size, "corpus": {**spec, **corpus}, **result}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous):
+    """Print the ratio of each headline metric to the same size in a previous result file."""
+    metrics = [
+        ("ingest", "docs_per_second"), ("ingest", "chunks_per_second"), ("query", "p50_ms"),
+        ("query", "p95_ms"), ("query", "p99_ms"), ("query", "queries_per_second"), ("context", "avg_tokens"),
+        ("startup", "import_seconds"), ("startup", "ready_seconds"), ("startup", "first_query_ms"), (None, "peak_rss_mb"),
+    ]
+    before = {run["size"]: run for run in previous["runs"]}
+    for run in current["runs"]:
+        if run["size"] not in before:
+            continue
+        print(f"{run['size']} vs {previous.get('git_commit') or 'previous'}:")
+        for section, name in metrics:
+            new = run.get(section, {}).get(name) if section else run[name]
+            old = before[run["size"]].get(section, {}).get(name) if section else before[run["size"]][name]
+            change = f"{new / old:.2f}x" if new is not None and old else "n/a"
+            print(f"  {(section + '.' if section else '') + name:28} {old} -> {new} ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest throughput and query latency with local fake models.")
+    parser.add_argument("--sizes", default="small", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--types", default="pdf,csv,xlsx", help="comma-separated file types to generate")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=0, help="per-query deadline in seconds (0: none)")
+    parser.add_argument("--embedding-latency-ms", type=float, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--run-startup", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+    if args.run_startup:
+        print(json.dumps(run_startup(json.loads(args.run_startup))))
+        return
+
+    args.types = set(args.types.split(","))
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "types": sorted(args.types),
+            "queries": args.queries,
+            "concurrency": args.concurrency,
+            "timeout": args.timeout,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+            "settings": {name: os.environ[name] for name in SETTINGS if name in os.environ},
+        },
+        "runs": [run_size(size, args) for size in args.sizes.split(",")],
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+import os
+import re
+import math
+import time
+import json
+import shutil
+import logging
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+_SEPARATORS = re.compile(r"[-./:]")
+# idf of a term that occurs in about 90% of chunks.
+_MIN_IDF = 0.1
+
+
+def tokenize(text):
+    """Lowercase word tokens. Compound tokens such as ``SKU-00123`` or ``3.5`` are kept whole and also split into parts."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class _Segment:
+    """Postings written by ``BM25Index.save``, memory-mapped read-only.
+
+    Postings are stored term by term (slots and term frequencies, with
+    per-term offsets) and, to take chunks out again, the terms of each slot.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "terms.json"), "r", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = self._map(directory, "offsets")
+        self.slots = self._map(directory, "slots")
+        self.tfs = self._map(directory, "tfs")
+        self.doc_offsets = self._map(directory, "doc_offsets")
+        self.doc_terms = self._map(directory, "doc_terms")
+
+    @staticmethod
+    def _map(directory, name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+    def postings(self, term):
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.slots[start:end], self.tfs[start:end]
+
+    def slot_terms(self, slot):
+        return [self.terms[i] for i in self.doc_terms[self.doc_offsets[slot]:self.doc_offsets[slot + 1]]]
+
+
+class BM25Index:
+    """Incrementally updated inverted index that ranks chunks with Okapi BM25.
+
+    Each term maps to parallel arrays of chunk slots and term frequencies, so
+    a query is scored with a few vectorized NumPy operations per query term
+    and needs no embedding call. Chunks are added and removed by id alongside
+    the vector store; removed slots are tombstoned and the postings compacted
+    once they outnumber live ones.
+
+    With ``path`` the index can be saved as a memory-mapped segment, so a
+    restarted process, or each of several reading processes, maps the saved
+    postings instead of tokenizing every chunk again, and only indexes the
+    chunks changed since. Chunks added after the last save are kept in
+    memory; ``needs_save`` turns true once there are ``save_every`` of them.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, path=None, save_every=10000):
+        self.k1 = k1
+        self.b = b
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        with self._lock:
+            self._slots = {}
+            self._slot_ids = []
+            self._slot_terms = []
+            self._lengths = array("f")
+            self._alive = bytearray()
+            self._postings = {}
+            self._df = {}
+            self._total_length = 0
+            self._live = 0
+            # Slots below _saved_slots live in the mapped segment; their terms are read from it.
+            self._segment = None
+            self._segment_name = None
+            self._saved_slots = 0
+            self.unsaved = 0
+
+    def reset(self):
+        """Empty the index and delete what was saved under ``path``."""
+        with self._lock:
+            self._clear()
+            if self.path:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+    def __len__(self):
+        return self._live
+
+    def add(self, ids, texts):
+        """Index ``texts`` under ``ids``, replacing any chunks already indexed under the same ids."""
+        with self._lock:
+            self.remove([doc_id for doc_id in ids if doc_id in self._slots])
+            for doc_id, text in zip(ids, texts):
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                slot = len(self._slot_ids)
+                self._slots[doc_id] = slot
+                self._slot_ids.append(doc_id)
+                self._slot_terms.append(tuple(counts))
+                self._lengths.append(len(tokens))
+                self._alive.append(1)
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("q"), array("f"))
+                    postings[0].append(slot)
+                    postings[1].append(tf)
+                    self._df[term] = self._df.get(term, 0) + 1
+                self._total_length += len(tokens)
+                self._live += 1
+                self.unsaved += 1
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                slot = self._slots.pop(doc_id, None)
+                if slot is None:
+                    continue
+                terms = self._slot_terms[slot]
+                if terms is None:
+                    terms = self._segment.slot_terms(slot)
+                for term in terms:
+                    self._df[term] -= 1
+                    if not self._df[term]:
+                        del self._df[term]
+                self._slot_ids[slot] = None
+                self._slot_terms[slot] = ()
+                self._alive[slot] = 0
+                self._total_length -= int(self._lengths[slot])
+                self._live -= 1
+            # Removed saved slots stay tombstoned until the next save.
+            unsaved_slots = len(self._slot_ids) - self._saved_slots
+            if unsaved_slots > 1024 and self._alive.count(1, self._saved_slots) < unsaved_slots // 2:
+                self._compact()
+
+    def _compact(self):
+        first = self._saved_slots
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        keep_slots = alive.copy()
+        keep_slots[:first] = True
+        renumber = np.cumsum(keep_slots) - 1
+        postings = {}
+        for term, (slots, tfs) in self._postings.items():
+            slot_view = np.frombuffer(slots, dtype=np.int64)
+            keep = alive[slot_view]
+            if keep.any():
+                postings[term] = (
+                    array("q", renumber[slot_view[keep]].tobytes()),
+                    array("f", np.frombuffer(tfs, dtype=np.float32)[keep].tobytes()),
+                )
+            del slot_view
+        lengths = np.frombuffer(self._lengths, dtype=np.float32)[keep_slots]
+        self._postings = postings
+        self._lengths = array("f", lengths.tobytes())
+        self._slot_ids = self._slot_ids[:first] + [doc_id for doc_id in self._slot_ids[first:] if doc_id is not None]
+        self._slot_terms = [terms for terms, kept in zip(self._slot_terms, keep_slots) if kept]
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(self._slot_ids) if doc_id is not None}
+        self._alive = bytearray(alive[keep_slots].astype(np.uint8).tobytes())
+
+    def _term_postings(self, term):
+        """Return the (slots, tfs) arrays of ``term``: saved ones first, then those added since. Callers hold the lock."""
+        parts = []
+        if self._segment is not None:
+            saved = self._segment.postings(term)
+            if saved is not None:
+                parts.append(saved)
+        postings = self._postings.get(term)
+        if postings is not None:
+            parts.append((np.frombuffer(postings[0], dtype=np.int64), np.frombuffer(postings[1], dtype=np.float32)))
+        return parts
+
+    def search(self, query, k=4):
+        """Return up to ``k`` (chunk id, BM25 score) pairs for ``query``, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._live or not terms or k <= 0:
+                return []
+            scores = np.zeros(len(self._slot_ids), dtype=np.float32)
+            lengths = np.frombuffer(self._lengths, dtype=np.float32)
+            average_length = self._total_length / self._live
+            weights = {}
+            for term in terms:
+                df = self._df.get(term)
+                if df:
+                    weights[term] = math.log(1 + (self._live - df + 0.5) / (df + 0.5))
+            # Terms in nearly every chunk (CSV column names, say) barely move the
+            # ranking but cost a pass over the whole corpus, so skip them when
+            # the query has anything more selective.
+            if any(idf >= _MIN_IDF for idf in weights.values()):
+                weights = {term: idf for term, idf in weights.items() if idf >= _MIN_IDF}
+            for term, idf in weights.items():
+                parts = self._term_postings(term)
+                while parts:
+                    slots, tfs = parts.pop()
+                    norms = self.k1 * (1 - self.b + self.b * lengths[slots] / average_length)
+                    scores[slots] += idf * tfs * (self.k1 + 1) / (tfs + norms)
+                    # Views must not outlive the lock: the arrays cannot grow while exported.
+                    del slots, tfs, norms
+            del lengths
+            scores *= np.frombuffer(self._alive, dtype=np.uint8)
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            order = candidates[np.argsort(-scores[candidates])]
+            return [(self._slot_ids[slot], float(scores[slot])) for slot in order]
+
+    # Persistence
+
+    def _saved_name(self):
+        """Return the name of the segment last saved under ``path``, or None."""
+        try:
+            with open(os.path.join(self.path, "current.json"), "r", encoding="utf-8") as f:
+                return json.load(f)["segment"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def needs_save(self):
+        return bool(self.path) and self.save_every is not None and self.unsaved >= self.save_every
+
+    def outdated(self):
+        """Return True if another process has saved a segment newer than the one loaded."""
+        return bool(self.path) and self._saved_name() != self._segment_name
+
+    def save(self, rows):
+        """Write the live chunks as a new segment under ``path`` and map it in place of the in-memory postings.
+
+        ``rows`` maps chunk ids to their rows in the vector store; it is saved
+        with the segment so ``load`` can tell which chunks changed since.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            started = time.perf_counter()
+            alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            renumber = np.cumsum(alive) - 1
+            terms = list(self._df)
+            term_index = {term: i for i, term in enumerate(terms)}
+            term_parts, slot_parts, tf_parts = [], [], []
+            segment = self._segment
+            if segment is not None:
+                saved_terms = np.array([term_index.get(term, -1) for term in segment.terms], dtype=np.int64)
+                term_parts.append(np.repeat(saved_terms, np.diff(segment.offsets)))
+                slot_parts.append(np.asarray(segment.slots, dtype=np.int64))
+                tf_parts.append(np.asarray(segment.tfs, dtype=np.float32))
+            for term, (slots, tfs) in self._postings.items():
+                if term in term_index:
+                    term_parts.append(np.full(len(slots), term_index[term], dtype=np.int64))
+                    slot_parts.append(np.array(slots, dtype=np.int64))
+                    tf_parts.append(np.array(tfs, dtype=np.float32))
+            term_of = np.concatenate(term_parts) if term_parts else np.zeros(0, dtype=np.int64)
+            slots = np.concatenate(slot_parts) if slot_parts else np.zeros(0, dtype=np.int64)
+            tfs = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.float32)
+            keep = alive[slots] & (term_of >= 0)
+            term_of, slots, tfs = term_of[keep], renumber[slots[keep]], tfs[keep]
+            del term_parts, slot_parts, tf_parts, keep
+
+            ids = [doc_id for doc_id in self._slot_ids if doc_id is not None]
+            by_term = np.argsort(term_of, kind="stable")
+            by_slot = np.argsort(slots, kind="stable")
+            arrays = {
+                "offsets": np.concatenate([[0], np.cumsum(np.bincount(term_of, minlength=len(terms)))]),
+                "slots": slots[by_term].astype(np.int32),
+                "tfs": tfs[by_term],
+                "doc_offsets": np.concatenate([[0], np.cumsum(np.bincount(slots, minlength=len(ids)))]),
+                "doc_terms": term_of[by_slot].astype(np.int32),
+                "df": np.array([self._df[term] for term in terms], dtype=np.int64),
+                "lengths": np.frombuffer(self._lengths, dtype=np.float32)[alive],
+                "rows": np.array([rows.get(doc_id, -1) for doc_id in ids], dtype=np.int64),
+            }
+            name = str(time.time_ns())
+            directory = os.path.join(self.path, name)
+            os.makedirs(directory)
+            for key, value in arrays.items():
+                np.save(os.path.join(directory, f"{key}.npy"), value)
+            with open(os.path.join(directory, "terms.json"), "w", encoding="utf-8") as f:
+                json.dump(terms, f)
+            with open(os.path.join(directory, "ids.json"), "w", encoding="utf-8") as f:
+                json.dump(ids, f)
+            previous = self._saved_name()
+            tmp_path = os.path.join(self.path, "current.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"segment": name}, f)
+            os.replace(tmp_path, os.path.join(self.path, "current.json"))
+            # The segment just replaced is kept for readers that have not switched yet.
+            for entry in os.listdir(self.path):
+                if entry not in (name, previous) and os.path.isdir(os.path.join(self.path, entry)):
+                    shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+            del arrays, term_of, slots, tfs
+            self.load()
+            logger.info(
+                f"Saved lexical index segment with {len(ids)} chunks and {len(terms)} terms "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+
+    def load(self):
+        """Map the segment last saved under ``path`` in place of the current contents.
+
+        Returns {chunk id: vector store row} for the chunks it holds; empty,
+        with an empty index, when nothing was saved or it cannot be read.
+        """
+        with self._lock:
+            self._clear()
+            name = self._saved_name() if self.path else None
+            if name is None:
+                return {}
+            directory = os.path.join(self.path, name)
+            try:
+                segment = _Segment(directory)
+                with open(os.path.join(directory, "ids.json"), "r", encoding="utf-8") as f:
+                    ids = json.load(f)
+                lengths = np.load(os.path.join(directory, "lengths.npy"))
+                df = np.load(os.path.join(directory, "df.npy"))
+                rows = np.load(os.path.join(directory, "rows.npy"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load lexical index segment {directory}, indexing from scratch: {str(e)}")
+                return {}
+            self._segment = segment
+            self._segment_name = name
+            self._saved_slots = len(ids)
+            self._slot_ids = ids
+            self._slots = {doc_id: slot for slot, doc_id in enumerate(ids)}
+            self._slot_terms = [None] * len(ids)
+            self._lengths = array("f", lengths.astype(np.float32).tobytes())
+            self._alive = bytearray(b"\x01" * len(ids))
+            self._df = dict(zip(segment.terms, df.tolist()))
+            self._total_length = int(lengths.sum())
+            self._live = len(ids)
+            return dict(zip(ids, rows.tolist()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunks": self._live,
+                "slots": len(self._slot_ids),
+                "terms": len(self._df),
+                "average_length": round(self._total_length / self._live, 1) if self._live else 0,
+                "saved_slots": self._saved_slots,
+                "unsaved": self.unsaved,
+            }
+
+
+def reciprocal_rank_fusion(rankings, k=4, constant=60):
+    """Merge ranked lists of documents by reciprocal rank, keyed by ``doc.id``; return the top ``k``."""
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (constant + rank + 1)
+            documents.setdefault(doc.id, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[doc_id] for doc_id in best]
+
+
+def retrieval_report(store, queries, k=5, candidates=20):
+    """Compare lexical, vector and hybrid retrieval on ``store``.
+
+    ``queries`` is a list of (kind, query text, relevant chunk id) tuples.
+    Returns one row per mode and query kind with recall@k, mean reciprocal
+    rank, and mean and p95 per-query latency in milliseconds. Vector and
+    hybrid latency include the query embedding call.
+    """
+    def lexical(query):
+        return [doc for doc, _ in store.lexical_search_with_score(query, k)]
+
+    def vector(query):
+        return store.similarity_search_by_vector(store.embedding.embed_query(query), k=k)
+
+    def hybrid(query):
+        fetch = max(k, candidates)
+        vector_docs = store.similarity_search_by_vector(store.embedding.embed_query(query), k=fetch)
+        lexical_docs = [doc for doc, _ in store.lexical_search_with_score(query, fetch)]
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], k)
+
+    report = []
+    for mode, search in (("lexical", lexical), ("vector", vector), ("hybrid", hybrid)):
+        for kind in sorted({kind for kind, _, _ in queries}):
+            latencies, hits, reciprocal_ranks = [], 0, []
+            for query_kind, query, relevant in queries:
+                if query_kind != kind:
+                    continue
+                started = time.perf_counter()
+                ids = [doc.id for doc in search(query)]
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits += relevant in ids
+                reciprocal_ranks.append(1.0 / (ids.index(relevant) + 1) if relevant in ids else 0.0)
+            report.append({
+                "mode": mode,
+                "queries": kind,
+                f"recall@{k}": round(hits / len(latencies), 4),
+                "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+                "mean_ms": round(float(np.mean(latencies)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    import random
+    import argparse
+    from numpy_vector_store import NumpyVectorStore
+
+    parser = argparse.ArgumentParser(
+        description="Compare lexical, vector and hybrid retrieval on a synthetic product catalog."
+    )
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--fake-embeddings", action="store_true",
+        help="use random embeddings instead of OpenAI (latency only; vector quality is meaningless)",
+    )
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        embedding = DeterministicFakeEmbedding(size=256)
+    else:
+        import dotenv
+        from langchain_openai import OpenAIEmbeddings
+        dotenv.load_dotenv()
+        embedding = OpenAIEmbeddings(model="text-embedding-3-large")
+
+    rng = random.Random(0)
+    adjectives = ["stainless", "wireless", "ergonomic", "compact", "heavy-duty", "waterproof", "organic", "portable"]
+    products = ["kettle", "keyboard", "office chair", "drill", "backpack", "tent", "coffee beans", "speaker"]
+    warehouses = ["Leeds", "Austin", "Osaka", "Lyon", "Porto", "Denver"]
+    texts, ids, rows = [], [], []
+    for i in range(args.rows):
+        row = {
+            "sku": f"SKU-{i:06d}",
+            "product": f"{rng.choice(adjectives)} {rng.choice(products)}",
+            "warehouse": rng.choice(warehouses),
+            "price": f"{rng.uniform(5, 500):.2f}",
+        }
+        rows.append(row)
+        ids.append(f"catalog.csv::{i}")
+        texts.append("\n".join(f"{key}: {value}" for key, value in row.items()))
+
+    store = NumpyVectorStore(embedding, lexical=BM25Index())
+    for start in range(0, len(texts), 1000):
+        store.add_texts(texts[start:start + 1000], ids=ids[start:start + 1000])
+
+    queries = []
+    for i in rng.sample(range(args.rows), args.queries):
+        row = rows[i]
+        queries.append(("exact_id", f"What is the price of {row['sku']}?", ids[i]))
+        queries.append((
+            "descriptive",
+            f"Which {row['product']} is stored in {row['warehouse']} for {row['price']}?",
+            ids[i],
+        ))
+    print(json.dumps(retrieval_report(store, queries, k=args.k), indent=2))
@@ -0,0 +1,141 @@
+import numpy as np
+from langchain_core.documents import Document
+
+# tiktoken encodings by model name; False where tiktoken or the model's encoding is unavailable.
+_encodings = {}
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Count ``text`` in ``model``'s tokens, or estimate at four characters per token without tiktoken."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(model)
+        except Exception:
+            encoding = False
+        _encodings[model] = encoding
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def mmr_order(query_vector, vectors, mmr_lambda=0.7):
+    """Order ``vectors`` by maximal marginal relevance to ``query_vector``.
+
+    Each pick maximizes ``mmr_lambda * relevance - (1 - mmr_lambda) * redundancy``,
+    where redundancy is the highest similarity to an already picked vector.
+    ``vectors`` are expected to be L2-normalized; the query need not be.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    relevance = vectors @ (query_vector / (np.linalg.norm(query_vector) or 1.0))
+    similarity = vectors @ vectors.T
+    order = [int(np.argmax(relevance))]
+    redundancy = similarity[order[0]].copy()
+    remaining = set(range(len(vectors))) - set(order)
+    while remaining:
+        candidates = np.array(sorted(remaining))
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy[candidates]
+        pick = int(candidates[np.argmax(scores)])
+        order.append(pick)
+        remaining.discard(pick)
+        redundancy = np.maximum(redundancy, similarity[pick])
+    return order
+
+
+def _parent_key(doc):
+    """Identify the document a chunk was split from: every metadata field except its offset."""
+    return tuple(sorted((name, repr(value)) for name, value in doc.metadata.items() if name != "start_index"))
+
+
+class _Segment:
+    """A contiguous span of one source page built from one or more chunks."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.key = _parent_key(doc)
+        self.text = doc.page_content
+        self.start = doc.metadata.get("start_index")
+        self.tokens = count_tokens(self.text)
+
+    @property
+    def end(self):
+        return None if self.start is None else self.start + len(self.text)
+
+    def merged_text(self, doc, min_overlap=20):
+        """Return the text covering this segment and ``doc``, or None if they are not adjacent."""
+        text, start = doc.page_content, doc.metadata.get("start_index")
+        if start is not None and self.start is not None:
+            end = start + len(text)
+            if start > self.end or end < self.start:
+                return None
+            if start < self.start:
+                left, left_end, right, right_start = text, end, self.text, self.start
+            else:
+                left, left_end, right, right_start = self.text, self.end, text, start
+            return left + right[left_end - right_start:] if right_start + len(right) > left_end else left
+        # Without offsets, fall back to matching the splitter's overlap in the text itself.
+        for left, right in ((self.text, text), (text, self.text)):
+            for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+                if left.endswith(right[:size]):
+                    return left + right[size:]
+        return None
+
+    def absorb(self, doc, text):
+        start = doc.metadata.get("start_index")
+        if start is not None and self.start is not None:
+            self.start = min(self.start, start)
+        self.text = text
+        self.tokens = count_tokens(text)
+
+    def to_document(self):
+        metadata = dict(self.doc.metadata)
+        if self.start is not None:
+            metadata["start_index"] = self.start
+        return Document(id=self.doc.id, page_content=self.text, metadata=metadata)
+
+
+def build_context(docs, token_budget, query_vector=None, vectors=None, mmr_lambda=0.7):
+    """Select, merge and pack retrieved chunks into at most ``token_budget`` tokens of context.
+
+    ``docs`` are in relevance order. Those with an entry in ``vectors`` (chunk
+    id to normalized embedding) are re-ranked by maximal marginal relevance
+    when ``query_vector`` is given; the rest, such as SQL results, keep their
+    place in front. Chunks that overlap or touch a chunk already chosen from
+    the same page (same metadata apart from ``start_index``) are merged into it, so the splitter's overlap is
+    sent once. Chunks that do not fit the remaining budget are skipped.
+    Returns the packed documents and their total token count.
+    """
+    vectors = vectors or {}
+    pinned = [doc for doc in docs if doc.id not in vectors]
+    ranked = [doc for doc in docs if doc.id in vectors]
+    if query_vector is not None and len(ranked) > 1:
+        ranked = [ranked[i] for i in mmr_order(query_vector, [vectors[doc.id] for doc in ranked], mmr_lambda)]
+
+    segments = []
+    total = 0
+    for doc in pinned + ranked:
+        key = _parent_key(doc)
+        merged = False
+        for segment in segments:
+            if segment.key != key:
+                continue
+            text = segment.merged_text(doc)
+            if text is None:
+                continue
+            added = count_tokens(text) - segment.tokens
+            if total + added <= token_budget:
+                segment.absorb(doc, text)
+                total += added
+            merged = True
+            break
+        if merged:
+            continue
+        tokens = count_tokens(doc.page_content)
+        if total + tokens <= token_budget or not segments:
+            segments.append(_Segment(doc))
+            total += tokens
+    return [segment.to_document() for segment in segments], total
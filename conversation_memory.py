@@ -0,0 +1,251 @@
+import os
+import re
+import logging
+import json
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from collections import OrderedDict
+
+from context_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Expired conversations are deleted from disk at most this often.
+_PURGE_INTERVAL = 60
+# Words and openings that lean on earlier turns ("what about 2023?", "and their totals?").
+_REFERRING_WORDS = re.compile(
+    r"\b(it|its|they|them|their|theirs|these|those|this|he|him|his|she|her|hers|there|then|same"
+    r"|above|previous|former|latter|else|another|others)\b|\.\.\.|\u2026",
+    re.IGNORECASE,
+)
+_CONTINUATIONS = re.compile(r"^\W*(and|or|but|also|so|what about|how about|why|how come)\b", re.IGNORECASE)
+
+
+def truncate_tokens(text, max_tokens, keep="start"):
+    """Shorten ``text`` to at most ``max_tokens`` tokens, keeping its start or its end."""
+    while text and count_tokens(text) > max_tokens:
+        size = int(len(text) * max_tokens / count_tokens(text) * 0.9)
+        text = text[:size] if keep == "start" else text[len(text) - size:]
+    return text
+
+
+def is_follow_up(question):
+    """Return True if ``question`` probably needs the conversation to be understood.
+
+    Short questions, ones that open like a continuation, and ones with
+    pronouns or an ellipsis count; a question that names what it is about
+    does not need rewriting.
+    """
+    return (
+        len(question.split()) <= 3
+        or bool(_CONTINUATIONS.search(question))
+        or bool(_REFERRING_WORDS.search(question))
+    )
+
+
+def format_turns(turns):
+    return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def extractive_summary(summary, turns, max_tokens):
+    """Fold ``turns`` into ``summary`` without a model: each question with the first line of its answer."""
+    lines = [summary] if summary else []
+    for question, answer in turns:
+        first_line = answer.strip().split("\n", 1)[0]
+        lines.append(f"User asked: {question} Answer: {truncate_tokens(first_line, max(1, max_tokens // 4))}")
+    return truncate_tokens("\n".join(lines), max_tokens, keep="end")
+
+
+class ConversationMemory:
+    """Per-thread conversation history with bounded memory and a bounded prompt footprint.
+
+    Each thread keeps a running summary and its most recent turns. Once both
+    together exceed ``token_budget`` tokens, the oldest turns are folded into
+    the summary by ``summarize(summary, turns, max_tokens)`` (extractive when
+    not given, or when it fails). Folding runs on background threads, so a
+    model-written summary never delays an answer; until it lands, the
+    oldest unfolded turns are left out of the history, which therefore stays
+    within the budget however long a conversation runs. At most
+    ``max_threads`` threads are held in memory, least recently used first out,
+    and threads idle for longer than ``ttl`` seconds are forgotten.
+
+    With ``path`` every thread is also written through to SQLite: threads
+    evicted from memory are read back on their next turn, and server
+    processes sharing the file see each other's turns.
+    """
+
+    def __init__(self, max_threads=1000, ttl=86400, token_budget=800, path=None, summarize=None, compaction_workers=2):
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.path = path
+        self.summarize = summarize
+        self.compactions = 0
+        self.evictions = 0
+        self._threads = OrderedDict()
+        self._compacting = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=compaction_workers, thread_name_prefix="conversation-compaction"
+        )
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last_purge = 0.0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " thread_id TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _expired(self, updated_at):
+        return self.ttl is not None and self.ttl > 0 and time.time() - updated_at > self.ttl
+
+    def _load(self, thread_id):
+        """Return a thread's state from memory or disk, or None. Callers hold the lock."""
+        state = self._threads.get(thread_id)
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT state, updated_at FROM conversations WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            # Another process may have answered a later turn of this thread.
+            if row and (state is None or row[1] > state["updated_at"]):
+                state = json.loads(row[0])
+        if state is None:
+            return None
+        if self._expired(state["updated_at"]):
+            self._drop(thread_id)
+            return None
+        self._threads[thread_id] = state
+        self._threads.move_to_end(thread_id)
+        return state
+
+    def _store(self, thread_id, state):
+        """Keep a thread's state in memory and on disk, evicting the least recently used. Callers hold the lock."""
+        self._threads[thread_id] = state
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+            self.evictions += 1
+        if self._conn is not None:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (thread_id, state, updated_at) VALUES (?, ?, ?)",
+                (thread_id, json.dumps(state), state["updated_at"]),
+            )
+            if self.ttl and time.time() - self._last_purge > _PURGE_INTERVAL:
+                self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (time.time() - self.ttl,))
+                self._last_purge = time.time()
+            self._conn.commit()
+
+    def _drop(self, thread_id):
+        self._threads.pop(thread_id, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM conversations WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+
+    def get(self, thread_id):
+        """Return (summary, recent turns as (question, answer) pairs) for a thread; empty if unknown."""
+        if not thread_id:
+            return "", []
+        with self._lock:
+            state = self._load(thread_id)
+            if state is None:
+                return "", []
+            summary, turns = state["summary"], [tuple(turn) for turn in state["turns"]]
+        # Turns waiting to be folded into the summary do not count against the budget meanwhile.
+        while len(turns) > 1 and count_tokens(summary) + count_tokens(format_turns(turns)) > self.token_budget:
+            turns = turns[1:]
+        return summary, turns
+
+    def history(self, thread_id):
+        """Return a thread's history as prompt text, at most ``token_budget`` tokens; empty if unknown."""
+        summary, turns = self.get(thread_id)
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}")
+        if turns:
+            parts.append(format_turns(turns))
+        return "\n\n".join(parts)
+
+    def append(self, thread_id, question, answer):
+        """Record a turn, and start compacting the thread if it no longer fits the token budget."""
+        if not thread_id:
+            return
+        # A single turn never takes more than half the budget, so the most recent one always fits.
+        answer = truncate_tokens(answer, max(1, self.token_budget // 2 - count_tokens(question)))
+        with self._lock:
+            state = self._load(thread_id) or {"summary": "", "turns": []}
+            state["turns"].append([question, answer])
+            state["updated_at"] = time.time()
+            self._store(thread_id, state)
+            if thread_id in self._compacting or self._tokens(state) <= self.token_budget:
+                return
+            folded = self._turns_to_fold(state)
+            summary = state["summary"]
+            self._compacting.add(thread_id)
+        self._executor.submit(self._compact, thread_id, summary, folded)
+
+    def _compact(self, thread_id, summary, folded):
+        """Replace the ``folded`` oldest turns of a thread with a summary that includes them."""
+        try:
+            new_summary = self._summarize(summary, folded)
+            with self._lock:
+                state = self._load(thread_id)
+                if state is not None:
+                    state["summary"] = new_summary
+                    state["turns"] = state["turns"][len(folded):]
+                    state["updated_at"] = time.time()
+                    self._store(thread_id, state)
+                    self.compactions += 1
+        finally:
+            with self._lock:
+                self._compacting.discard(thread_id)
+
+    def _tokens(self, state):
+        return count_tokens(state["summary"]) + count_tokens(format_turns(state["turns"]))
+
+    def _turns_to_fold(self, state):
+        """Return the oldest turns to summarize so the remaining ones take at most half the budget."""
+        turns = state["turns"]
+        folded = 0
+        while folded < len(turns) - 1 and count_tokens(format_turns(turns[folded:])) > self.token_budget // 2:
+            folded += 1
+        return [tuple(turn) for turn in turns[: max(folded, 1)]]
+
+    def _summarize(self, summary, turns):
+        max_tokens = self.token_budget // 2
+        if self.summarize is not None:
+            try:
+                return truncate_tokens(self.summarize(summary, turns, max_tokens).strip(), max_tokens, keep="end")
+            except Exception as e:
+                logger.warning(f"Could not summarize conversation, keeping an extractive summary: {str(e)}")
+        return extractive_summary(summary, turns, max_tokens)
+
+    def clear(self, thread_id):
+        """Forget a thread."""
+        with self._lock:
+            self._drop(thread_id)
+
+    def stats(self):
+        with self._lock:
+            stored = None
+            if self._conn is not None:
+                stored = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            return {
+                "threads_in_memory": len(self._threads),
+                "threads_on_disk": stored,
+                "max_threads": self.max_threads,
+                "ttl": self.ttl,
+                "token_budget": self.token_budget,
+                "compactions": self.compactions,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,155 @@
+import os
+import logging
+import json
+import hashlib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _pack_chunk_ids(name, chunk_ids):
+    """Return (n, other ids) such that ``chunk_ids`` is ``name::0`` .. ``name::n-1`` followed by the other ids."""
+    count = 0
+    while count < len(chunk_ids) and chunk_ids[count] == f"{name}::{count}":
+        count += 1
+    return count, list(chunk_ids[count:])
+
+
+def _pack(name, entry):
+    """Return a copy of a catalog entry with its chunk ids replaced by the packed form."""
+    entry = dict(entry)
+    if "chunk_ids" in entry:
+        entry["chunks"], entry["extra_chunk_ids"] = _pack_chunk_ids(name, entry.pop("chunk_ids"))
+    return entry
+
+
+def _unpack(name, entry):
+    entry = dict(entry)
+    entry["chunk_ids"] = [f"{name}::{i}" for i in range(entry.pop("chunks", 0))] + entry.pop("extra_chunk_ids", [])
+    return entry
+
+
+def file_hash(path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCatalog:
+    """Persistent record of every indexed document and the chunks it produced.
+
+    Entries are keyed by the document's path relative to the docs directory and
+    hold the file hash, mtime, size, file type and the ids of its chunks in the
+    vector store, so a single file can be added or evicted without touching the
+    rest of the corpus. Chunk ids of the form ``name::0`` to ``name::n-1`` are
+    stored as their count ``n``; only other ids, such as those of OCR chunks,
+    are stored as they are.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._entries = {}
+        self.load()
+
+    def load(self):
+        with self._lock:
+            self._entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        entries = json.load(f).get("documents", {})
+                    # Catalogs written before chunk ids were packed list every id.
+                    self._entries = {name: _pack(name, entry) for name, entry in entries.items()}
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not read document catalog {self.path}: {str(e)}")
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"documents": self._entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+
+    def names(self):
+        with self._lock:
+            return sorted(self._entries)
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return _unpack(name, entry) if entry else None
+
+    def entries(self):
+        with self._lock:
+            return {name: _unpack(name, entry) for name, entry in self._entries.items()}
+
+    def is_current(self, name, path):
+        """Return True if the catalog entry for ``name`` still matches the file on disk."""
+        entry = self.get(name)
+        if not entry or not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            return True
+        return entry.get("hash") == file_hash(path)
+
+    def upsert(self, name, path, file_type, chunk_ids, digest=None):
+        stat = os.stat(path)
+        chunk_ids = list(chunk_ids)
+        entry = {
+            "hash": digest or file_hash(path),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "file_type": file_type,
+            "chunk_ids": chunk_ids,
+            "chunk_count": len(chunk_ids),
+            "indexed_at": time.time(),
+        }
+        with self._lock:
+            self._entries[name] = _pack(name, entry)
+            self.save()
+        return entry
+
+    def put(self, name, entry):
+        """Store an entry as returned by ``get``, e.g. one copied from another catalog."""
+        with self._lock:
+            self._entries[name] = _pack(name, entry)
+            self.save()
+
+    def replace(self, entries):
+        """Replace every entry with ``entries``, a mapping as returned by ``entries``."""
+        with self._lock:
+            self._entries = {name: _pack(name, entry) for name, entry in entries.items()}
+            self.save()
+
+    def set_chunk_ids(self, name, chunk_ids):
+        """Replace the chunk ids recorded for an existing entry."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            chunk_ids = list(chunk_ids)
+            entry["chunks"], entry["extra_chunk_ids"] = _pack_chunk_ids(name, chunk_ids)
+            entry["chunk_count"] = len(chunk_ids)
+            self.save()
+            return _unpack(name, entry)
+
+    def remove(self, name):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.save()
+            return _unpack(name, entry) if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self.save()
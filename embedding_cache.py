@@ -0,0 +1,153 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Disk-backed, content-addressed cache in front of an embeddings model.
+
+    Vectors are stored as float32 blobs in SQLite, keyed by the model name plus
+    the SHA-256 of the text, so a chunk that has been embedded once is never sent
+    to the model again, across restarts, resets, and re-uploads. The cache holds
+    at most ``max_entries`` vectors and evicts the least recently used ones.
+    """
+
+    def __init__(self, underlying, path, max_entries=500000, model_name=None):
+        self.underlying = underlying
+        self.path = path
+        self.max_entries = max_entries
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    def _key(self, text):
+        return f"{self.model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        # SQLite limits the number of bound parameters per statement.
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            found.update((key, _unpack(blob)) for key, blob in rows)
+        return found
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        now = time.time()
+        with self._lock:
+            self.hits += sum(1 for key in keys if key in cached)
+            self.misses += len(keys) - sum(1 for key in keys if key in cached)
+            if cached:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in cached],
+                )
+                self._conn.commit()
+
+        fresh = {}
+        if missing:
+            if getattr(self.underlying, "supports_batch_callback", False):
+                # Store each batch as soon as it completes so a failure part way
+                # through keeps the finished batches and a retry resumes after them.
+                def on_batch(batch, vectors):
+                    self._store({self._key(text): vector for text, vector in zip(batch, vectors)})
+
+                vectors = self.underlying.embed_documents(list(missing.values()), on_batch=on_batch)
+                fresh = dict(zip(missing.keys(), vectors))
+            else:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+                fresh = dict(zip(missing.keys(), vectors))
+                self._store(fresh)
+
+        return [cached[key] if key in cached else fresh[key] for key in keys]
+
+    def _store(self, vectors):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, _pack(vector), now) for key, vector in vectors.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def embed_query(self, text: str, deadline=None) -> List[float]:
+        if deadline is not None and getattr(self.underlying, "supports_batch_callback", False):
+            return self.underlying.embed_query(text, deadline=deadline)
+        return self.underlying.embed_query(text)
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
@@ -0,0 +1,199 @@
+import logging
+import time
+import random
+import threading
+import concurrent.futures
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import span
+from context_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error):
+    """Return True for HTTP 429 / rate-limit errors from the OpenAI client or a compatible server."""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _AdaptiveLimit:
+    """Concurrency limit that halves on rate limiting and grows back by one per success."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def throttle(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+    def succeed(self):
+        with self._condition:
+            self._successes += 1
+            if self.limit < self.maximum and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+
+class EmbeddingPipeline(Embeddings):
+    """Batched, concurrent, rate-limit-aware front end for an embeddings model.
+
+    Texts are packed into batches of at most ``max_batch_tokens`` tokens and
+    ``max_batch_size`` inputs, and up to ``concurrency`` batches are in flight
+    at once. A rate-limited batch is retried with exponential backoff (or the
+    server's Retry-After), and the number of concurrent requests is halved
+    until requests succeed again. ``on_batch`` callbacks receive each batch as
+    soon as it completes, so a caller such as the embedding cache can keep
+    finished work when a later batch fails and resume from there.
+    """
+
+    supports_batch_callback = True
+
+    def __init__(
+        self,
+        underlying,
+        max_batch_tokens=100000,
+        max_batch_size=512,
+        concurrency=4,
+        max_retries=8,
+        initial_backoff=1.0,
+        max_backoff=60.0,
+        model_name=None,
+    ):
+        self.underlying = underlying
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.model = model_name or getattr(underlying, "model", None)
+        self._limit = _AdaptiveLimit(concurrency)
+        self._stats_lock = threading.Lock()
+        self.chunks_embedded = 0
+        self.batches = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.seconds = 0.0
+
+    def make_batches(self, texts):
+        """Split ``texts`` into (start, batch, tokens) triples that respect the token and size budgets."""
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            count = count_tokens(text, self.model or "text-embedding-3-large")
+            if i > start and (tokens + count > self.max_batch_tokens or i - start >= self.max_batch_size):
+                batches.append((start, texts[start:i], tokens))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(texts):
+            batches.append((start, texts[start:], tokens))
+        return batches
+
+    def _with_backoff(self, call, what, deadline=None):
+        """Return ``call()``, retrying rate-limited calls with exponential backoff (or the server's Retry-After).
+
+        With a ``deadline`` the error is raised instead of sleeping past it.
+        """
+        attempt = 0
+        while True:
+            try:
+                result = call()
+                self._limit.succeed()
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                self._limit.throttle()
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(self.max_backoff, self.initial_backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+                if deadline is not None and deadline.remaining() is not None and delay >= deadline.remaining():
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                    self.rate_limited += 1
+                logger.warning(f"{what} rate limited, retrying in {delay:.1f}s (concurrency {self._limit.limit})")
+                time.sleep(delay)
+                attempt += 1
+
+    def _embed_batch(self, batch, tokens):
+        def call():
+            with self._limit, span("embed_batch", chunks=len(batch), tokens=tokens):
+                return self.underlying.embed_documents(batch)
+
+        return self._with_backoff(call, "Embedding batch")
+
+    def embed_documents(self, texts: List[str], on_batch=None) -> List[List[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+        started = time.perf_counter()
+        batches = self.make_batches(texts)
+        vectors = [None] * len(texts)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                executor.submit(self._embed_batch, batch, tokens): (start, batch) for start, batch, tokens in batches
+            }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    start, batch = futures[future]
+                    result = future.result()
+                    vectors[start:start + len(batch)] = result
+                    if on_batch:
+                        on_batch(batch, result)
+                    with self._stats_lock:
+                        self.chunks_embedded += len(batch)
+                        self.batches += 1
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                with self._stats_lock:
+                    self.seconds += time.perf_counter() - started
+        return vectors
+
+    def embed_query(self, text: str, deadline=None) -> List[float]:
+        """Embed a query, retrying rate limits only while the request's ``deadline`` (a ``query_pool.Deadline``) allows."""
+        # Queries do not wait for a slot behind indexing batches, but a rate
+        # limit they hit still throttles those batches.
+        return self._with_backoff(lambda: self.underlying.embed_query(text), "Query embedding", deadline)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "chunks_embedded": self.chunks_embedded,
+                "batches": self.batches,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "concurrency_limit": self._limit.limit,
+                "chunks_per_second": round(self.chunks_embedded / self.seconds, 2) if self.seconds else None,
+            }
@@ -8,7 +8,7 @@ function App() {
   const [documents, setDocuments] = useState([]);
   const [loading, setLoading] = useState(false);
   const [threadId, setThreadId] = useState(null);
-  const [timeout, setTimeout] = useState(30); // Default timeout of 30 seconds
+  const [queryTimeout, setQueryTimeout] = useState(30); // Default timeout of 30 seconds
   const [showSettings, setShowSettings] = useState(false);
   const fileInputRef = useRef(null);
   const chatContainerRef = useRef(null);
@@ -126,13 +126,11 @@ function App() {
     }
     
     try {
-      // Add timeout parameter if enabled
-      const queryWithTimeout = timeout > 0 ? `${currentMessage} timeout=${timeout}` : currentMessage;
-      
+      // A timeout of 0 means no limit
       const response = await fetch('/api/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: queryWithTimeout })
+        body: JSON.stringify({ message: currentMessage, thread_id: threadId, timeout: queryTimeout })
       });
       
       const data = await response.json();
@@ -152,7 +150,11 @@ function App() {
 
   const handleClearChat = async () => {
     try {
-      await fetch('/api/chat/clear', { method: 'POST' });
+      await fetch('/api/chat/clear', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ thread_id: threadId })
+      });
       setChatHistory([]);
     } catch (error) {
       console.error('Error clearing chat:', error);
@@ -177,6 +179,18 @@ function App() {
       const data = await response.json();
       
       if (data.success) {
+        // Wait for the background ingestion job to finish
+        let job = data.job;
+        while (job && (job.state === 'queued' || job.state === 'running')) {
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          const jobResponse = await fetch(`/api/jobs/${job.id}`);
+          job = await jobResponse.json();
+        }
+        if (job && job.state === 'failed') {
+          alert(`Error processing ${file.name}: ${job.error}`);
+          return;
+        }
+        
         // Refresh document list
         const docsResponse = await fetch('/api/documents');
         const docsData = await docsResponse.json();
@@ -303,15 +317,15 @@ function App() {
               min="0"
               max="120"
               step="5"
-              value={timeout}
-              onChange={(e) => setTimeout(parseInt(e.target.value))}
+              value={queryTimeout}
+              onChange={(e) => setQueryTimeout(parseInt(e.target.value))}
             />
-            <span className="setting-value">{timeout === 0 ? 'No limit' : `${timeout}s`}</span>
+            <span className="setting-value">{queryTimeout === 0 ? 'No limit' : `${queryTimeout}s`}</span>
           </div>
           <p className="setting-description">
-            {timeout === 0 
+            {queryTimeout === 0 
               ? 'No timeout limit - responses may take longer for complex queries.' 
-              : `If response takes longer than ${timeout} seconds, processing will stop.`}
+              : `If response takes longer than ${queryTimeout} seconds, processing will stop.`}
           </p>
         </div>
       </div>
@@ -0,0 +1,16 @@
+import os
+
+# Several workers share one index: the first to start writes it, the others
+# map its snapshot read-only and follow its updates (see rag_service._watch_index).
+bind = os.environ.get("BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("WEB_WORKERS", "4"))
+threads = int(os.environ.get("WEB_THREADS", "8"))
+# Streamed answers and long uploads outlive gunicorn's default 30 second timeout.
+timeout = int(os.environ.get("WEB_TIMEOUT", "300"))
+
+
+def post_worker_init(worker):
+    import rag_service
+    # Without a snapshot to load, the first build can outlast ``timeout``; run it
+    # off the worker's boot so the worker answers (from an empty index) meanwhile.
+    rag_service.initialize_system(background=True)
@@ -0,0 +1,99 @@
+import logging
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class IndexManager:
+    """Builds new index snapshots off to the side and coalesces concurrent rebuild requests.
+
+    ``build`` constructs a complete snapshot without touching the one being
+    served, and ``publish`` swaps it in with a single reference assignment, so
+    queries never wait on or observe a half-built index. Rebuilds run on one
+    background thread; requests that arrive while a rebuild is running are
+    served together by the next one. ``lock``, if given, is held only while
+    publishing, so other index writers keep going during the build; ``publish``
+    brings what they changed meanwhile into the new snapshot. Readers never
+    take it.
+    """
+
+    def __init__(self, build, publish, lock=None):
+        self.build = build
+        self.publish = publish
+        self.lock = lock
+        self.rebuilds = 0
+        self.coalesced = 0
+        self.last_duration = None
+        self.last_error = None
+        self._condition = threading.Condition()
+        self._requested = 0
+        self._completed = 0
+        self._running = False
+        self._errors = {}
+
+    def rebuild(self, wait=True, timeout=None):
+        """Request a rebuild. With ``wait``, block until a rebuild started after this request finishes.
+
+        Returns None on success (or when not waiting) and the error message if
+        the rebuild failed.
+        """
+        with self._condition:
+            self._requested += 1
+            ticket = self._requested
+            if self._running:
+                self.coalesced += 1
+            else:
+                self._running = True
+                threading.Thread(target=self._run, daemon=True).start()
+            if not wait:
+                return None
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._completed < ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return "Timed out waiting for index rebuild"
+                self._condition.wait(remaining)
+            return next((error for done, error in self._errors.items() if done >= ticket), None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                target = self._requested
+            started = time.perf_counter()
+            error = None
+            try:
+                built = self.build()
+                if self.lock is not None:
+                    with self.lock:
+                        self.publish(built)
+                else:
+                    self.publish(built)
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Index rebuild failed: {error}")
+            with self._condition:
+                self.rebuilds += 1
+                self.last_duration = time.perf_counter() - started
+                self.last_error = error
+                self._errors = {target: error} if error else {}
+                self._completed = target
+                self._condition.notify_all()
+                if self._requested == target:
+                    self._running = False
+                    return
+
+    @property
+    def rebuilding(self):
+        with self._condition:
+            return self._running
+
+    def stats(self):
+        with self._condition:
+            return {
+                "rebuilding": self._running,
+                "rebuilds": self.rebuilds,
+                "coalesced_requests": self.coalesced,
+                "last_duration_seconds": round(self.last_duration, 3) if self.last_duration is not None else None,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,208 @@
+import os
+import logging
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "running")
+
+_COLUMNS = (
+    "id", "document", "path", "digest", "state", "documents_done", "chunks_done",
+    "error", "created_at", "started_at", "finished_at",
+)
+
+
+class IngestionJobQueue:
+    """Persistent queue of document ingestion jobs run by a bounded pool of worker threads.
+
+    Jobs are stored in SQLite, so jobs that were queued or running when the
+    server stopped are picked up again on the next start. Submitting a file
+    that an active job will already ingest returns that job instead of
+    queueing a duplicate, and jobs for the same document never run
+    concurrently.
+
+    Several processes may share the database: any of them can submit jobs,
+    and the one that called ``start`` with a ``poll_interval`` also picks up
+    the jobs the others queued.
+    """
+
+    def __init__(self, path, handler, workers=2):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._enqueued = set()
+        self._document_locks = {}
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " document TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " documents_done INTEGER NOT NULL DEFAULT 0,"
+            " chunks_done INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL)"
+        )
+        self._conn.commit()
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def _row(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def start(self, poll_interval=None):
+        """Start the workers and re-queue jobs left unfinished by a previous run. Idempotent.
+
+        With ``poll_interval`` (seconds), jobs submitted by other processes are
+        picked up from the database that often.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._conn.execute("UPDATE jobs SET state = 'queued', started_at = NULL WHERE state = 'running'")
+            self._conn.commit()
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if poll_interval:
+                thread = threading.Thread(target=self._poll, args=(poll_interval,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        pending = self._enqueue_pending()
+        if pending:
+            logger.info(f"Resuming {pending} unfinished ingestion jobs")
+
+    def _enqueue_pending(self):
+        """Hand queued jobs that no worker has been given yet to the workers; return how many."""
+        with self._lock:
+            pending = [
+                job_id for (job_id,) in self._conn.execute(
+                    "SELECT id FROM jobs WHERE state = 'queued' ORDER BY created_at"
+                )
+                if job_id not in self._enqueued
+            ]
+            self._enqueued.update(pending)
+        for job_id in pending:
+            self._queue.put(job_id)
+        return len(pending)
+
+    def _poll(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self._enqueue_pending()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not poll for ingestion jobs: {str(e)}")
+
+    def submit(self, document, path, digest=None):
+        """Queue a file for ingestion and return its job, or the active job that will already ingest it.
+
+        A queued job reads the file only when it runs, so it covers any new
+        submission for its document; a running one only covers a submission
+        whose content ``digest`` it was given. Without a digest the job
+        records the one its handler returns. The job runs in this process if
+        its workers are started, else in the process polling the same database.
+        """
+        covered = "state = 'queued'" + (" OR (state = 'running' AND digest = ?)" if digest else "")
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id FROM jobs WHERE document = ? AND ({covered}) ORDER BY created_at LIMIT 1",
+                (document, digest) if digest else (document,),
+            ).fetchone()
+            if row:
+                job_id = row[0]
+            else:
+                job_id = str(uuid.uuid4())
+                self._conn.execute(
+                    "INSERT INTO jobs (id, document, path, digest, state, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                    (job_id, document, path, digest or "", time.time()),
+                )
+                self._conn.commit()
+                if self._threads:
+                    self._enqueued.add(job_id)
+                    self._queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Return a job's state, progress, and throughput, or None if it does not exist."""
+        job = self._row(job_id)
+        if job is None:
+            return None
+        elapsed = None
+        if job["started_at"]:
+            elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+        job["elapsed_seconds"] = round(elapsed, 3) if elapsed is not None else None
+        job["chunks_per_second"] = round(job["chunks_done"] / elapsed, 2) if elapsed else None
+        del job["path"]
+        return job
+
+    def list(self, limit=50):
+        with self._lock:
+            ids = [job_id for (job_id,) in self._conn.execute(
+                "SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            )]
+        return [self.get(job_id) for job_id in ids]
+
+    def _document_lock(self, document):
+        with self._lock:
+            return self._document_locks.setdefault(document, threading.Lock())
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                with self._lock:
+                    self._enqueued.discard(job_id)
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self._row(job_id)
+        if job is None or job["state"] != "queued":
+            return
+        with self._document_lock(job["document"]):
+            with self._lock:
+                claimed = self._conn.execute(
+                    "UPDATE jobs SET state = 'running', started_at = ?, documents_done = 0, chunks_done = 0"
+                    " WHERE id = ? AND state = 'queued'",
+                    (time.time(), job_id),
+                ).rowcount
+                self._conn.commit()
+            if not claimed:
+                return
+
+            def progress(documents_done, chunks_done):
+                self._update(job_id, documents_done=documents_done, chunks_done=chunks_done)
+
+            try:
+                digest = self.handler(job, progress)
+                self._update(job_id, state="succeeded", finished_at=time.time(), digest=digest or job["digest"])
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} for {job['document']} failed: {str(e)}")
+                self._update(job_id, state="failed", error=str(e), finished_at=time.time())
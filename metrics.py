@@ -0,0 +1,184 @@
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus-style histogram with one series per combination of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback each time the metrics are rendered."""
+
+    def __init__(self, name, help, read, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, kind="gauge"):
+        """Register a gauge (or, with ``kind="counter"``, a monotonic counter) read from ``read()``."""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, read, kind)
+            return self._metrics[name]
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "genie_stage_duration_seconds", "Time spent in each ingest and query stage.", labels=("stage", "status")
+)
+STAGE_SIZE = REGISTRY.histogram(
+    "genie_stage_size", "Bytes, chunks, tokens and other counts handled per stage call.",
+    labels=("stage", "unit"), buckets=SIZE_BUCKETS,
+)
+
+
+class Span:
+    """A timed stage. ``counts`` are numeric sizes such as bytes, chunks or tokens."""
+
+    def __init__(self, stage, counts=None):
+        self.stage = stage
+        self.counts = dict(counts or {})
+
+    def set(self, **counts):
+        self.counts.update(counts)
+
+
+def record(stage, seconds, error=False, **counts):
+    """Record a stage that has already been timed, e.g. in another process."""
+    STAGE_SECONDS.observe(seconds, stage=stage, status="error" if error else "ok")
+    for unit, value in counts.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            STAGE_SIZE.observe(value, stage=stage, unit=unit)
+    trace = _current_trace.get()
+    if trace is not None:
+        entry = {"stage": stage, "ms": round(seconds * 1000, 2), **counts}
+        if error:
+            entry["error"] = True
+        with trace.lock:
+            trace.spans.append(entry)
+
+
+@contextmanager
+def span(stage, **counts):
+    """Time the enclosed block as ``stage``; counts may be added to the yielded Span with ``set``."""
+    current = Span(stage, counts)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, error, **current.counts)
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        with self.lock:
+            return {"trace_id": self.trace_id, "spans": list(self.spans)}
+
+
+@contextmanager
+def trace(trace_id=None):
+    """Collect the spans recorded in this context (including work it hands to the query pool) into a Trace."""
+    current = Trace(trace_id)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
@@ -0,0 +1,660 @@
+import os
+import logging
+import json
+import uuid
+import sqlite3
+import threading
+from collections import namedtuple
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Quantized rows are dequantized in blocks of roughly this many bytes so that
+# scoring never materializes a float32 copy of the whole matrix.
+_SCORE_BLOCK_BYTES = 64 * 1024 * 1024
+# Ids per SQLite ``IN (...)`` lookup, below SQLite's bound-parameter limit.
+_SQL_BATCH = 500
+
+# The rows a search reads, captured under the store's lock and scored without it.
+_View = namedtuple("_View", "count matrix scales alive row_ids")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store that keeps every embedding in one contiguous NumPy matrix.
+
+    Vectors are L2-normalized on insert, so the cosine similarity of a query
+    against the whole corpus is a single matrix-vector product, and the top k
+    rows are picked with ``argpartition``. Rows can be stored as float32, or
+    quantized to float16 or int8 (with a per-row scale) to cut memory 2-4x
+    further. When ``path`` is given the matrix is a memory-mapped ``.npy`` file
+    and chunk text and metadata live in a SQLite table next to it, read on
+    demand, so the store survives restarts and only the pages that are
+    touched stay resident. Deleted rows are tombstoned and compacted away once
+    they outnumber live ones.
+
+    With ``read_only`` the files are opened by a process that only searches
+    them, such as one of several server workers: the matrix is mapped
+    read-only and shared with every other process through the page cache,
+    and ``refresh`` picks up what the writing process has changed since.
+    Only the id-to-row mapping and the chunks the lexical index has not
+    saved yet are held per process.
+
+    An optional ``ann`` index (see ``ann_index.IVFIndex``) restricts scoring to
+    a subset of candidate rows once the corpus is large enough, and an optional
+    ``lexical`` index (see ``bm25_index.BM25Index``) is kept in step with the
+    stored chunks for keyword search. A lexical index with a path is saved
+    next to the vectors every ``save_every`` added chunks and on compaction,
+    and loaded back on start, so only the chunks changed since are tokenized;
+    the ``ann`` index is saved and loaded the same way.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        path: Optional[str] = None,
+        dtype: str = "float32",
+        ann=None,
+        lexical=None,
+        read_only: bool = False,
+    ):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+        if read_only and not path:
+            raise ValueError("A read-only vector store needs a path")
+        self.embedding = embedding
+        self.path = path
+        self.dtype = dtype
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._dim = None
+        self._count = 0
+        self._matrix = None
+        self._scales = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_ids = []
+        self._rows = {}
+        self._docs = {}
+        self._conn = None
+        self._readers = threading.local()
+        self.ann = ann
+        self.lexical = lexical
+
+        if path:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self._conn = self._connect()
+            if not read_only:
+                # WAL lets read-only processes keep reading while this one commits.
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS documents ("
+                    " row INTEGER PRIMARY KEY,"
+                    " id TEXT UNIQUE NOT NULL,"
+                    " content TEXT NOT NULL,"
+                    " metadata TEXT NOT NULL)"
+                )
+                self._conn.commit()
+            self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    # Storage
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _connect(self):
+        return sqlite3.connect(self._file("documents.sqlite3"), check_same_thread=False, timeout=30)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"Vector store at {self.path} is read-only")
+
+    def _read_meta(self):
+        meta_path = self._file("meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _map(self, name):
+        return np.load(self._file(name), mmap_mode="r" if self.read_only else "r+")
+
+    def _read_rows(self, conn, count):
+        """Return {id: row} for the rows below ``count`` recorded in the documents table."""
+        return {doc_id: row for row, doc_id in conn.execute("SELECT row, id FROM documents WHERE row < ?", (count,))}
+
+    def _index_lexical(self, conn, ids):
+        """Add the text of the given stored ids to the lexical index."""
+        ids = list(ids)
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            rows = conn.execute(
+                f"SELECT id, content FROM documents WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+            self.lexical.add([doc_id for doc_id, _ in rows], [content for _, content in rows])
+
+    def _sync_lexical(self, conn, rows):
+        """Load the saved lexical index and bring it in line with ``rows``, {id: row}, by indexing only what changed."""
+        saved = self.lexical.load()
+        self.lexical.remove([doc_id for doc_id, row in saved.items() if rows.get(doc_id) != row])
+        self._index_lexical(conn, [doc_id for doc_id, row in rows.items() if saved.get(doc_id) != row])
+
+    def save_lexical(self):
+        """Save the lexical index, with the rows it was built from, so the next start maps it instead of rebuilding it."""
+        if self.lexical is None or self.read_only:
+            return
+        with self._lock:
+            rows = dict(self._rows)
+        self.lexical.save(rows)
+
+    def save_ann(self):
+        """Save the ``ann`` index's cell assignments, so the next start only assigns the rows added since."""
+        if self.ann is None or self.read_only:
+            return
+        with self._lock:
+            self.ann.save()
+
+    def _set_rows(self, rows, count, capacity):
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._row_ids = [None] * count
+        for doc_id, row in rows.items():
+            self._alive[row] = True
+            self._row_ids[row] = doc_id
+        self._rows = rows
+
+    def _load(self):
+        meta = self._read_meta()
+        if meta is None:
+            return
+        if meta.get("dtype") != self.dtype:
+            if self.read_only:
+                raise ValueError(f"Vector store at {self.path} uses {meta.get('dtype')}, not {self.dtype}")
+            logger.warning(f"Vector store at {self.path} uses {meta.get('dtype')}, rebuilding as {self.dtype}")
+            self.clear()
+            return
+        self._dim = meta["dim"]
+        self._count = meta["count"]
+        self._matrix = self._map("vectors.npy")
+        if self.dtype == "int8":
+            self._scales = self._map("scales.npy")
+        self._set_rows(self._read_rows(self._conn, self._count), self._count, self._matrix.shape[0])
+        if self.ann is not None:
+            self.ann.assign_missing(self)
+        if self.lexical is not None:
+            self._sync_lexical(self._conn, self._rows)
+            if not self.read_only and self.lexical.needs_save():
+                self.save_lexical()
+
+    def refresh(self):
+        """Catch up with rows another process has added to or deleted from this store's files.
+
+        Meant for read-only stores. Only rows whose id or position changed are
+        re-read, and searches keep running on the previous state meanwhile.
+        Returns the number of (added, removed) rows.
+        """
+        meta = self._read_meta() or {"dim": None, "count": 0}
+        count = meta["count"]
+        conn = self._connect()
+        try:
+            rows = self._read_rows(conn, count)
+            with self._lock:
+                previous = self._rows
+            removed = [doc_id for doc_id, row in previous.items() if rows.get(doc_id) != row]
+            added = [doc_id for doc_id, row in rows.items() if previous.get(doc_id) != row]
+            if self.lexical is not None and self.lexical.outdated():
+                # The writer saved a newer segment: map it and index only what it lacks.
+                self._sync_lexical(conn, rows)
+            elif self.lexical is not None:
+                self.lexical.remove(removed)
+                self._index_lexical(conn, added)
+        finally:
+            conn.close()
+        matrix = self._map("vectors.npy") if count else None
+        scales = self._map("scales.npy") if count and self.dtype == "int8" else None
+        with self._lock:
+            self._dim = meta["dim"]
+            self._count = count
+            self._matrix = matrix
+            self._scales = scales
+            self._set_rows(rows, count, 0 if matrix is None else matrix.shape[0])
+            if self.ann is not None:
+                self.ann.load()
+                self.ann.assign_missing(self)
+        return len(added), len(removed)
+
+    def _reader(self):
+        """Return this thread's read-only SQLite connection, or None once the store's files are gone.
+
+        Document lookups use it so they need neither the lock nor the
+        connection writes go through.
+        """
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            try:
+                conn = sqlite3.connect(
+                    f"file:{self._file('documents.sqlite3')}?mode=ro", uri=True, check_same_thread=False, timeout=30
+                )
+            except sqlite3.OperationalError:
+                return None
+            self._readers.conn = conn
+        return conn
+
+    def _documents(self, ids):
+        """Return the stored documents of those ``ids`` that exist, keyed by id."""
+        if not self.path:
+            docs = {}
+            for doc_id in ids:
+                doc = self._docs.get(doc_id)
+                if doc is not None:
+                    docs[doc_id] = doc
+            return docs
+        conn = self._reader()
+        if conn is None:
+            # A replaced generation whose files were removed: only the store's own connection still reads them.
+            with self._lock:
+                return self._read_documents(self._conn, ids)
+        return self._read_documents(conn, ids)
+
+    def _read_documents(self, conn, ids):
+        ids = list(ids)
+        docs = {}
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            for doc_id, content, metadata in conn.execute(
+                f"SELECT id, content, metadata FROM documents WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ):
+                docs[doc_id] = Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+        return docs
+
+    def _save_meta(self):
+        if not self.path:
+            return
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "dtype": self.dtype, "count": self._count}, f)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _allocate(self, name, shape, dtype):
+        if not self.path:
+            return np.zeros(shape, dtype=dtype)
+        tmp_path = self._file(f"{name}.tmp")
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        return array, tmp_path
+
+    def _publish(self, name, allocated):
+        if not self.path:
+            return allocated
+        array, tmp_path = allocated
+        array.flush()
+        del array
+        os.replace(tmp_path, self._file(name))
+        return np.load(self._file(name), mmap_mode="r+")
+
+    def _copy_rows(self, source, target, keep, block=65536):
+        if source is None:
+            return
+        for start in range(0, len(keep), block):
+            rows = keep[start:start + block]
+            target[start:start + len(rows)] = source[rows]
+
+    def _resize(self, capacity, keep=None):
+        """Reallocate the matrix with ``capacity`` rows, copying ``keep`` rows (default: all)."""
+        keep = np.arange(self._count) if keep is None else keep
+        matrix = self._allocate("vectors.npy", (capacity, self._dim), self.dtype)
+        self._copy_rows(self._matrix, matrix[0] if self.path else matrix, keep)
+        self._matrix = self._publish("vectors.npy", matrix)
+        if self.dtype == "int8":
+            scales = self._allocate("scales.npy", (capacity,), np.float32)
+            self._copy_rows(self._scales, scales[0] if self.path else scales, keep)
+            self._scales = self._publish("scales.npy", scales)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(keep)] = self._alive[keep] if len(self._alive) else False
+        self._alive = alive
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed > capacity:
+            self._resize(max(needed, capacity * 2, 1024))
+
+    def _quantize(self, vectors):
+        if self.dtype == "float32":
+            return vectors, None
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    # Writes
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = kwargs.get("embeddings")
+        if vectors is None:
+            vectors = self.embedding.embed_documents(texts)
+        return self.add_vectors(np.asarray(vectors, dtype=np.float32), texts, metadatas, ids)
+
+    def add_vectors(self, vectors, texts, metadatas, ids) -> List[str]:
+        """Insert pre-computed embeddings. Existing ids are replaced."""
+        self._check_writable()
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            existing = [doc_id for doc_id in ids if doc_id in self._rows]
+            if existing:
+                self.delete(existing)
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self._dim}")
+
+            start = self._count
+            end = start + len(ids)
+            self._ensure_capacity(end)
+            quantized, scales = self._quantize(vectors)
+            self._matrix[start:end] = quantized
+            if scales is not None:
+                self._scales[start:end] = scales
+            self._alive[start:end] = True
+
+            rows = []
+            for offset, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                row = start + offset
+                self._row_ids.append(doc_id)
+                self._rows[doc_id] = row
+                if not self.path:
+                    self._docs[doc_id] = Document(id=doc_id, page_content=text, metadata=metadata or {})
+                rows.append((row, doc_id, text, json.dumps(metadata or {}, default=str)))
+            self._count = end
+
+            if self.path:
+                self._matrix.flush()
+                if self._scales is not None:
+                    self._scales.flush()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents (row, id, content, metadata) VALUES (?, ?, ?, ?)", rows
+                )
+                self._conn.commit()
+                self._save_meta()
+            if self.ann is not None:
+                self.ann.on_add(self, start, vectors)
+            if self.lexical is not None:
+                self.lexical.add(ids, texts)
+        if self.lexical is not None and self.lexical.needs_save():
+            self.save_lexical()
+        if self.ann is not None and self.ann.needs_save():
+            self.save_ann()
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        self._check_writable()
+        with self._lock:
+            removed = []
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is None:
+                    continue
+                self._alive[row] = False
+                self._row_ids[row] = None
+                self._docs.pop(doc_id, None)
+                removed.append((doc_id,))
+            if self.path and removed:
+                self._conn.executemany("DELETE FROM documents WHERE id = ?", removed)
+                self._conn.commit()
+            if self.lexical is not None and removed:
+                self.lexical.remove([doc_id for doc_id, in removed])
+            if self._count > 1024 and len(self._rows) < self._count // 2:
+                self.compact()
+        return True
+
+    def compact(self):
+        """Drop tombstoned rows and renumber the remaining ones."""
+        self._check_writable()
+        with self._lock:
+            keep = np.flatnonzero(self._alive[: self._count])
+            logger.info(f"Compacting vector store: {self._count} rows -> {len(keep)} rows")
+            self._resize(max(len(keep), 1024), keep=keep)
+            if self.ann is not None:
+                self.ann.remap(keep)
+            self._row_ids = [self._row_ids[row] for row in keep]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._row_ids)}
+            self._count = len(keep)
+            if self.path:
+                # Rows only move down, so renumbering in ascending order never collides.
+                self._conn.executemany(
+                    "UPDATE documents SET row = ? WHERE id = ?", list(enumerate(self._row_ids))
+                )
+                self._conn.commit()
+                self._save_meta()
+            # Saved lexical rows are stale now.
+            self.save_lexical()
+
+    def clear(self):
+        """Remove every vector and document from the store."""
+        self._check_writable()
+        with self._lock:
+            self._dim = None
+            self._count = 0
+            self._matrix = None
+            self._scales = None
+            self._alive = np.zeros(0, dtype=bool)
+            self._row_ids = []
+            self._rows = {}
+            self._docs = {}
+            if self.ann is not None:
+                self.ann.reset()
+            if self.lexical is not None:
+                self.lexical.reset()
+            if self.path:
+                for name in ("meta.json", "vectors.npy", "scales.npy"):
+                    if os.path.exists(self._file(name)):
+                        os.remove(self._file(name))
+                self._conn.execute("DELETE FROM documents")
+                self._conn.commit()
+
+    # Reads
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_by_ids(self, ids, /) -> List[Document]:
+        docs = self._documents(ids)
+        return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+    def ids(self) -> List[str]:
+        """Return the ids of every stored chunk."""
+        with self._lock:
+            return list(self._rows)
+
+    def get_vectors(self, ids) -> dict:
+        """Return the stored (normalized) vectors of the given ids that exist, keyed by id."""
+        with self._lock:
+            found = [doc_id for doc_id in ids if doc_id in self._rows]
+            if not found:
+                return {}
+            vectors = self._vectors(np.array([self._rows[doc_id] for doc_id in found]))
+        return dict(zip(found, vectors))
+
+    def _vectors(self, rows, view=None):
+        """Return the given rows as dequantized float32 vectors, read from ``view`` if given."""
+        matrix, scales = (self._matrix, self._scales) if view is None else (view.matrix, view.scales)
+        vectors = matrix[rows].astype(np.float32, copy=False)
+        if self.dtype == "int8":
+            vectors = vectors * scales[rows][:, None]
+        return vectors
+
+    def _view(self):
+        """Capture the rows a search reads. Callers hold the lock.
+
+        Inserts only append rows past ``count``, and resizing or compacting
+        maps a new matrix, so the captured rows stay intact once the lock is
+        released. The alive mask is copied because deletes clear it in place.
+        """
+        count = self._count
+        return _View(count, self._matrix, self._scales, self._alive[:count].copy(), self._row_ids)
+
+    def _scores(self, view, queries, rows=None):
+        """Cosine similarity of each row of ``view`` (default: all) against each normalized query, shape (rows, n_queries)."""
+        if rows is not None:
+            scores = self._vectors(rows, view) @ queries.T
+            scores[~view.alive[rows]] = -np.inf
+            return scores
+        count = view.count
+        matrix = view.matrix[:count]
+        if self.dtype == "float32":
+            scores = matrix @ queries.T
+        else:
+            scores = np.empty((count, queries.shape[0]), dtype=np.float32)
+            block = max(1, _SCORE_BLOCK_BYTES // (self._dim * 4))
+            for start in range(0, count, block):
+                end = min(start + block, count)
+                scores[start:end] = matrix[start:end].astype(np.float32) @ queries.T
+            if self.dtype == "int8":
+                scores *= view.scales[:count, None]
+        scores[~view.alive] = -np.inf
+        return scores
+
+    def _top_k(self, view, scores, k, filter=None, rows=None):
+        available = int(np.isfinite(scores).sum())
+        if available == 0 or k <= 0:
+            return []
+        if filter is None:
+            k = min(k, available)
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            order = candidates[np.argsort(-scores[candidates])]
+        else:
+            order = np.argsort(-scores)[:available]
+        results = []
+        block = max(k, 64)
+        for start in range(0, len(order), block):
+            positions = order[start:start + block]
+            ids = [view.row_ids[i if rows is None else rows[i]] for i in positions]
+            docs = self._documents(ids)
+            for i, doc_id in zip(positions, ids):
+                doc = docs.get(doc_id)
+                if doc is None or (filter is not None and not filter(doc)):
+                    continue
+                results.append((doc, float(scores[i])))
+                if len(results) == k:
+                    return results
+        return results
+
+    def _embed_queries(self, queries):
+        vectors = np.asarray(queries, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        return _normalize(vectors)
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings, k: int = 4, filter: Optional[Callable[[Document], bool]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """Score a batch of query vectors against the corpus in one matrix product."""
+        queries = self._embed_queries(embeddings)
+        with self._lock:
+            if self._count == 0:
+                return [[] for _ in range(queries.shape[0])]
+            view = self._view()
+            candidates = None
+            if self.ann is not None and self.ann.active(len(self._rows)):
+                candidates = [self.ann.candidates(query, view.count) for query in queries]
+        # Scoring, top-k and the document lookups run without the lock, so writers are not held up.
+        if candidates is not None:
+            return [
+                self._top_k(view, self._scores(view, query[None, :], rows)[:, 0], k, filter, rows)
+                for query, rows in zip(queries, candidates)
+            ]
+        scores = self._scores(view, queries)
+        return [self._top_k(view, scores[:, i], k, filter) for i in range(queries.shape[0])]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Callable[[Document], bool]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k=k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def batch_similarity_search(self, queries: List[str], k: int = 4, **kwargs: Any) -> List[List[Document]]:
+        """Answer several queries with one embedding request and one matrix product."""
+        if not queries:
+            return []
+        vectors = self.embedding.embed_documents(list(queries))
+        return [
+            [doc for doc, _ in results]
+            for results in self.similarity_search_with_score_by_vectors(vectors, k=k, **kwargs)
+        ]
+
+    def lexical_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """Keyword search through the ``lexical`` index; no embedding call is made."""
+        if self.lexical is None:
+            raise ValueError("This vector store has no lexical index")
+        hits = self.lexical.search(query, k)
+        docs = self._documents([doc_id for doc_id, _ in hits])
+        return [(docs[doc_id], score) for doc_id, score in hits if doc_id in docs]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda score: score
+
+    def stats(self):
+        with self._lock:
+            capacity = 0 if self._matrix is None else self._matrix.shape[0]
+            return {
+                "dtype": self.dtype,
+                "dimensions": self._dim,
+                "vectors": len(self._rows),
+                "rows": self._count,
+                "capacity": capacity,
+                "matrix_bytes": 0 if self._matrix is None else int(self._matrix.nbytes),
+                "memory_mapped": bool(self.path),
+                "read_only": self.read_only,
+                "ann": self.ann.stats() if self.ann is not None else None,
+                "lexical": self.lexical.stats() if self.lexical is not None else None,
+            }
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import threading
+import multiprocessing
+import concurrent.futures
+
+MISTRAL_OCR_MODEL = "mistral-ocr-latest"
+PYPDF_ENGINE = "pypdf"
+# Process pools start their workers from a fresh interpreter (forkserver, or
+# spawn where that is unavailable) rather than forking the server, whose
+# threads may hold locks the child would inherit held.
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+class OCRCache:
+    """On-disk cache of OCR output per PDF content hash, engine, and page.
+
+    A document is only considered cached once all of its pages have been
+    stored, so a partial run is never returned as a complete result.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_pages ("
+            " digest TEXT NOT NULL,"
+            " engine TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " PRIMARY KEY (digest, engine, page))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_documents ("
+            " digest TEXT NOT NULL,"
+            " engine TEXT NOT NULL,"
+            " pages INTEGER NOT NULL,"
+            " PRIMARY KEY (digest, engine))"
+        )
+        self._conn.commit()
+
+    def get(self, digest, engine):
+        """Return the cached page texts for a document, or None if it has not been fully processed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pages FROM ocr_documents WHERE digest = ? AND engine = ?", (digest, engine)
+            ).fetchone()
+            if row is None:
+                return None
+            pages = self._conn.execute(
+                "SELECT text FROM ocr_pages WHERE digest = ? AND engine = ? ORDER BY page", (digest, engine)
+            ).fetchall()
+        if len(pages) != row[0]:
+            return None
+        return [text for (text,) in pages]
+
+    def put(self, digest, engine, pages):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ocr_pages (digest, engine, page, text) VALUES (?, ?, ?, ?)",
+                [(digest, engine, page, text) for page, text in enumerate(pages)],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_documents (digest, engine, pages) VALUES (?, ?, ?)",
+                (digest, engine, len(pages)),
+            )
+            self._conn.commit()
+
+
+def _page_text(page):
+    for attribute in ("markdown", "text"):
+        text = getattr(page, attribute, None)
+        if isinstance(text, str):
+            return text
+    return str(page)
+
+
+def mistral_ocr_pages(path, client, model=MISTRAL_OCR_MODEL):
+    """OCR a PDF with the Mistral API and return one text per page.
+
+    ``client`` only needs the ``files.upload``, ``files.get_signed_url`` and
+    ``ocr.process`` calls of ``mistralai.Mistral``, so a local stub can stand
+    in for it.
+    """
+    with open(path, "rb") as f:
+        uploaded_pdf = client.files.upload(
+            file={
+                "file_name": os.path.basename(path),
+                "content": f,
+            },
+            purpose="ocr"
+        )
+    signed_url = client.files.get_signed_url(file_id=uploaded_pdf.id)
+    ocr_response = client.ocr.process(
+        model=model,
+        document={
+            "type": "document_url",
+            "document_url": signed_url.url,
+        }
+    )
+    pages = getattr(ocr_response, "pages", None)
+    if not pages:
+        return [str(ocr_response)]
+    return [_page_text(page) for page in pages]
+
+
+def _extract_page_range(path, start, end):
+    import pypdf
+
+    reader = pypdf.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def extract_text_pages(path, workers=None):
+    """Extract the embedded text of every PDF page with pypdf, split across a process pool."""
+    import pypdf
+
+    page_count = len(pypdf.PdfReader(path).pages)
+    workers = min(workers or os.cpu_count() or 1, page_count)
+    if workers <= 1:
+        return _extract_page_range(path, 0, page_count)
+
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges), mp_context=POOL_CONTEXT) as executor:
+        futures = [executor.submit(_extract_page_range, path, start, end) for start, end in ranges]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+    return pages
@@ -0,0 +1,133 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace, and drop trailing punctuation so trivial variants share a key."""
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip(" ?!.")
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with an optional per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, created):
+        return self.ttl is not None and self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or self._expired(item[1]):
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, (value, created) in self._entries.items() if not self._expired(created)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class AnswerCache:
+    """Two-tier cache of query answers, scoped to a corpus version.
+
+    The exact tier matches on normalized query text. The optional semantic tier
+    returns the answer of a previous query whose embedding has cosine
+    similarity of at least ``semantic_threshold`` with the new one. Every
+    entry carries the corpus version it was answered against, and lookups only
+    match the current version, so an upload, delete, or reset never serves a
+    stale answer.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, semantic_threshold=0.0):
+        self.semantic_threshold = semantic_threshold
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self._exact = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._semantic = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    @property
+    def semantic_enabled(self):
+        return self.semantic_threshold > 0
+
+    def get(self, query, corpus_version):
+        return self._exact.get((corpus_version, normalize_query(query)))
+
+    def get_semantic(self, embedding, corpus_version):
+        if not self.semantic_enabled:
+            return None
+        candidates = [
+            (vector, answer) for (version, _), (vector, answer) in self._semantic.items() if version == corpus_version
+        ]
+        if candidates:
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            scores = np.stack([vector for vector, _ in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.semantic_threshold:
+                self.semantic_hits += 1
+                return candidates[best][1]
+        self.semantic_misses += 1
+        return None
+
+    def put(self, query, corpus_version, answer, embedding=None):
+        key = (corpus_version, normalize_query(query))
+        self._exact.put(key, answer)
+        if self.semantic_enabled and embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            self._semantic.put(key, (vector, answer))
+
+    def clear(self):
+        self._exact.clear()
+        self._semantic.clear()
+
+    def stats(self):
+        exact = self._exact.stats()
+        lookups = exact["hits"] + exact["misses"]
+        return {
+            "exact": exact,
+            "semantic": {
+                "enabled": self.semantic_enabled,
+                "threshold": self.semantic_threshold,
+                "hits": self.semantic_hits,
+                "misses": self.semantic_misses,
+            },
+            "hit_rate": (exact["hits"] + self.semantic_hits) / lookups if lookups else 0.0,
+        }
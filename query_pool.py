@@ -0,0 +1,219 @@
+import time
+import queue
+import threading
+import contextvars
+import concurrent.futures
+
+
+class QueryRejected(Exception):
+    """Raised when the query pool is saturated and cannot admit another request."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work could finish."""
+
+
+class Deadline:
+    """Absolute point in time by which a request must complete; ``None`` seconds means no deadline."""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left before the deadline (never negative), or None if there is no deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage=None):
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline of {self.seconds}s exceeded" + (f" before {stage}" if stage else ""))
+
+
+class _Timer:
+    """Running count, total and maximum of a duration, in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self):
+        return {
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else None,
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+class QueryPool:
+    """Process-wide bounded pool of worker threads for answering queries.
+
+    At most ``workers`` requests execute at once and at most ``max_queue``
+    more wait for a worker; further submissions are rejected immediately with
+    QueryRejected instead of piling up threads. Each request carries a
+    Deadline that the work function receives, so it can bound its own
+    retrieval and LLM calls, and a request whose deadline passes while it is
+    still queued is dropped without running. Queue wait and execution time
+    are tracked separately and, if given, passed to ``observe(stage, seconds)``.
+    Streamed requests (see ``stream``) hold a worker for as long as they
+    produce output.
+    """
+
+    def __init__(self, workers=8, max_queue=32, observe=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.observe = observe
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.expired_in_queue = 0
+        self.completed = 0
+        self.failed = 0
+        self._queue_wait = _Timer()
+        self._execution = _Timer()
+
+    def run(self, func, *args, timeout=None, **kwargs):
+        """Run ``func(*args, deadline=..., **kwargs)`` on the pool and return its result.
+
+        Raises QueryRejected if the pool is saturated and DeadlineExceeded if
+        ``timeout`` seconds pass first. The caller stops waiting at the
+        deadline; the work itself is expected to give up by then as well.
+        """
+        deadline = Deadline(timeout)
+        future = self._submit(func, args, kwargs, deadline)
+        try:
+            return future.result(timeout=deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise DeadlineExceeded(f"Deadline of {timeout}s exceeded")
+
+    def stream(self, func, *args, timeout=None, **kwargs):
+        """Run the generator function ``func(*args, deadline=..., **kwargs)`` on the pool; return an iterator over its items.
+
+        The request is admitted here, so QueryRejected is raised before
+        anything is iterated. Items are handed over as the worker produces
+        them, and iterating raises DeadlineExceeded if ``timeout`` seconds pass
+        before the next one arrives. Closing the iterator, e.g. when the client
+        disconnects, or hitting the deadline closes ``func``'s generator after
+        its current item and frees the worker.
+        """
+        deadline = Deadline(timeout)
+        items = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce(deadline):
+            generator = func(*args, deadline=deadline, **kwargs)
+            try:
+                for item in generator:
+                    if cancelled.is_set():
+                        break
+                    items.put((True, item))
+            except BaseException as e:
+                items.put((False, e))
+                raise
+            finally:
+                generator.close()
+                items.put((False, None))
+
+        self._submit(produce, (), {}, deadline)
+
+        def consume():
+            try:
+                while True:
+                    try:
+                        ok, item = items.get(timeout=deadline.remaining())
+                    except queue.Empty:
+                        with self._lock:
+                            self.timed_out += 1
+                        raise DeadlineExceeded(f"Deadline of {timeout}s exceeded")
+                    if ok:
+                        yield item
+                    elif item is None:
+                        return
+                    else:
+                        raise item
+            finally:
+                cancelled.set()
+
+        return consume()
+
+    def _submit(self, func, args, kwargs, deadline):
+        """Admit a request and queue ``func`` for a worker; return its future."""
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise QueryRejected(f"Query pool saturated ({self._pending} requests in flight)")
+            self._pending += 1
+            self.submitted += 1
+        submitted_at = time.perf_counter()
+        try:
+            # Run in a copy of the caller's context so context variables such as
+            # the current trace follow the request onto the worker thread.
+            context = contextvars.copy_context()
+            return self._executor.submit(context.run, self._execute, func, args, kwargs, deadline, submitted_at)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def _execute(self, func, args, kwargs, deadline, submitted_at):
+        started = time.perf_counter()
+        with self._lock:
+            self._queue_wait.add(started - submitted_at)
+            self._running += 1
+        if self.observe:
+            self.observe("queue_wait", started - submitted_at)
+        succeeded = False
+        try:
+            if deadline.expired:
+                with self._lock:
+                    self.expired_in_queue += 1
+                raise DeadlineExceeded(f"Deadline of {deadline.seconds}s exceeded while queued")
+            result = func(*args, deadline=deadline, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._execution.add(elapsed)
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            if self.observe:
+                self.observe("execution", elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "expired_in_queue": self.expired_in_queue,
+                "queue_wait": self._queue_wait.stats(),
+                "execution": self._execution.stats(),
+            }
@@ -1,169 +1,1153 @@
 import os
+import logging
 import dotenv
 import uuid
 import glob
-import base64
 from pathlib import Path
-import tempfile
-from typing import List, Dict, Any
-import requests
-from PIL import Image
-import io
 import re
 import threading
 import time
 import concurrent.futures
+import shutil
+import hashlib
+import json
+import contextlib
 
+try:
+    import fcntl
+except ImportError:  # Windows: the single server process is always the index writer
+    fcntl = None
+
+# The OpenAI client, document loaders and text splitter take seconds to
+# import, so they are imported where first used rather than here.
 from langchain_core.documents import Document
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.document_loaders import PyPDFLoader, CSVLoader, UnstructuredExcelLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import StateGraph, END
+from langchain_core.embeddings import Embeddings
+
+from document_catalog import DocumentCatalog, file_hash
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import EmbeddingPipeline
+from numpy_vector_store import NumpyVectorStore
+from ann_index import IVFIndex
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from query_cache import AnswerCache, LRUCache
+from ingestion_jobs import IngestionJobQueue
+from index_manager import IndexManager
+from query_pool import QueryPool, QueryRejected, DeadlineExceeded
+import metrics
+from metrics import span
+from table_store import TableStore, describe_table, is_table_question
+from context_builder import build_context, count_tokens
+from conversation_memory import ConversationMemory, format_turns, is_follow_up
+from ocr_service import OCRCache, MISTRAL_OCR_MODEL, PYPDF_ENGINE, POOL_CONTEXT, mistral_ocr_pages, extract_text_pages
 
 dotenv.load_dotenv(Path(__file__).parent / ".env")
 
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DOCS_DIRECTORY = os.environ.get("DOCS_DIRECTORY", os.path.join(BASE_DIRECTORY, "docs"))
+STORAGE_DIRECTORY = os.environ.get("STORAGE_DIRECTORY", os.path.join(BASE_DIRECTORY, "storage"))
+SUPPORTED_EXTENSIONS = {'.pdf': 'pdf', '.xlsx': 'excel', '.xls': 'excel', '.csv': 'csv'}
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "512"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "8"))
+VECTOR_STORE_DTYPE = os.environ.get("VECTOR_STORE_DTYPE", "float32")
+VECTOR_SEARCH_MODE = os.environ.get("VECTOR_SEARCH_MODE", "exact")
+ANN_MIN_VECTORS = int(os.environ.get("ANN_MIN_VECTORS", "50000"))
+ANN_LISTS = int(os.environ.get("ANN_LISTS", "0"))
+ANN_PROBES = int(os.environ.get("ANN_PROBES", "8"))
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", "10"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+SNAPSHOT_MANIFEST = "snapshot.json"
+INDEX_POLL_INTERVAL = float(os.environ.get("INDEX_POLL_INTERVAL", "1.0"))
+STREAM_INGEST_THRESHOLD_BYTES = int(os.environ.get("STREAM_INGEST_THRESHOLD_BYTES", str(100 * 1024 * 1024)))
+STREAM_INGEST_BATCH_SIZE = int(os.environ.get("STREAM_INGEST_BATCH_SIZE", "256"))
+LOADER_WORKERS = int(os.environ.get("LOADER_WORKERS", str(os.cpu_count() or 1)))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", "8"))
+QUERY_QUEUE_SIZE = int(os.environ.get("QUERY_QUEUE_SIZE", "32"))
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "30"))
+TABLE_ENGINE = os.environ.get("TABLE_ENGINE", "true").lower() in ("1", "true", "yes")
+TABLE_QUERY_MAX_ROWS = int(os.environ.get("TABLE_QUERY_MAX_ROWS", "50"))
+OCR_INDEX_RESULTS = os.environ.get("OCR_INDEX_RESULTS", "true").lower() in ("1", "true", "yes")
+CONVERSATION_MAX_THREADS = int(os.environ.get("CONVERSATION_MAX_THREADS", "1000"))
+CONVERSATION_TTL = float(os.environ.get("CONVERSATION_TTL", "86400"))
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", "800"))
+CONVERSATION_SPILL = os.environ.get("CONVERSATION_SPILL", "true").lower() in ("1", "true", "yes")
+CONVERSATION_SUMMARIZER = os.environ.get("CONVERSATION_SUMMARIZER", "llm")
+CONVERSATION_REWRITE = os.environ.get("CONVERSATION_REWRITE", "true").lower() in ("1", "true", "yes")
+
+# Model classes, imported from langchain_openai on first use unless they have
+# been replaced beforehand (benchmark.py swaps in local fakes this way).
+ChatOpenAI = None
+OpenAIEmbeddings = None
+
 _llm = None
+_models_lock = threading.Lock()
 _embeddings = None
 _vector_store = None
 _chain = None
 _is_initialized = False
-_memory = MemorySaver()
-_conversation_history = {}
+_catalog = DocumentCatalog(os.path.join(STORAGE_DIRECTORY, "catalog.json"))
+# Held by index writers (ingest, delete, rebuild). Queries never take it: they
+# read the published _vector_store snapshot, which rebuilds replace atomically.
+_index_lock = threading.RLock()
+# Documents written to the live index while a rebuild runs; None when none runs.
+_rebuild_changes = None
+# Documents a streaming ingest is writing to the live index batch by batch.
+_live_streams = set()
+_load_timings = []
+_startup = {}
+_corpus_version = 0
+# With several server processes (e.g. gunicorn workers) sharing STORAGE_DIRECTORY,
+# the one holding storage/writer.lock indexes; the others map its published
+# snapshot read-only and follow the manifest, see _watch_index.
+_writer_lock_file = None
+_serving = {"role": None, "pid": os.getpid(), "refreshes": 0, "reloads": 0}
+_answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD,
+)
+_query_embedding_cache = LRUCache(max_entries=QUERY_EMBEDDING_CACHE_SIZE)
+_conversations = ConversationMemory(
+    max_threads=CONVERSATION_MAX_THREADS,
+    ttl=CONVERSATION_TTL,
+    token_budget=CONVERSATION_TOKEN_BUDGET,
+    path=os.path.join(STORAGE_DIRECTORY, "conversations.sqlite3") if CONVERSATION_SPILL else None,
+    summarize=(lambda summary, turns, max_tokens: _summarize_conversation(summary, turns, max_tokens))
+    if CONVERSATION_SUMMARIZER == "llm" else None,
+)
+_context_totals = {"queries": 0, "candidates": 0, "chunks": 0, "candidate_tokens": 0, "tokens": 0}
+_context_lock = threading.Lock()
+_table_store = TableStore(os.path.join(STORAGE_DIRECTORY, "tables.sqlite3"), max_result_rows=TABLE_QUERY_MAX_ROWS)
+_ocr_cache = OCRCache(os.path.join(STORAGE_DIRECTORY, "ocr.sqlite3"))
+_ocr_client = None
+_index_manager = IndexManager(
+    build=lambda: _build_snapshot(),
+    publish=lambda built: _publish_build(built),
+    lock=_index_lock,
+)
+_query_pool = QueryPool(
+    workers=QUERY_WORKERS,
+    max_queue=QUERY_QUEUE_SIZE,
+    observe=lambda stage, seconds: metrics.record(f"query_pool_{stage}", seconds),
+)
+_jobs = IngestionJobQueue(
+    os.path.join(STORAGE_DIRECTORY, "jobs.sqlite3"),
+    handler=lambda job, progress: _run_ingest_job(job, progress),
+    workers=INGEST_WORKERS,
+)
+
+_default_timeout = QUERY_TIMEOUT
+_timeout_message = "I'm sorry, but processing your request took too long and was stopped. Please try a simpler question or adjust the timeout setting."
+
+def _bump_corpus_version():
+    """Mark the indexed corpus as changed so answers cached against it are no longer served."""
+    global _corpus_version
+    if _is_reader():
+        # Readers take the corpus version from the writer's manifest.
+        return
+    with _index_lock:
+        _corpus_version += 1
+        if _vector_store is not None:
+            _save_snapshot_manifest(_vector_store)
+
+def _openai_class(name):
+    """Return ``ChatOpenAI`` or ``OpenAIEmbeddings``, importing langchain_openai on first use."""
+    model_class = globals()[name]
+    if model_class is None:
+        import langchain_openai
+        model_class = getattr(langchain_openai, name)
+    return model_class
+
+class _DeferredEmbeddings(Embeddings):
+    """Embeddings model that is only constructed, and its client library imported, on the first call."""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._model = None
+    
+    def _get(self):
+        with _models_lock:
+            if self._model is None:
+                self._model = self._factory()
+            return self._model
+    
+    def embed_documents(self, texts):
+        return self._get().embed_documents(texts)
+    
+    def embed_query(self, text):
+        return self._get().embed_query(text)
+
+def _get_llm():
+    """Return the chat model, constructing it on first use."""
+    global _llm
+    if _llm is None:
+        with _models_lock:
+            if _llm is None:
+                _llm = _openai_class("ChatOpenAI")(model="gpt-4o", temperature=0)
+                logger.info("LLM initialized")
+    return _llm
+
+def _file_type(path):
+    """Return the catalog file type for a supported path, or None."""
+    _, ext = os.path.splitext(path.lower())
+    return SUPPORTED_EXTENSIONS.get(ext)
+
+def _document_name(path):
+    """Return the catalog key for a file: its path relative to the docs directory."""
+    return os.path.relpath(os.path.abspath(path), DOCS_DIRECTORY).replace(os.sep, "/")
+
+def list_document_files():
+    """Return the paths of all supported files under the docs directory."""
+    if not os.path.exists(DOCS_DIRECTORY):
+        os.makedirs(DOCS_DIRECTORY)
+    
+    paths = []
+    for pattern in ("**/*.pdf", "**/*.xlsx", "**/*.xls", "**/*.csv"):
+        paths.extend(glob.glob(os.path.join(DOCS_DIRECTORY, pattern), recursive=True))
+    return sorted(paths)
+
+def iter_file_documents(path):
+    """Lazily yield the documents of a PDF (per page), Excel (per element), or CSV (per row) file.
+    
+    With TABLE_ENGINE on, CSV and Excel files are loaded into the table store
+    instead and yield one schema summary per table.
+    """
+    file_type = _file_type(path)
+    if TABLE_ENGINE and file_type in ('csv', 'excel'):
+        yield from _iter_table_documents(path, file_type)
+        return
+    if file_type == 'pdf':
+        from langchain_community.document_loaders import PyPDFLoader
+        loader = PyPDFLoader(path)
+    elif file_type == 'excel':
+        from langchain_community.document_loaders import UnstructuredExcelLoader
+        loader = UnstructuredExcelLoader(path, mode="elements")
+    elif file_type == 'csv':
+        from langchain_community.document_loaders import CSVLoader
+        loader = CSVLoader(path)
+    else:
+        raise ValueError(f"Unsupported file type: {path}")
+    
+    for doc in loader.lazy_load():
+        if hasattr(doc, 'metadata'):
+            doc.metadata['source'] = os.path.basename(path)
+            doc.metadata['file_type'] = file_type
+        yield doc
+
+def _iter_table_documents(path, file_type):
+    """Load a CSV or Excel file into the table store and yield the schema summary of each of its tables."""
+    for table in _table_store.load_file(_document_name(path), path, file_type):
+        logger.info(f"Loaded {table['row_count']} rows into table {table['name']}")
+        yield Document(
+            page_content=describe_table(table),
+            metadata={'source': os.path.basename(path), 'file_type': file_type, 'table': table['name']},
+        )
+
+def load_file(path):
+    """Load a single PDF, Excel, or CSV file into documents tagged with their source."""
+    labels = {'pdf': ('PDF', 'pages'), 'excel': ('Excel', 'elements'), 'csv': ('CSV', 'rows')}
+    if TABLE_ENGINE:
+        labels.update({'excel': ('Excel', 'table summaries'), 'csv': ('CSV', 'table summaries')})
+    label, unit = labels.get(_file_type(path), ('file', 'documents'))
+    logger.info(f"Loading {label}: {path}")
+    docs = list(iter_file_documents(path))
+    logger.info(f"Loaded {len(docs)} {unit} from {label}: {os.path.basename(path)}")
+    return docs
 
-_default_timeout = 30
+def _load_file_timed(path):
+    """Load one file, returning (path, documents, seconds, error) instead of raising."""
+    started = time.perf_counter()
+    try:
+        docs = load_file(path)
+        return path, docs, time.perf_counter() - started, None
+    except Exception as e:
+        return path, [], time.perf_counter() - started, str(e)
+
+def iter_loaded_files(paths, workers=None):
+    """Parse files concurrently and yield (path, documents, seconds, error) as each one finishes.
+    
+    Parsing runs in a process pool of ``workers`` processes (default
+    LOADER_WORKERS) so CPU-bound loaders use every core; with one worker or one
+    file it runs in-process. A failing file yields its error and does not
+    affect the others.
+    """
+    for result in _iter_loaded_files(list(paths), LOADER_WORKERS if workers is None else workers):
+        path, docs, seconds, error = result
+        # Recorded here rather than in the loader, which may run in another process.
+        metrics.record(
+            f"load_{_file_type(path)}", seconds, error is not None,
+            bytes=os.path.getsize(path) if os.path.exists(path) else 0, documents=len(docs),
+        )
+        yield result
+
+def _init_loader_process(docs_directory, table_engine, table_store_path):
+    """Give a loader process, which imports this module afresh, the settings the server runs with."""
+    global DOCS_DIRECTORY, TABLE_ENGINE, _table_store
+    DOCS_DIRECTORY, TABLE_ENGINE = docs_directory, table_engine
+    _table_store = TableStore(table_store_path, max_result_rows=TABLE_QUERY_MAX_ROWS)
+
+def _iter_loaded_files(paths, workers):
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield _load_file_timed(path)
+        return
+    
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(workers, len(paths)),
+        mp_context=POOL_CONTEXT,
+        initializer=_init_loader_process,
+        initargs=(DOCS_DIRECTORY, TABLE_ENGINE, _table_store.path),
+    ) as executor:
+        futures = [executor.submit(_load_file_timed, path) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
 
 def load_documents():
     """Load documents from the docs directory, supporting PDF, Excel, and CSV."""
-    docs_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
-    if not os.path.exists(docs_directory):
-        os.makedirs(docs_directory)
-    
-    print(f"Loading documents from: {docs_directory}")
+    logger.info(f"Loading documents from: {DOCS_DIRECTORY}")
     all_documents = []
-        
-    pdf_files = glob.glob(os.path.join(docs_directory, "**/*.pdf"), recursive=True)
-    print(f"Found {len(pdf_files)} PDF files")
-    for pdf_path in pdf_files:
-        try:
-            print(f"Loading PDF: {pdf_path}")
-            loader = PyPDFLoader(pdf_path)
-            docs = loader.load()
-            print(f"  - Loaded {len(docs)} pages from PDF: {os.path.basename(pdf_path)}")
-            
-            for doc in docs:
-                if hasattr(doc, 'metadata'):
-                    doc.metadata['source'] = os.path.basename(pdf_path)
-                    doc.metadata['file_type'] = 'pdf'
-            
-            all_documents.extend(docs)
-        except Exception as e:
-            print(f"Error loading {pdf_path}: {str(e)}")
     
-    excel_files = glob.glob(os.path.join(docs_directory, "**/*.xlsx"), recursive=True)
-    excel_files.extend(glob.glob(os.path.join(docs_directory, "**/*.xls"), recursive=True))
-    print(f"Found {len(excel_files)} Excel files")
-    for excel_path in excel_files:
-        try:
-            print(f"Loading Excel: {excel_path}")
-            loader = UnstructuredExcelLoader(excel_path, mode="elements")
-            docs = loader.load()
-            print(f"  - Loaded {len(docs)} elements from Excel: {os.path.basename(excel_path)}")
-            
-            for doc in docs:
-                if hasattr(doc, 'metadata'):
-                    doc.metadata['source'] = os.path.basename(excel_path)
-                    doc.metadata['file_type'] = 'excel'
-            
-            all_documents.extend(docs)
-        except Exception as e:
-            print(f"Error loading {excel_path}: {str(e)}")
-        
-    csv_files = glob.glob(os.path.join(docs_directory, "**/*.csv"), recursive=True)
-    print(f"Found {len(csv_files)} CSV files")
-    for csv_path in csv_files:
-        try:
-            print(f"Loading CSV: {csv_path}")
-            loader = CSVLoader(csv_path)
-            docs = loader.load()
-            print(f"  - Loaded {len(docs)} rows from CSV: {os.path.basename(csv_path)}")
-            
-            for doc in docs:
-                if hasattr(doc, 'metadata'):
-                    doc.metadata['source'] = os.path.basename(csv_path)
-                    doc.metadata['file_type'] = 'csv'
-            
-            all_documents.extend(docs)
-        except Exception as e:
-            print(f"Error loading {csv_path}: {str(e)}")
+    paths = list_document_files()
+    logger.info(f"Found {len(paths)} supported files")
+    for path, docs, seconds, error in iter_loaded_files(paths):
+        if error:
+            logger.error(f"Error loading {path}: {error}")
+        all_documents.extend(docs)
     
-    print(f"Total documents loaded: {len(all_documents)}")
+    logger.info(f"Total documents loaded: {len(all_documents)}")
     return all_documents
 
 def split_documents(documents):
     """Split documents into chunks."""
     if not documents:
-        print("No documents to split")
+        logger.debug("No documents to split")
         return []
-        
+    
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
+        separators=["\n\n", "\n", ". ", " ", ""],
+        add_start_index=True,
     )
     
-    chunks = splitter.split_documents(documents)
-    print(f"Split {len(documents)} documents into {len(chunks)} chunks")
+    with span("split", documents=len(documents), bytes=sum(len(doc.page_content) for doc in documents)) as current:
+        chunks = splitter.split_documents(documents)
+        current.set(chunks=len(chunks))
+    logger.debug(f"Split {len(documents)} documents into {len(chunks)} chunks")
     return chunks
 
-def initialize_system():
-    """Initialize a simple RAG system."""
-    global _llm, _embeddings, _vector_store, _chain, _is_initialized
+def _checkpoint_path(name):
+    key = hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(STORAGE_DIRECTORY, "checkpoints", f"{key}.json")
+
+def _read_checkpoint(name):
+    path = _checkpoint_path(name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get("name") == name else None
+
+def _is_resumable(checkpoint, digest):
+    """Return True if a checkpoint matches the file and the store still holds its chunks."""
+    if not checkpoint or checkpoint.get("hash") != digest:
+        return False
+    name, chunks_done = checkpoint["name"], checkpoint.get("chunks_done", 0)
+    with _index_lock:
+        return not chunks_done or bool(_write_store().get_by_ids([f"{name}::{chunks_done - 1}"]))
+
+def _write_checkpoint(name, digest, documents_done, chunks_done):
+    path = _checkpoint_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"name": name, "hash": digest, "documents_done": documents_done, "chunks_done": chunks_done}, f)
+    os.replace(tmp_path, path)
+
+def _embed_chunks(chunks):
+    """Embed chunk texts; done outside the index lock so slow embedding calls do not block other writers."""
+    texts = [chunk.page_content for chunk in chunks]
+    with span("embed", chunks=len(texts), bytes=sum(len(text) for text in texts)):
+        return _embeddings.embed_documents(texts)
+
+def _write_store():
+    """Return the live store index writers modify; None in reader processes, which never modify the index.
+
+    Callers hold the index lock, so a rebuild cannot swap the store under them.
+    """
+    if _is_reader():
+        return None
+    return _vector_store
+
+@contextlib.contextmanager
+def _writing(name, catalog):
+    """Guard a write of document ``name`` to ``catalog`` and its vector store.
     
-    if _is_initialized:
-        return _chain
+    Writes to the live index take the index lock and are recorded for a
+    rebuild in progress, which replays them onto its generation before
+    publishing it (see _publish_build). A generation being rebuilt is only
+    written by its rebuild and needs no lock.
+    """
+    if catalog is not _catalog:
+        yield
+        return
+    with _index_lock:
+        if _rebuild_changes is not None:
+            _rebuild_changes.add(name)
+        yield
+
+def _add_chunks(chunks, chunk_ids, vectors, store):
+    store.add_texts(
+        [chunk.page_content for chunk in chunks],
+        metadatas=[chunk.metadata for chunk in chunks],
+        ids=chunk_ids,
+        embeddings=vectors,
+    )
+
+def _stream_index_file(path, digest=None, batch_size=None, progress=None, store=None, catalog=None):
+    """Index a large file in fixed-size batches so peak memory is bounded by the batch, not the file.
     
-    print("Initializing simple RAG system...")
-        
-    _llm = ChatOpenAI(model="gpt-4o", temperature=0)
-    print("LLM initialized")
-        
-    _embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-    print("Embeddings initialized")
+    Documents are read lazily, split, and embedded ``batch_size`` at a time, and
+    progress is checkpointed after every batch; an ingest that crashed part way
+    through resumes after the last completed batch. ``progress`` is called with
+    (documents done, chunks done) after each batch. ``store`` and ``catalog``
+    are those of a generation being rebuilt (default: the live index); its
+    ingests are not checkpointed.
+    """
+    name = _document_name(path)
+    digest = digest or file_hash(path)
+    batch_size = batch_size or STREAM_INGEST_BATCH_SIZE
+    catalog = _catalog if catalog is None else catalog
+    live = catalog is _catalog
+    
+    if live:
+        with _index_lock:
+            _live_streams.add(name)
+    try:
+        checkpoint = _read_checkpoint(name) if live else None
+        documents_done = chunks_done = 0
+        if _is_resumable(checkpoint, digest):
+            documents_done, chunks_done = checkpoint["documents_done"], checkpoint["chunks_done"]
+            logger.info(f"Resuming streaming ingest of {name} after {documents_done} documents ({chunks_done} chunks)")
+        else:
+            # Evict chunks left by a previous version of the file or an abandoned partial ingest.
+            with _writing(name, catalog):
+                entry = catalog.get(name) or {}
+                stale = max(entry.get("chunk_count", 0), (checkpoint or {}).get("chunks_done", 0))
+                (store if store is not None else _write_store()).delete(
+                    ids=entry.get("chunk_ids", []) + [f"{name}::{i}" for i in range(stale)]
+                )
         
-    _vector_store = InMemoryVectorStore(embedding=_embeddings)
-    print("Vector store initialized")
+        def flush(batch):
+            nonlocal documents_done, chunks_done
+            chunks = split_documents(batch)
+            chunk_ids = [f"{name}::{chunks_done + i}" for i in range(len(chunks))]
+            if chunks:
+                vectors = _embed_chunks(chunks)
+                with _writing(name, catalog):
+                    _add_chunks(chunks, chunk_ids, vectors, store if store is not None else _write_store())
+            documents_done += len(batch)
+            chunks_done += len(chunks)
+            if live:
+                _write_checkpoint(name, digest, documents_done, chunks_done)
+            logger.info(f"Streamed {documents_done} documents ({chunks_done} chunks) from {name}")
+            if progress:
+                progress(documents_done, chunks_done)
         
-    documents = load_documents()
+        batch = []
+        for position, doc in enumerate(iter_file_documents(path)):
+            if position < documents_done:
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
         
-    if documents:
-        chunks = split_documents(documents)
+        ocr = _cached_ocr_chunks(name, digest)
+        with _writing(name, catalog):
+            catalog.upsert(name, path, _file_type(path), [f"{name}::{i}" for i in range(chunks_done)], digest=digest)
+            if live and os.path.exists(_checkpoint_path(name)):
+                os.remove(_checkpoint_path(name))
+            _add_ocr_chunks(name, ocr, store if store is not None else _write_store(), catalog)
+            return catalog.get(name)
+    finally:
+        if live:
+            with _index_lock:
+                _live_streams.discard(name)
+
+def _should_stream(path):
+    return os.path.getsize(path) >= STREAM_INGEST_THRESHOLD_BYTES
+
+def _index_file(path, digest=None, documents=None, progress=None, store=None, catalog=None):
+    """Split and embed one file into a vector store and record it in a catalog.
+    
+    ``store`` and ``catalog`` default to the live index; a rebuild passes its
+    new generation's. The file is loaded here unless its already parsed
+    ``documents`` are given; files above STREAM_INGEST_THRESHOLD_BYTES are
+    streamed in batches instead. Parsing and embedding happen outside the
+    index lock; the file's previous chunks are swapped for the new ones under
+    it. ``progress`` is called with (documents done, chunks done).
+    """
+    name = _document_name(path)
+    digest = digest or file_hash(path)
+    catalog = _catalog if catalog is None else catalog
+    if documents is None and _should_stream(path):
+        return _stream_index_file(path, digest, progress=progress, store=store, catalog=catalog)
+    if documents is None:
+        documents = load_file(path)
+    if progress:
+        progress(len(documents), 0)
+    chunks = split_documents(documents)
+    chunk_ids = [f"{name}::{i}" for i in range(len(chunks))]
+    vectors = _embed_chunks(chunks) if chunks else []
+    ocr = _cached_ocr_chunks(name, digest)
+    with _writing(name, catalog):
+        target = store if store is not None else _write_store()
+        existing = catalog.get(name)
+        if existing and existing.get("chunk_ids"):
+            logger.info(f"Evicting {existing['chunk_count']} stale chunks for {name}")
+            target.delete(ids=existing["chunk_ids"])
         if chunks:
-            print(f"Adding {len(chunks)} chunks to vector store...")
-            _vector_store.add_documents(documents=chunks)
-            print("Documents added to vector store")
+            logger.debug(f"Adding {len(chunks)} chunks from {name} to vector store...")
+            _add_chunks(chunks, chunk_ids, vectors, target)
+        catalog.upsert(name, path, _file_type(path), chunk_ids, digest=digest)
+        _add_ocr_chunks(name, ocr, target, catalog)
+    if progress:
+        progress(len(documents), len(chunks))
+    return catalog.get(name)
+
+def sync_documents(store, catalog):
+    """Index every file under the docs directory into ``store`` and ``catalog``, a generation being built.
+    
+    A file that fails to load is skipped without affecting the others.
+    """
+    paths = list_document_files()
+    logger.info(f"Found {len(paths)} supported files in {DOCS_DIRECTORY}")
+    large = [path for path in paths if _should_stream(path)]
+    for path in large:
+        try:
+            _stream_index_file(path, store=store, catalog=catalog)
+        except Exception as e:
+            logger.error(f"Error streaming {path}: {str(e)}")
+            name = _document_name(path)
+            catalog.remove(name)
+            store.delete(ids=[chunk_id for chunk_id in store.ids() if chunk_id.startswith(f"{name}::")])
+    
+    timings = []
+    small = [path for path in paths if path not in large]
+    for path, docs, seconds, error in iter_loaded_files(small):
+        timing = {"document": _document_name(path), "parse_seconds": round(seconds, 3), "documents": len(docs)}
+        timings.append(timing)
+        if error is None:
+            try:
+                _index_file(path, documents=docs, store=store, catalog=catalog)
+            except Exception as e:
+                error = str(e)
+        if error is not None:
+            timing["error"] = error
+            logger.error(f"Error loading {path}: {error}")
+            catalog.remove(_document_name(path))
+        else:
+            logger.info(f"Parsed {timing['document']} in {seconds:.2f}s")
+    _load_timings[:] = timings
+
+def initialize_system(background=False):
+    """Initialize a simple RAG system.
+    
+    The index published by the previous run is loaded from disk when there is
+    one, and only the files that changed since are re-indexed, in the
+    background; otherwise the whole docs directory is indexed first. With
+    ``background``, that first build runs on the index manager's thread
+    instead, and an empty index is served until it is published.
+    
+    When another process already writes the index in STORAGE_DIRECTORY, this
+    one becomes a reader: it serves queries from the published snapshot and
+    hands uploads, deletions and rebuilds to the writer.
+    """
+    with _index_lock:
+        if _is_initialized:
+            return _chain
+        chain = _build_system(background)
+    if not _is_reader():
+        _jobs.start(poll_interval=INDEX_POLL_INTERVAL or None)
+        if _startup.get("mode") == "snapshot":
+            threading.Thread(target=_reindex_changed_documents, name="reindex-changed", daemon=True).start()
+    if INDEX_POLL_INTERVAL > 0:
+        threading.Thread(target=_watch_index, name="index-watcher", daemon=True).start()
+    return chain
+
+def _acquire_writer_lock():
+    """Try to become the process that writes the index; return True on success."""
+    global _writer_lock_file
+    if _writer_lock_file is not None or fcntl is None:
+        return True
+    if not os.path.exists(STORAGE_DIRECTORY):
+        os.makedirs(STORAGE_DIRECTORY)
+    lock_file = open(os.path.join(STORAGE_DIRECTORY, "writer.lock"), "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Held until the process exits, when the OS releases it for the next worker to take.
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _writer_lock_file = lock_file
+    return True
+
+def _is_reader():
+    return _serving["role"] == "reader"
+
+def _build_system(background=False):
+    """Build the embeddings and vector store, loading the persisted snapshot or indexing the docs directory."""
+    global _embeddings, _vector_store, _chain, _is_initialized, _corpus_version
+    
+    logger.info("Initializing simple RAG system...")
+    started = time.perf_counter()
+    
+    # Retries are handled by the pipeline, which also backs off on rate limits.
+    # The OpenAI client itself is only created when something needs embedding.
+    _embeddings = CachedEmbeddings(
+        EmbeddingPipeline(
+            _DeferredEmbeddings(
+                lambda: _openai_class("OpenAIEmbeddings")(model="text-embedding-3-large", max_retries=0)
+            ),
+            max_batch_tokens=EMBEDDING_BATCH_TOKENS,
+            max_batch_size=EMBEDDING_BATCH_SIZE,
+            concurrency=EMBEDDING_CONCURRENCY,
+            max_retries=EMBEDDING_MAX_RETRIES,
+            model_name="text-embedding-3-large",
+        ),
+        os.path.join(STORAGE_DIRECTORY, "embeddings.sqlite3"),
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        model_name="text-embedding-3-large",
+    )
+    logger.info("Embeddings initialized")
+    
+    _serving["role"] = "writer" if _acquire_writer_lock() else "reader"
+    snapshot = _load_snapshot(read_only=_is_reader())
+    if _is_reader():
+        if snapshot is None:
+            # The writer has not published a snapshot yet; _watch_index opens it once it has.
+            _vector_store = NumpyVectorStore(embedding=_embeddings, dtype=VECTOR_STORE_DTYPE, lexical=BM25Index())
+        else:
+            _vector_store, _corpus_version = snapshot
+        _catalog.load()
+        _startup.update(mode="reader")
+        logger.info(f"Another process writes the index in {STORAGE_DIRECTORY}; serving its snapshot read-only")
+    elif snapshot is not None:
+        store, _corpus_version = snapshot
+        _publish_snapshot(store)
+        _remove_orphaned_chunks(store)
+        _startup.update(mode="snapshot")
+    elif background:
+        _catalog.clear()
+        _publish_snapshot(_new_vector_store())
+        _index_manager.rebuild(wait=False)
+        _startup.update(mode="background")
     else:
-        print("WARNING: No documents were loaded")
+        _publish_build(_build_snapshot())
+        _startup.update(mode="rebuild")
+    _startup.update(seconds=round(time.perf_counter() - started, 3), chunks=len(_vector_store))
+    metrics.record(f"startup_{_startup['mode']}", time.perf_counter() - started, chunks=len(_vector_store))
+    if _startup["mode"] == "background":
+        logger.info("Indexing the docs directory in the background; serving an empty index until it is published")
+    elif not _catalog.names():
+        logger.warning("No documents were loaded")
+    logger.info(f"Embedding cache: {_embeddings.stats()}")
         
-    def simple_rag_chain(query, thread_id=None):        
-        docs = _vector_store.similarity_search(query, k=5)
-                
-        context = ""
-        for i, doc in enumerate(docs):
-            source = doc.metadata.get('source', 'Unknown')
-            page = doc.metadata.get('page', '')
-            page_info = f" (page {page})" if page else ""
+    def simple_rag_chain(query, thread_id=None, deadline=None):        
+        docs = retrieve_documents(query, k=CONTEXT_CANDIDATES, deadline=deadline)
+        docs = assemble_context(query, _table_results(query, docs, deadline) + docs)
+        prompt = _build_prompt_timed(query, docs, _conversations.history(thread_id))
+        response = _invoke_llm("llm", prompt, deadline)
+        return response.content
+    
+    _chain = simple_rag_chain
+    _is_initialized = True
+    logger.info("Simple RAG system initialized")
+    return _chain
+
+def _new_vector_store(directory=None, read_only=False):
+    """Create an empty vector store in a fresh generation directory, or open the one in ``directory``."""
+    directory = directory or os.path.join(STORAGE_DIRECTORY, "vectors", f"gen-{time.time_ns()}")
+    ann = None
+    if VECTOR_SEARCH_MODE == "ivf":
+        ann = IVFIndex(
+            n_lists=ANN_LISTS,
+            n_probe=ANN_PROBES,
+            min_vectors=ANN_MIN_VECTORS,
+            path=os.path.join(directory, "ivf.npz"),
+        )
+    elif VECTOR_SEARCH_MODE != "exact":
+        logger.warning(f"Unknown VECTOR_SEARCH_MODE {VECTOR_SEARCH_MODE!r}, using exact search")
+    return NumpyVectorStore(
+        embedding=_embeddings, path=directory, dtype=VECTOR_STORE_DTYPE, ann=ann,
+        lexical=BM25Index(path=os.path.join(directory, "bm25")), read_only=read_only,
+    )
+
+def _build_snapshot():
+    """Index the docs directory into a new generation, a vector store and catalog of its own; return both.
+    
+    The index lock is not held: uploads, deletions and OCR keep writing to the
+    live index meanwhile, and _publish_build replays the documents they changed.
+    """
+    global _rebuild_changes
+    
+    store = _new_vector_store()
+    catalog = DocumentCatalog(os.path.join(store.path, "catalog.json"))
+    logger.info(f"Building vector store snapshot ({VECTOR_STORE_DTYPE}, {VECTOR_SEARCH_MODE} search) in {store.path}")
+    with _index_lock:
+        # Streaming ingests already under way keep writing to the live index batch by batch.
+        _rebuild_changes = set(_live_streams)
+    # Save the lexical and IVF indexes once the whole corpus is in, not every save_every chunks on the way.
+    indexes = [index for index in (store.lexical, store.ann) if index is not None]
+    save_every = [index.save_every for index in indexes]
+    for index in indexes:
+        index.save_every = None
+    try:
+        sync_documents(store, catalog)
+    except BaseException:
+        with _index_lock:
+            _rebuild_changes = None
+        shutil.rmtree(store.path, ignore_errors=True)
+        raise
+    finally:
+        for index, every in zip(indexes, save_every):
+            index.save_every = every
+    store.save_lexical()
+    if store.ann is not None:
+        # Publish the snapshot with the IVF index its build started training, not exact search.
+        store.ann.join()
+        store.save_ann()
+    return store, catalog
+
+def _publish_build(built):
+    """Publish a generation returned by _build_snapshot once the live writes made during its build are replayed onto it."""
+    global _rebuild_changes
+    
+    store, catalog = built
+    with _index_lock:
+        changed, _rebuild_changes = _rebuild_changes or set(), None
+        if changed and _vector_store is not None:
+            _replay_changes(store, catalog, changed)
+        _catalog.replace(catalog.entries())
+        for name in _table_store.retain(_catalog.names()):
+            logger.info(f"Dropped tables of removed document: {name}")
+        _publish_snapshot(store)
+
+def _replay_changes(store, catalog, names, batch_size=1000):
+    """Make documents ``names`` in a new generation what they are in the live index. Callers hold the index lock.
+    
+    What the build indexed for them is dropped and their live chunks are
+    copied over with their vectors, so nothing is embedded again.
+    """
+    prefixes = tuple(f"{name}::" for name in names)
+    for name in names:
+        catalog.remove(name)
+    store.delete(ids=[chunk_id for chunk_id in store.ids() if chunk_id.startswith(prefixes)])
+    ids = [chunk_id for chunk_id in _vector_store.ids() if chunk_id.startswith(prefixes)]
+    for start in range(0, len(ids), batch_size):
+        vectors = _vector_store.get_vectors(ids[start:start + batch_size])
+        docs = [doc for doc in _vector_store.get_by_ids(list(vectors)) if doc.id in vectors]
+        if docs:
+            store.add_vectors(
+                [vectors[doc.id] for doc in docs], [doc.page_content for doc in docs],
+                [doc.metadata for doc in docs], [doc.id for doc in docs],
+            )
+    for name in names:
+        entry = _catalog.get(name)
+        if entry is not None:
+            catalog.put(name, entry)
+    logger.info(f"Replayed {len(names)} documents written during the rebuild ({len(ids)} chunks)")
+
+def _publish_snapshot(store):
+    """Atomically make ``store`` the served index and discard older generations."""
+    global _vector_store
+    
+    with _index_lock:
+        _vector_store = store
+        _bump_corpus_version()
+        vectors_directory = os.path.dirname(store.path)
+        # Queries still holding an older store keep working: their memory maps
+        # stay valid after the files are unlinked.
+        for name in os.listdir(vectors_directory):
+            path = os.path.join(vectors_directory, name)
+            if name not in (os.path.basename(store.path), SNAPSHOT_MANIFEST):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+    logger.info(f"Published vector store snapshot with {len(store)} chunks")
+
+def _save_snapshot_manifest(store):
+    """Record ``store`` as the published snapshot, with the settings it was built with and the corpus version."""
+    manifest = {
+        "generation": os.path.basename(store.path),
+        "corpus_version": _corpus_version,
+        "dtype": VECTOR_STORE_DTYPE,
+        "search_mode": VECTOR_SEARCH_MODE,
+        "chunks": len(store),
+        "saved_at": time.time(),
+    }
+    path = os.path.join(os.path.dirname(store.path), SNAPSHOT_MANIFEST)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+def _manifest_path():
+    return os.path.join(STORAGE_DIRECTORY, "vectors", SNAPSHOT_MANIFEST)
+
+def _read_snapshot_manifest():
+    """Return the published snapshot's manifest, or None if there is no readable one."""
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest["generation"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable index snapshot manifest {path}: {str(e)}")
+        return None
+    return manifest
+
+def _load_snapshot(read_only=False):
+    """Open the published snapshot; return (store, corpus version), or None if unusable."""
+    manifest = _read_snapshot_manifest()
+    if manifest is None:
+        return None
+    directory = os.path.join(os.path.dirname(_manifest_path()), manifest["generation"])
+    if not os.path.isdir(directory):
+        logger.warning(f"Index snapshot {directory} is missing, rebuilding")
+        return None
+    if (manifest.get("dtype"), manifest.get("search_mode")) != (VECTOR_STORE_DTYPE, VECTOR_SEARCH_MODE):
+        logger.info(
+            f"Index snapshot was built with {manifest.get('dtype')}, {manifest.get('search_mode')} search; "
+            f"rebuilding for {VECTOR_STORE_DTYPE}, {VECTOR_SEARCH_MODE} search"
+        )
+        return None
+    with span("snapshot_load") as current:
+        store = _new_vector_store(directory, read_only=read_only)
+        current.set(chunks=len(store))
+    if len(store) != manifest.get("chunks"):
+        logger.warning(f"Index snapshot has {len(store)} chunks, expected {manifest.get('chunks')}")
+    logger.info(f"Loaded index snapshot {manifest['generation']} with {len(store)} chunks")
+    return store, manifest.get("corpus_version", 0)
+
+def _remove_orphaned_chunks(store):
+    """Delete chunks of the loaded snapshot that no catalog entry or resumable ingest accounts for."""
+    known = set()
+    for entry in _catalog.entries().values():
+        known.update(entry.get("chunk_ids", []))
+    # Chunks of a streaming ingest that was interrupted are kept for it to resume from.
+    orphans = [
+        chunk_id for chunk_id in store.ids()
+        if chunk_id not in known and not os.path.exists(_checkpoint_path(chunk_id.split("::", 1)[0]))
+    ]
+    if orphans:
+        logger.info(f"Removing {len(orphans)} chunks that belong to no indexed document")
+        with _index_lock:
+            store.delete(ids=orphans)
+
+def _reindex_changed_documents():
+    """Bring a loaded snapshot up to date with the docs directory.
+    
+    Documents whose files were deleted are removed. New files, changed files
+    and documents with chunks missing from the snapshot are queued as
+    ingestion jobs, so queries are answered from the snapshot meanwhile.
+    """
+    paths = {_document_name(path): path for path in list_document_files()}
+    for name in _catalog.names():
+        if name not in paths:
+            logger.info(f"Removing deleted document: {name}")
+            remove_document(name)
+    stored = set(_vector_store.ids())
+    queued = 0
+    for name, path in paths.items():
+        entry = _catalog.get(name)
+        if entry and not set(entry.get("chunk_ids", [])) <= stored:
+            logger.warning(f"Index snapshot is missing chunks of {name}, re-indexing it")
+            remove_document(name)
+        elif entry and _catalog.is_current(name, path):
+            continue
+        try:
+            submit_ingest(path)
+            queued += 1
+        except OSError as e:
+            logger.error(f"Could not queue {name} for re-indexing: {str(e)}")
+    _startup["reindex_queued"] = queued
+    if queued:
+        logger.info(f"Queued {queued} new or changed documents for re-indexing")
+
+def rebuild_index(wait=True, timeout=None):
+    """Re-index the docs directory into a new snapshot and swap it in.
+    
+    Queries keep using the current snapshot until the new one is published,
+    and concurrent requests are coalesced into a single rebuild. Returns None
+    on success, else an error message. A reader process only asks the writer
+    to rebuild and returns without waiting.
+    """
+    if not _is_initialized:
+        try:
+            initialize_system()
+        except Exception as e:
+            return str(e)
+        return None
+    if _is_reader():
+        with open(_rebuild_request_path(), "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return None
+    return _index_manager.rebuild(wait=wait, timeout=timeout)
+
+def _rebuild_request_path():
+    return os.path.join(STORAGE_DIRECTORY, "rebuild.request")
+
+def _watch_index():
+    """Keep this process in step with the others sharing STORAGE_DIRECTORY.
+    
+    Readers poll the snapshot manifest, which the writer rewrites after every
+    change to the index, and refresh their read-only view when it changes.
+    The writer picks up rebuilds requested by readers.
+    """
+    seen = None
+    while True:
+        time.sleep(INDEX_POLL_INTERVAL)
+        try:
+            if not _is_reader():
+                if os.path.exists(_rebuild_request_path()):
+                    os.remove(_rebuild_request_path())
+                    logger.info("Rebuilding the index at the request of another process")
+                    _index_manager.rebuild(wait=False)
+                continue
+            try:
+                stat = os.stat(_manifest_path())
+            except FileNotFoundError:
+                continue
+            if (stat.st_ino, stat.st_mtime_ns) != seen:
+                _follow_snapshot()
+                seen = (stat.st_ino, stat.st_mtime_ns)
+        except Exception as e:
+            logger.warning(f"Could not follow the published index: {str(e)}")
+
+def _follow_snapshot():
+    """Bring a reader's view of the index, catalog and corpus version up to the published manifest."""
+    global _vector_store, _corpus_version
+    
+    manifest = _read_snapshot_manifest()
+    if manifest is None:
+        return
+    generation = os.path.basename(_vector_store.path) if _vector_store.path else None
+    with span("snapshot_refresh") as current:
+        if manifest["generation"] != generation:
+            snapshot = _load_snapshot(read_only=True)
+            if snapshot is None:
+                return
+            # Queries already holding the previous store finish on it.
+            _vector_store = snapshot[0]
+            _serving["reloads"] += 1
+            current.set(generation=manifest["generation"])
+        else:
+            added, removed = _vector_store.refresh()
+            _serving["refreshes"] += 1
+            current.set(added=added, removed=removed)
+    _catalog.load()
+    _corpus_version = manifest.get("corpus_version", 0)
+
+def embed_query(query, deadline=None):
+    """Embed a query, reusing the vector of an identical recent query. Rate limits are retried until ``deadline``."""
+    vector = _query_embedding_cache.get(query)
+    if vector is None:
+        with span("query_embedding", bytes=len(query)):
+            vector = _embeddings.embed_query(query, deadline=deadline)
+        _query_embedding_cache.put(query, vector)
+    return vector
+
+def retrieve_documents(query, k=5, deadline=None, mode=None):
+    """Return the ``k`` chunks most relevant to ``query``.
+    
+    ``mode`` (default RETRIEVAL_MODE) is ``lexical`` for BM25 keyword search
+    with no embedding call, ``vector`` for embedding similarity, or
+    ``hybrid`` to fuse the top HYBRID_CANDIDATES of both by reciprocal rank.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}, expected one of {RETRIEVAL_MODES}")
+    store = _vector_store
+    if mode == "lexical":
+        return _lexical_search(store, query, k)
+    
+    query_embedding = embed_query(query, deadline)
+    if deadline is not None:
+        deadline.check("vector search")
+    if mode == "vector":
+        return _vector_search(store, query_embedding, k)
+    
+    fetch = max(k, HYBRID_CANDIDATES)
+    return reciprocal_rank_fusion(
+        [_vector_search(store, query_embedding, fetch), _lexical_search(store, query, fetch)], k
+    )
+
+def _vector_search(store, query_embedding, k):
+    with span("vector_search", chunks=len(store)) as current:
+        docs = store.similarity_search_by_vector(query_embedding, k=k)
+        current.set(results=len(docs))
+    return docs
+
+def _lexical_search(store, query, k):
+    with span("lexical_search", bytes=len(query)) as current:
+        docs = [doc for doc, _ in store.lexical_search_with_score(query, k)]
+        current.set(results=len(docs))
+    return docs
+
+def assemble_context(query, docs):
+    """Merge, diversify and pack retrieved chunks into at most CONTEXT_TOKEN_BUDGET tokens.
+    
+    Overlapping and adjacent chunks of the same page are merged, the rest are
+    ordered by maximal marginal relevance to the query, and chunks that no
+    longer fit the budget are dropped; see ``context_builder.build_context``.
+    """
+    with span("context_assembly", candidates=len(docs)) as current:
+        candidate_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+        query_vector = vectors = None
+        if RETRIEVAL_MODE != "lexical":
+            # Already embedded by retrieve_documents, so this is a cache hit.
+            query_vector = embed_query(query)
+            vectors = _vector_store.get_vectors([doc.id for doc in docs if doc.id])
+        packed, tokens = build_context(docs, CONTEXT_TOKEN_BUDGET, query_vector, vectors, CONTEXT_MMR_LAMBDA)
+        current.set(chunks=len(packed), candidate_tokens=candidate_tokens, tokens=tokens)
+    with _context_lock:
+        _context_totals["queries"] += 1
+        _context_totals["candidates"] += len(docs)
+        _context_totals["chunks"] += len(packed)
+        _context_totals["candidate_tokens"] += candidate_tokens
+        _context_totals["tokens"] += tokens
+    logger.debug(f"Packed {len(docs)} candidates ({candidate_tokens} tokens) into {len(packed)} chunks ({tokens} tokens)")
+    return packed
+
+def _context_stats():
+    with _context_lock:
+        totals = dict(_context_totals)
+    queries = totals["queries"]
+    return {
+        "token_budget": CONTEXT_TOKEN_BUDGET,
+        **totals,
+        "avg_candidate_tokens": round(totals["candidate_tokens"] / queries, 1) if queries else None,
+        "avg_tokens": round(totals["tokens"] / queries, 1) if queries else None,
+    }
+
+def _invoke_llm(stage, prompt, deadline=None):
+    """Call the LLM within ``deadline``, recording the call as ``stage`` with its token counts."""
+    with span(stage, bytes=len(prompt)) as current:
+        response = _get_llm().invoke(prompt, **_llm_options(deadline))
+        usage = getattr(response, "usage_metadata", None) or {}
+        current.set(**{name: usage[name] for name in ("input_tokens", "output_tokens") if name in usage})
+    return response
+
+def _build_prompt_timed(query, docs, history=""):
+    with span("prompt_assembly", chunks=len(docs)) as current:
+        prompt = build_prompt(query, docs, history)
+        current.set(bytes=len(prompt))
+    return prompt
+
+def _llm_options(deadline):
+    """Return LLM call options that cap the request at the time left before ``deadline``."""
+    if deadline is None or deadline.remaining() is None:
+        return {}
+    deadline.check("generation")
+    return {"timeout": deadline.remaining()}
+
+def build_sql_prompt(query, tables):
+    """Assemble the prompt that asks the LLM for a SQL query over the given tables."""
+    schemas = "\n\n".join(describe_table(table) for table in tables)
+    return f"""You translate questions about tabular data into a single SQLite SELECT statement.
+
+Tables:
+{schemas}
+
+Question: {query}
+
+Reply with only the SQL query, without explanation or formatting. Use only the tables and columns listed above and quote identifiers with double quotes. Compute sums, counts, averages and filters in SQL. If these tables cannot answer the question, reply with NONE."""
+
+def _extract_sql(text):
+    text = text.strip()
+    fenced = re.search(r"```(?:sql)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        text = fenced.group(1).strip()
+    return text.rstrip(";").strip()
+
+def _table_results(query, docs, deadline=None):
+    """Answer ``query`` exactly with a generated SQL query over the tables among ``docs``.
+    
+    Returns a one-element list with a document holding the query and its
+    result, or an empty list when no table was retrieved, the question asks
+    for no aggregate or filter (see is_table_question), the LLM finds the
+    tables irrelevant, or the query fails.
+    """
+    names = {doc.metadata['table'] for doc in docs if doc.metadata.get('table')}
+    if not names:
+        return []
+    tables = _table_store.tables(names)
+    if not tables or not is_table_question(query, tables):
+        return []
+    sql = _extract_sql(_invoke_llm("sql_generation", build_sql_prompt(query, tables), deadline).content)
+    if not sql or sql.upper() == "NONE":
+        return []
+    try:
+        with span("table_query") as current:
+            columns, rows, truncated = _table_store.query(sql, deadline)
+            current.set(rows=len(rows))
+    except Exception as e:
+        logger.warning(f"Table query failed: {str(e)}\n  SQL: {sql}")
+        return []
+    logger.debug(f"Table query returned {len(rows)} rows: {sql}")
+    lines = [" | ".join(columns)] + [" | ".join("" if value is None else str(value) for value in row) for row in rows]
+    if truncated:
+        lines.append(f"(only the first {len(rows)} rows are shown)")
+    return [Document(
+        page_content=f"Exact result of the SQL query {sql}\n" + "\n".join(lines),
+        metadata={'source': ", ".join(sorted({table['source'] for table in tables})), 'sql': sql},
+    )]
+
+def build_prompt(query, docs, history=""):
+    """Assemble the answer prompt from the retrieved chunks and the conversation so far."""
+    if history:
+        history = f"Conversation so far:\n{history}\n\n"
+    context = ""
+    for i, doc in enumerate(docs):
+        source = doc.metadata.get('source', 'Unknown')
+        page = doc.metadata.get('page', '')
+        page_info = f" (page {page})" if page else ""
+        
+        context += f"\n\nDocument {i+1} from {source}{page_info}:\n{doc.page_content}"
             
-            context += f"\n\nDocument {i+1} from {source}{page_info}:\n{doc.page_content}"
-                
-        prompt = f"""You are a document analysis assistant. Answer the question based on the following context from documents.
+    return f"""You are a document analysis assistant. Answer the question based on the following context from documents.
 
-                        Context:
+                        {history}Context:
                         {context}
 
                         Question: {query}
@@ -176,251 +1160,580 @@ def initialize_system():
                         5. Always be truthful and helpful
 
                         Answer:"""
-                
-        response = _llm.invoke(prompt)
-        return response.content
+
+def build_rewrite_prompt(query, history):
+    """Assemble the prompt that turns a follow-up question into a standalone one for retrieval."""
+    return f"""Given the conversation below and a follow-up question, rewrite the follow-up question as a standalone question that can be understood without the conversation. Keep names, numbers and identifiers exactly as written. If it is already standalone, repeat it unchanged.
+
+Conversation:
+{history}
+
+Follow-up question: {query}
+
+Reply with only the standalone question."""
+
+def build_summary_prompt(summary, turns, max_tokens):
+    """Assemble the prompt that folds older conversation turns into the running summary."""
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return f"""{previous}Conversation turns to add:
+{format_turns(turns)}
+
+Write an updated summary of the conversation in at most {max_tokens * 3 // 4} words. Keep the questions asked, the facts, figures, names and documents the answers relied on, and drop everything else. Reply with only the summary."""
+
+def _summarize_conversation(summary, turns, max_tokens):
+    return _invoke_llm("conversation_summary", build_summary_prompt(summary, turns, max_tokens)).content
+
+def _standalone_query(query, thread_id, deadline=None):
+    """Rewrite a follow-up question so it can be searched and cached without its conversation.
     
-    _chain = simple_rag_chain
-    _is_initialized = True
-    print("Simple RAG system initialized")
-    return _chain
+    Questions that already stand on their own are returned as asked, so they
+    are looked up in the answer cache without a model call.
+    """
+    if not CONVERSATION_REWRITE or not is_follow_up(query):
+        return query
+    history = _conversations.history(thread_id)
+    if not history:
+        return query
+    try:
+        rewritten = _invoke_llm("query_rewrite", build_rewrite_prompt(query, history), deadline).content.strip()
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not rewrite follow-up question, searching it as asked: {str(e)}")
+        return query
+    logger.debug(f"Rewrote follow-up question {query!r} as {rewritten!r}")
+    return rewritten or query
+
+def clear_conversation(thread_id):
+    """Forget the conversation history of a thread."""
+    _conversations.clear(thread_id)
 
-def process_with_timeout(func, args=(), kwargs={}, timeout=None):
-    """Execute a function with a timeout."""
-    if timeout is None or timeout <= 0:
-        return func(*args, **kwargs)
+def ingest_file(path, progress=None):
+    """Incrementally index a single new or changed file without rebuilding the corpus.
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args, **kwargs)
-        try:
-            return future.result(timeout=timeout)
-        except concurrent.futures.TimeoutError:
-            print(f"Processing timed out after {timeout} seconds")
-            return "I'm sorry, but processing your request took too long and was stopped. Please try a simpler question or adjust the timeout setting."
+    Returns the file's catalog entry. An unchanged file is left as is, apart
+    from adding OCR text cached since it was indexed; a changed file has its
+    previous chunks replaced by the new ones.
+    """
+    name = _document_name(path)
+    digest = file_hash(path)
+    with _index_lock:
+        if not _is_initialized:
+            initialize_system()
+            return _catalog.get(name)
+        
+        existing = _catalog.get(name)
+        unchanged = existing is not None and existing.get("hash") == digest
+        if unchanged and not _ocr_unindexed(name, existing):
+            logger.info(f"{name} is unchanged, skipping re-indexing")
+            return existing
+    
+    if unchanged:
+        entry = _index_ocr(name, digest)
+    else:
+        entry = _index_file(path, digest, progress=progress)
+    _bump_corpus_version()
+    return entry
+
+def _run_ingest_job(job, progress):
+    """Ingest, or remove, a job's file; return the content hash it was indexed with."""
+    if not os.path.exists(job["path"]):
+        # Deleted since it was queued, or queued by a reader process to remove it.
+        remove_document(job["document"])
+        return None
+    entry = ingest_file(job["path"], progress=progress)
+    return entry["hash"] if entry else None
 
-def process_query(query, thread_id=None, timeout=None):
-    """Process a user query and return the response with timeout support."""
+def submit_ingest(path):
+    """Queue a saved file for background ingestion and return its job.
+    
+    The file is hashed by the job when it runs, not by the caller.
+    """
     if not _is_initialized:
         initialize_system()
+    return _jobs.submit(_document_name(path), os.path.abspath(path))
+
+def get_ingest_job(job_id):
+    """Return the state and progress of an ingestion job, or None."""
+    return _jobs.get(job_id)
+
+def list_ingest_jobs(limit=50):
+    return _jobs.list(limit)
+
+def remove_document(name):
+    """Evict a document's chunks from the vector store and drop it from the catalog.
     
-    if not thread_id:
-        thread_id = str(uuid.uuid4())
-        
-    timeout_match = re.search(r'timeout=(\d+)', query)
-    if timeout_match:
-        try:
-            user_timeout = int(timeout_match.group(1))
-            timeout = user_timeout
-            # Remove the timeout parameter from the query
-            query = re.sub(r'timeout=\d+', '', query).strip()
-        except ValueError:
-            pass
+    A reader process queues the removal for the writer instead, once the file is gone.
+    """
+    if _is_reader():
+        _jobs.submit(name, os.path.join(DOCS_DIRECTORY, name))
+        return _catalog.get(name)
+    with _writing(name, _catalog):
+        entry = _catalog.remove(name)
+        _table_store.drop_document(name)
+        if entry and entry.get("chunk_ids") and _write_store() is not None:
+            logger.info(f"Evicting {entry['chunk_count']} chunks for {name}")
+            _write_store().delete(ids=entry["chunk_ids"])
+        if entry:
+            _bump_corpus_version()
+        return entry
+
+def _answer_without_retrieval(query, thread_id, document=None):
+    """Answer OCR requests and questions about the knowledge base itself; None for regular queries."""
+    ocr_result = process_ocr_request(query, thread_id, document)
+    if ocr_result:
+        return ocr_result
+            
+    document_files = get_document_list()
     
-    try:        
-        ocr_result = process_ocr_request(query, thread_id)
-        if ocr_result:
-            return ocr_result
-                
-        document_files = get_document_list()
-        
-        if not document_files:
-            print("WARNING: No documents have been loaded.")
-            return {
-                "response": "I don't have any documents in my knowledge base yet. Please upload some documents first.",
-                "thread_id": thread_id,
-                "success": True
-            }
-                
-        if "any document" in query.lower() or "have document" in query.lower():
-            doc_list = ", ".join(document_files)
-            response = f"I have {len(document_files)} document(s) in my knowledge base: {doc_list}."
+    if not document_files:
+        logger.warning("No documents have been loaded.")
+        return {
+            "response": "I don't have any documents in my knowledge base yet. Please upload some documents first.",
+            "thread_id": thread_id,
+            "success": True
+        }
             
-            return {
-                "response": response,
-                "thread_id": thread_id,
-                "success": True
-            }
+    if "any document" in query.lower() or "have document" in query.lower():
+        doc_list = ", ".join(document_files)
+        response = f"I have {len(document_files)} document(s) in my knowledge base: {doc_list}."
         
-        print(f"Processing query: '{query}' with timeout: {timeout if timeout else 'None'}")
-                
-        if timeout:
-            response = process_with_timeout(_chain, args=(query, thread_id), timeout=timeout)
-        else:
-            response = _chain(query, thread_id)
-        
-        if isinstance(response, str):
-            return {
-                "response": response,
-                "thread_id": thread_id,
-                "success": True
-            }
-        
-        print(f"Response generated successfully")
         return {
             "response": response,
             "thread_id": thread_id,
             "success": True
         }
+    return None
+
+def _lookup_answer(query, corpus_version, deadline=None):
+    """Return (cached answer or None, query embedding if one was computed)."""
+    cached = _answer_cache.get(query, corpus_version)
+    if cached is not None or not _answer_cache.semantic_enabled:
+        return cached, None
+    query_embedding = embed_query(query, deadline)
+    return _answer_cache.get_semantic(query_embedding, corpus_version), query_embedding
+
+def _record_answer(query, thread_id, response, deadline, search_query=None, corpus_version=None, query_embedding=None):
+    """Add an answer to its conversation and, given its ``search_query``, to the answer cache.
+    
+    Nothing is recorded once ``deadline`` has passed: the caller has been
+    told the request timed out, so the answer must not reappear in the
+    conversation's history.
+    """
+    if deadline is not None and deadline.expired:
+        logger.info(f"Discarding the answer for thread {thread_id}, which finished after its deadline")
+        return
+    if search_query is not None:
+        _answer_cache.put(search_query, corpus_version, response, query_embedding)
+    _conversations.append(thread_id, query, response)
+
+def _answer_query(query, thread_id, document=None, deadline=None):
+    """Answer a query on a query pool worker, giving up once ``deadline`` passes."""
+    direct_result = _answer_without_retrieval(query, thread_id, document)
+    if direct_result:
+        return direct_result
+    
+    corpus_version = _corpus_version
+    # Follow-ups are searched and cached as the standalone question they stand for.
+    search_query = _standalone_query(query, thread_id, deadline)
+    cached, query_embedding = _lookup_answer(search_query, corpus_version, deadline)
+    if cached is not None:
+        _record_answer(query, thread_id, cached, deadline)
+        return {
+            "response": cached,
+            "thread_id": thread_id,
+            "success": True,
+            "cached": True
+        }
+    
+    response = _chain(search_query, thread_id, deadline=deadline)
+    _record_answer(query, thread_id, response, deadline, search_query, corpus_version, query_embedding)
+    logger.debug("Response generated successfully")
+    return {
+        "response": response,
+        "thread_id": thread_id,
+        "success": True
+    }
+
+def process_query(query, thread_id=None, timeout=None, document=None, trace_id=None):
+    """Process a user query on the shared query pool and return the response.
+    
+    ``timeout`` is the request's deadline in seconds (QUERY_TIMEOUT if None,
+    no limit if 0); retrieval and the LLM call are bounded by the time left.
+    Raises QueryRejected when the pool is saturated. With ``trace_id`` the
+    response carries a ``trace`` listing the timed stages of the request.
+    """
+    if trace_id:
+        with metrics.trace(trace_id) as trace:
+            result = process_query(query, thread_id, timeout, document)
+        return {**result, "trace": trace.to_dict()}
+    
+    if not _is_initialized:
+        initialize_system()
+    
+    if not thread_id:
+        thread_id = str(uuid.uuid4())
+    
+    if timeout is None:
+        timeout = _default_timeout
+    
+    try:
+        logger.debug(f"Processing query: '{query}' with timeout: {timeout if timeout else 'None'}")
+        with span("query", bytes=len(query)):
+            return _query_pool.run(
+                _answer_query, query, thread_id, document,
+                timeout=timeout if timeout > 0 else None,
+            )
+    except QueryRejected:
+        raise
+    except DeadlineExceeded as e:
+        logger.warning(f"Processing timed out: {str(e)}")
+        return {
+            "response": _timeout_message,
+            "thread_id": thread_id,
+            "success": True,
+            "timed_out": True
+        }
     except Exception as e:
-        print(f"Error in process_query: {str(e)}")
+        logger.error(f"Error in process_query: {str(e)}")
         return {
             "response": f"Error processing query: {str(e)}",
             "thread_id": thread_id,
             "success": False
         }
 
-def get_document_list():
-    """Get list of all supported documents in the docs directory."""
-    docs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
-    documents = []
+def _source_info(doc):
+    return {"source": doc.metadata.get('source', 'Unknown'), "page": doc.metadata.get('page')}
+
+def stream_query(query, thread_id=None, document=None, timeout=None):
+    """Process a user query on the shared query pool, returning an iterator of events as the answer is generated.
     
-    if os.path.exists(docs_dir):        
-        supported_extensions = ['.pdf', '.xlsx', '.xls','.csv']
+    Yields a ``sources`` event with the retrieved chunks first, then one
+    ``token`` event per piece of the LLM's output as it arrives, then a
+    ``done`` event with timings (``first_token_ms`` is the time to the first
+    token). Closing the iterator, e.g. when the client disconnects, stops
+    the LLM stream. ``timeout`` bounds the whole request as for
+    process_query; once it passes an ``error`` event with ``timed_out`` ends
+    the stream. Raises QueryRejected, before any event, when the pool is
+    saturated.
+    """
+    started = time.perf_counter()
+    if not _is_initialized:
+        initialize_system()
+    
+    if not thread_id:
+        thread_id = str(uuid.uuid4())
+    
+    if timeout is None:
+        timeout = _default_timeout
+    
+    events = _query_pool.stream(
+        _stream_answer, query, thread_id, document, started,
+        timeout=timeout if timeout > 0 else None,
+    )
+    return _stream_events(events, thread_id)
+
+def _stream_events(events, thread_id):
+    try:
+        yield from events
+    except DeadlineExceeded as e:
+        logger.warning(f"Streaming timed out: {str(e)}")
+        yield {"type": "error", "message": _timeout_message, "thread_id": thread_id, "success": True, "timed_out": True}
+    except Exception as e:
+        logger.error(f"Error in stream_query: {str(e)}")
+        yield {"type": "error", "message": f"Error processing query: {str(e)}", "thread_id": thread_id, "success": False}
+
+def _stream_answer(query, thread_id, document, started, deadline=None):
+    """Generate the events of stream_query on a query pool worker, giving up once ``deadline`` passes."""
+    try:
+        direct_result = _answer_without_retrieval(query, thread_id, document)
+        if direct_result:
+            yield {"type": "sources", "sources": [], "thread_id": thread_id}
+            yield {"type": "token", "content": direct_result["response"]}
+            yield {"type": "done", "thread_id": thread_id, "success": direct_result["success"]}
+            return
         
-        for filename in os.listdir(docs_dir):
-            file_path = os.path.join(docs_dir, filename)
-            if os.path.isfile(file_path):
-                _, ext = os.path.splitext(filename.lower())
-                if ext in supported_extensions:
-                    documents.append(filename)
+        corpus_version = _corpus_version
+        search_query = _standalone_query(query, thread_id, deadline)
+        cached, query_embedding = _lookup_answer(search_query, corpus_version, deadline)
+        if cached is not None:
+            _record_answer(query, thread_id, cached, deadline)
+            yield {"type": "sources", "sources": [], "thread_id": thread_id, "cached": True}
+            yield {"type": "token", "content": cached}
+            yield {"type": "done", "thread_id": thread_id, "success": True, "cached": True}
+            return
+        
+        docs = retrieve_documents(search_query, k=CONTEXT_CANDIDATES, deadline=deadline)
+        docs = assemble_context(search_query, _table_results(search_query, docs, deadline) + docs)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        yield {
+            "type": "sources",
+            "sources": [_source_info(doc) for doc in docs],
+            "thread_id": thread_id,
+            "retrieval_ms": round(retrieval_ms, 1),
+        }
+        
+        prompt = _build_prompt_timed(search_query, docs, _conversations.history(thread_id))
+        first_token_ms = None
+        completed = False
+        tokens = []
+        stream_started = time.perf_counter()
+        try:
+            for chunk in _get_llm().stream(prompt, **_llm_options(deadline)):
+                if not chunk.content:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                tokens.append(chunk.content)
+                yield {"type": "token", "content": chunk.content}
+            completed = True
+        finally:
+            metrics.record(
+                "llm_stream", time.perf_counter() - stream_started, not completed,
+                bytes=len(prompt), output_chunks=len(tokens),
+            )
+            if not completed:
+                logger.info(f"Streaming cancelled for thread {thread_id}")
+        _record_answer(query, thread_id, "".join(tokens), deadline, search_query, corpus_version, query_embedding)
+        
+        yield {
+            "type": "done",
+            "thread_id": thread_id,
+            "success": True,
+            "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in stream_query: {str(e)}")
+        yield {"type": "error", "message": f"Error processing query: {str(e)}", "thread_id": thread_id, "success": False}
+
+metrics.REGISTRY.gauge("genie_vector_store_chunks", "Chunks in the served vector store.", lambda: len(_vector_store) if _vector_store is not None else None)
+metrics.REGISTRY.gauge("genie_conversation_threads", "Conversation threads held in memory.", lambda: _conversations.stats()["threads_in_memory"])
+metrics.REGISTRY.gauge("genie_corpus_version", "Number of times the indexed corpus has changed.", lambda: _corpus_version)
+metrics.REGISTRY.gauge("genie_query_pool_running", "Queries executing on the query pool.", lambda: _query_pool.stats()["running"])
+metrics.REGISTRY.gauge("genie_query_pool_queued", "Queries waiting for a query pool worker.", lambda: _query_pool.stats()["queued"])
+metrics.REGISTRY.gauge("genie_query_pool_rejected_total", "Queries rejected because the pool was saturated.", lambda: _query_pool.rejected, kind="counter")
+metrics.REGISTRY.gauge("genie_query_timeouts_total", "Queries that hit their deadline.", lambda: _query_pool.timed_out, kind="counter")
+metrics.REGISTRY.gauge("genie_answer_cache_hits_total", "Answers served from the answer cache.", lambda: _answer_cache.stats()["exact"]["hits"] + _answer_cache.stats()["semantic"]["hits"], kind="counter")
+
+def get_metrics():
+    """Return stage latency histograms and runtime gauges in the Prometheus text format."""
+    return metrics.REGISTRY.render()
+
+def get_stats():
+    """Return runtime counters for the RAG system's caches."""
+    return {
+        "embedding_cache": _embeddings.stats() if isinstance(_embeddings, CachedEmbeddings) else None,
+        "embedding_pipeline": _embeddings.underlying.stats() if isinstance(getattr(_embeddings, "underlying", None), EmbeddingPipeline) else None,
+        "vector_store": _vector_store.stats() if isinstance(_vector_store, NumpyVectorStore) else None,
+        "index_manager": _index_manager.stats(),
+        "load_timings": list(_load_timings),
+        "corpus_version": _corpus_version,
+        "answer_cache": _answer_cache.stats(),
+        "query_embedding_cache": _query_embedding_cache.stats(),
+        "query_pool": _query_pool.stats(),
+        "tables": _table_store.stats(),
+        "context": _context_stats(),
+        "startup": dict(_startup),
+        "conversations": _conversations.stats(),
+        "serving": dict(
+            _serving,
+            generation=os.path.basename(_vector_store.path) if getattr(_vector_store, "path", None) else None,
+        ),
+    }
+
+def get_document_list():
+    """Get list of all indexed documents from the document catalog."""
+    return _catalog.names()
+
+def _select_ocr_document(pdf_docs, query, document=None):
+    """Pick the PDF to OCR: the one requested, else one named in the query, else the first."""
+    if document:
+        return document if document in pdf_docs else None
+    lowered = query.lower()
+    for name in pdf_docs:
+        if name.lower() in lowered or os.path.splitext(os.path.basename(name))[0].lower() in lowered:
+            return name
+    return pdf_docs[0]
+
+def _get_ocr_client():
+    global _ocr_client
+    if _ocr_client is None:
+        from mistralai import Mistral
+        _ocr_client = Mistral(api_key=os.environ.get("MISTRAL_API_KEY"))
+    return _ocr_client
+
+def set_ocr_client(client):
+    """Use ``client`` in place of the Mistral client, e.g. a local stub."""
+    global _ocr_client
+    _ocr_client = client
+
+def _cached_ocr_chunks(name, digest):
+    """Split and embed a document's cached OCR text; return (chunks, vectors), or None if there is none.
     
-    return documents
+    Only Mistral OCR output is indexed: the pypdf fallback extracts the same
+    text the loader has already chunked. Embedding happens here, outside the
+    index lock; _add_ocr_chunks writes the result under it.
+    """
+    if not OCR_INDEX_RESULTS or _file_type(name) != 'pdf':
+        return None
+    pages = _ocr_cache.get(digest, MISTRAL_OCR_MODEL)
+    if pages is None:
+        return None
+    documents = [
+        Document(
+            page_content=text,
+            metadata={'source': os.path.basename(name), 'file_type': 'pdf', 'page': page, 'ocr_engine': MISTRAL_OCR_MODEL},
+        )
+        for page, text in enumerate(pages) if text.strip()
+    ]
+    chunks = split_documents(documents)
+    return chunks, _embed_chunks(chunks) if chunks else []
 
-def process_ocr_request(query, thread_id=None):
-    """Process OCR request for PDF documents."""    
-    import sys
-    sys.stdout.flush()
-    print("\n\n=== CHECKING IF OCR REQUEST ===", flush=True)
+def _add_ocr_chunks(name, ocr, store, catalog):
+    """Replace a document's OCR chunks in ``store`` and ``catalog`` with ``ocr`` from _cached_ocr_chunks."""
+    entry = catalog.get(name)
+    if ocr is None or not entry or store is None:
+        return
+    chunks, vectors = ocr
+    old_ids = [chunk_id for chunk_id in entry["chunk_ids"] if "::ocr::" in chunk_id]
+    if old_ids:
+        store.delete(ids=old_ids)
+    chunk_ids = [f"{name}::ocr::{i}" for i in range(len(chunks))]
+    if chunks:
+        _add_chunks(chunks, chunk_ids, vectors, store)
+    kept = [chunk_id for chunk_id in entry["chunk_ids"] if "::ocr::" not in chunk_id]
+    catalog.set_chunk_ids(name, kept + chunk_ids)
+    logger.info(f"Indexed {len(chunks)} OCR chunks for {name}")
+
+def _ocr_unindexed(name, entry):
+    """Return True if a document has cached OCR text that is not in the index yet."""
+    if not OCR_INDEX_RESULTS or _file_type(name) != 'pdf':
+        return False
+    if any("::ocr::" in chunk_id for chunk_id in entry["chunk_ids"]):
+        return False
+    return _ocr_cache.get(entry["hash"], MISTRAL_OCR_MODEL) is not None
+
+def _index_ocr(name, digest):
+    """Add the cached OCR text of an already indexed document to the live index."""
+    ocr = _cached_ocr_chunks(name, digest)
+    with _writing(name, _catalog):
+        _add_ocr_chunks(name, ocr, _write_store(), _catalog)
+        return _catalog.get(name)
+
+def process_ocr_request(query, thread_id=None, document=None):
+    """Process OCR request for PDF documents.
     
+    OCR output is cached on disk per PDF content hash and page, so repeated
+    requests for the same file never re-upload it. ``document`` selects the
+    PDF; otherwise a PDF named in the query, or the first one, is used.
+    """
     try:        
         ocr_pattern = re.compile(r'ocr|optical character recognition', re.IGNORECASE)                
-        print(f"Query: '{query}'", flush=True)
-        print(f"OCR pattern match: {bool(ocr_pattern.search(query))}", flush=True)
-                
         if not ocr_pattern.search(query):
-            print("Not an OCR request - missing OCR keyword", flush=True)
             return None
         
-        print("=== OCR REQUEST DETECTED ===", flush=True)
+        logger.debug("OCR request detected")
                 
         documents = get_document_list()
         pdf_docs = [doc for doc in documents if doc.lower().endswith('.pdf')]
         
         if not pdf_docs:
-            print("No PDF documents found", flush=True)
+            logger.debug("No PDF documents found")
             return {
                 "response": "No PDF documents found. Please upload a PDF document first.",
                 "thread_id": thread_id,
                 "success": False
             }
         
-        print(f"Found PDF documents: {pdf_docs}", flush=True)
+        target = _select_ocr_document(pdf_docs, query, document)
+        if target is None:
+            return {
+                "response": f"PDF document {document} not found. Available PDFs: {', '.join(pdf_docs)}.",
+                "thread_id": thread_id,
+                "success": False
+            }
+        
+        pdf_path = os.path.join(DOCS_DIRECTORY, target)
+        entry = _catalog.get(target)
+        digest = entry["hash"] if entry else file_hash(pdf_path)
         
         try:            
-            mistral_api_key = os.environ.get("MISTRAL_API_KEY")
-            if not mistral_api_key:
-                print("MISTRAL_API_KEY not found in environment variables", flush=True)
-                return {
-                    "response": "OCR processing requires a Mistral API key. Please add MISTRAL_API_KEY to your .env file.",
-                    "thread_id": thread_id,
-                    "success": False
-                }
-            
-            print(f"MISTRAL_API_KEY found: {mistral_api_key[:5]}...{mistral_api_key[-5:]}", flush=True)
-                        
-            try:
-                from mistralai import Mistral
-            except ImportError:
-                return {
-                    "response": "OCR processing requires the Mistral AI package. Please install it with 'pip install mistralai'.",
-                    "thread_id": thread_id,
-                    "success": False
-                }
-                        
-            docs_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
-            pdf_path = os.path.join(docs_directory, pdf_docs[0])
-            
-            print(f"Processing PDF for OCR: {pdf_path}")
-                        
-            client = Mistral(api_key=mistral_api_key)
-                        
-            try:
-                print(f"Uploading PDF for OCR: {pdf_path}")
-                
-                uploaded_pdf = client.files.upload(
-                    file={
-                        "file_name": pdf_docs[0],
-                        "content": open(pdf_path, "rb"),
-                    },
-                    purpose="ocr"
-                )
-                
-                print(f"File uploaded successfully with ID: {uploaded_pdf.id}")                                
-                signed_url = client.files.get_signed_url(file_id=uploaded_pdf.id)
-                print(f"Got signed URL: {signed_url.url}")
-                                
-                ocr_response = client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={
-                        "type": "document_url",
-                        "document_url": signed_url.url,
+            pages = _ocr_cache.get(digest, MISTRAL_OCR_MODEL)
+            if pages is not None:
+                logger.debug(f"Using cached OCR results for {target}")
+            else:
+                if _ocr_client is None and not os.environ.get("MISTRAL_API_KEY"):
+                    logger.warning("MISTRAL_API_KEY not found in environment variables")
+                    return {
+                        "response": "OCR processing requires a Mistral API key. Please add MISTRAL_API_KEY to your .env file.",
+                        "thread_id": thread_id,
+                        "success": False
                     }
-                )
-                                
-                if hasattr(ocr_response, 'pages') and ocr_response.pages:                    
-                    ocr_text = ""
-                    for page in ocr_response.pages:
-                        if hasattr(page, 'text'):
-                            ocr_text += page.text + "\n\n"
-                        else:
-                            ocr_text += str(page) + "\n\n"
-                else:
-                    ocr_text = str(ocr_response)
-                
-                markdown_text = f"# OCR Results for {pdf_docs[0]}\n\n"
-                markdown_text += "```\n"
-                markdown_text += ocr_text
-                markdown_text += "\n```"
                 
-                return {
-                    "response": markdown_text,
-                    "thread_id": thread_id,
-                    "success": True
-                }
-                
-            except Exception as e:
-                print(f"Error in Mistral OCR processing: {str(e)}")                                
-                import pypdf                
-                
-                reader = pypdf.PdfReader(pdf_path)
-                text = ""
-                
-                for page_num in range(len(reader.pages)):
-                    page = reader.pages[page_num]
-                    text += page.extract_text() + "\n\n"
-                
-                if not text.strip():
+                try:
+                    client = _get_ocr_client()
+                except ImportError:
                     return {
-                        "response": f"The PDF document {pdf_docs[0]} doesn't contain extractable text, and Mistral OCR failed with error: {str(e)}",
+                        "response": "OCR processing requires the Mistral AI package. Please install it with 'pip install mistralai'.",
                         "thread_id": thread_id,
                         "success": False
                     }
                 
-                return {
-                    "response": f"Mistral OCR failed, but basic text extraction from {pdf_docs[0]} succeeded:\n\n{text[:1500]}...",
-                    "thread_id": thread_id,
-                    "success": True
-                }
+                try:
+                    logger.info(f"Processing PDF for OCR: {pdf_path}")
+                    with span("ocr_mistral", bytes=os.path.getsize(pdf_path)) as current:
+                        pages = mistral_ocr_pages(pdf_path, client)
+                        current.set(pages=len(pages))
+                    _ocr_cache.put(digest, MISTRAL_OCR_MODEL, pages)
+                except Exception as e:
+                    logger.error(f"Error in Mistral OCR processing: {str(e)}")
+                    
+                    pages = _ocr_cache.get(digest, PYPDF_ENGINE)
+                    if pages is None:
+                        with span("ocr_pypdf", bytes=os.path.getsize(pdf_path)) as current:
+                            pages = extract_text_pages(pdf_path, workers=LOADER_WORKERS)
+                            current.set(pages=len(pages))
+                        _ocr_cache.put(digest, PYPDF_ENGINE, pages)
+                    text = "\n\n".join(pages)
+                    
+                    if not text.strip():
+                        return {
+                            "response": f"The PDF document {target} doesn't contain extractable text, and Mistral OCR failed with error: {str(e)}",
+                            "thread_id": thread_id,
+                            "success": False
+                        }
+                    
+                    return {
+                        "response": f"Mistral OCR failed, but basic text extraction from {target} succeeded:\n\n{text[:1500]}...",
+                        "thread_id": thread_id,
+                        "success": True
+                    }
+                
+                if OCR_INDEX_RESULTS:
+                    # An ingestion job embeds and indexes the text, so it is returned without waiting for that.
+                    _jobs.submit(target, os.path.abspath(pdf_path), digest)
+            
+            ocr_text = "".join(f"{page}\n\n" for page in pages)
+            markdown_text = f"# OCR Results for {target}\n\n```\n{ocr_text}\n```"
+            
+            return {
+                "response": markdown_text,
+                "thread_id": thread_id,
+                "success": True
+            }
                 
         except Exception as e:
-            print(f"Error in OCR processing: {str(e)}")
+            logger.error(f"Error in OCR processing: {str(e)}")
             return {
                 "response": f"Error during OCR processing: {str(e)}",
                 "thread_id": thread_id,
                 "success": False
             }
     except Exception as e:
-        print(f"Error in process_ocr_request: {str(e)}")
+        logger.error(f"Error in process_ocr_request: {str(e)}")
         return {
             "response": f"Error processing OCR request: {str(e)}",
             "thread_id": thread_id,
@@ -1,13 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
+import json
+import uuid
 from werkzeug.utils import secure_filename
 import rag_service
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
+app.config['UPLOAD_FOLDER'] = rag_service.DOCS_DIRECTORY
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024 * 1024  # 10GB max upload size
 app.secret_key = 'genie_secret_key'  
 
@@ -17,17 +19,85 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 @app.route('/api/init', methods=['GET'])
 def init():
     documents = rag_service.get_document_list()
-    return jsonify({'documents': documents})
+    return jsonify({'documents': documents, 'threadId': str(uuid.uuid4())})
+
+def _request_timeout(data):
+    """Return the request's ``timeout`` in seconds (None if absent); raise ValueError if it is not a valid one."""
+    timeout = data.get('timeout')
+    if timeout is None:
+        return None
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        timeout = -1
+    if not 0 <= timeout < float('inf'):
+        raise ValueError('timeout must be a non-negative number of seconds')
+    return timeout
+
+def _busy_response(error):
+    return jsonify({
+        'success': False,
+        'response': 'The server is busy right now. Please try again in a moment.',
+        'message': str(error),
+    }), 503, {'Retry-After': '1'}
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     data = request.json
     query = data.get('message', '')
-        
-    result = rag_service.process_query(query)
+    
+    try:
+        timeout = _request_timeout(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # Clients opt in to a per-request trace by sending X-Request-ID or "trace": true.
+    trace_id = request.headers.get('X-Request-ID') or (uuid.uuid4().hex if data.get('trace') else None)
+    
+    try:
+        result = rag_service.process_query(query, data.get('thread_id'), timeout, data.get('document'), trace_id)
+    except rag_service.QueryRejected as e:
+        return _busy_response(e)
     
     return jsonify(result)
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.json
+    query = data.get('message', '')
+    
+    try:
+        timeout = _request_timeout(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # Admitted to the query pool here, so a saturated server answers 503 before the stream starts.
+    try:
+        stream = rag_service.stream_query(query, data.get('thread_id'), data.get('document'), timeout)
+    except rag_service.QueryRejected as e:
+        return _busy_response(e)
+    
+    def events():
+        # Closed when the client disconnects, which stops the answer's worker.
+        try:
+            for event in stream:
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            stream.close()
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/chat/clear', methods=['POST'])
+def clear_chat():
+    data = request.get_json(silent=True) or {}
+    if data.get('thread_id'):
+        rag_service.clear_conversation(data['thread_id'])
+    return jsonify({'success': True})
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -43,14 +113,22 @@ def upload_file():
     _, ext = os.path.splitext(file.filename.lower())
     if ext in supported_extensions:
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)            
-        file.save(file_path)            
-        rag_service._is_initialized = False
-        rag_service.initialize_system()
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # Write to a temporary name and move it into place, so the indexer never reads a half-written file.
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        try:
+            file.save(tmp_path)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        job = rag_service.submit_ingest(file_path)
         
         return jsonify({
             'success': True, 
             'message': f'Successfully uploaded {filename}',
+            'job_id': job['id'],
+            'job': job,
         })
     else:
         return jsonify({
@@ -58,11 +136,30 @@ def upload_file():
             'message': 'Unsupported file type. Please upload PDF, Excel, or CSV files.'
         })
 
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': rag_service.list_ingest_jobs()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = rag_service.get_ingest_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
     documents = rag_service.get_document_list()
     return jsonify({'documents': documents})
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify(rag_service.get_stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(rag_service.get_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/documents/delete', methods=['POST'])
 def delete_document():
     data = request.json
@@ -79,7 +176,7 @@ def delete_document():
         
         os.remove(document_path)        
         
-        rag_service._is_initialized = False        
+        rag_service.remove_document(document_name)
         
         return jsonify({
             'success': True, 
@@ -91,12 +188,10 @@ def delete_document():
 
 @app.route('/api/reset', methods=['POST'])
 def reset_system():
-    try:
-        rag_service._is_initialized = False
-        rag_service.initialize_system()
-        return jsonify({'success': True, 'message': 'System reset successfully'})
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)})
+    error = rag_service.rebuild_index()
+    if error:
+        return jsonify({'success': False, 'message': error})
+    return jsonify({'success': True, 'message': 'System reset successfully'})
 
 
 @app.route('/', defaults={'path': ''})
@@ -0,0 +1,188 @@
+"""Offline stress test for concurrent queries, uploads, deletions and rebuilds.
+
+Indexes a small synthetic corpus with the fake embedding and chat models from
+``benchmark.py``, then for ``--duration`` seconds runs query threads next to
+threads that upload and index files, delete them, and rebuild the whole
+index, as the ``/api/chat``, ``/api/upload``, ``/api/documents/delete`` and
+``/api/reset`` handlers would. Afterwards it checks that the index is
+consistent: the chunk ids the catalog records are exactly the ids in the
+vector store, the lexical index holds the same number of chunks, and the
+catalog and table store list exactly the files left in the docs directory.
+Exits non-zero on any failed operation or mismatch:
+
+    python stress_test.py --duration 30 --query-threads 8
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import Counter
+
+from benchmark import fake_models, generate_corpus, generate_queries, write_pdf, _sentence, _table_rows
+
+UPLOAD_NAMES = 6
+
+
+def write_upload(path, rng):
+    """Write a small random PDF or CSV to ``path``, depending on its extension."""
+    if path.endswith(".pdf"):
+        write_pdf(path, [[_sentence(rng) for _ in range(20)] for _ in range(rng.randint(1, 4))])
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sku", "product", "region", "quantity", "price"])
+        writer.writerows(_table_rows(rng, rng.randint(10, 300)))
+
+
+def check_consistency(rag_service):
+    """Return a list of mismatches between the catalog, the vector store, the table store and the docs directory."""
+    problems = []
+    with rag_service._index_lock:
+        store = rag_service._vector_store
+        entries = rag_service._catalog.entries()
+        recorded = {chunk_id for entry in entries.values() for chunk_id in entry["chunk_ids"]}
+        stored = set(store.ids())
+        if recorded - stored:
+            problems.append(f"{len(recorded - stored)} catalog chunks missing from the store, e.g. {sorted(recorded - stored)[:3]}")
+        if stored - recorded:
+            problems.append(f"{len(stored - recorded)} store chunks not in the catalog, e.g. {sorted(stored - recorded)[:3]}")
+        if store.lexical is not None and len(store.lexical) != len(store):
+            problems.append(f"lexical index holds {len(store.lexical)} chunks, the store {len(store)}")
+        files = {rag_service._document_name(path) for path in rag_service.list_document_files()}
+        if set(entries) != files:
+            problems.append(f"catalog documents {sorted(set(entries) ^ files)} do not match the docs directory")
+        tables = {table["document"] for table in rag_service._table_store.tables()}
+        table_files = {name for name in files if rag_service._file_type(name) in ("csv", "excel")}
+        if rag_service.TABLE_ENGINE and tables != table_files:
+            problems.append(f"table store documents {sorted(tables ^ table_files)} do not match the docs directory")
+    return problems
+
+
+def run(args):
+    """Stress the service in this process; return the measurements and any problems found."""
+    import rag_service
+
+    embeddings, chat = fake_models(args.embedding_latency_ms / 1000, args.llm_latency_ms / 1000)
+    rag_service.OpenAIEmbeddings = embeddings
+    rag_service.ChatOpenAI = chat
+    rag_service.initialize_system()
+
+    docs = rag_service.DOCS_DIRECTORY
+    names = [f"upload_{i}.{'pdf' if i % 2 else 'csv'}" for i in range(UPLOAD_NAMES)]
+    # Each upload name is written and indexed, or deleted, by one thread at a time, as
+    # the server saves a file before queueing it and removes it before evicting it.
+    name_locks = {name: threading.Lock() for name in names}
+    queries = generate_queries(1000, seed=args.seed)
+    stop = threading.Event()
+    counts = Counter()
+    failures = []
+    latencies = []
+    stats_lock = threading.Lock()
+
+    def query(rng):
+        started = time.perf_counter()
+        result = rag_service.process_query(rng.choice(queries), timeout=args.timeout)
+        with stats_lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+        if not result.get("success", True):
+            raise RuntimeError(result.get("response"))
+
+    def upload(rng):
+        name = rng.choice(names)
+        with name_locks[name]:
+            path = os.path.join(docs, name)
+            write_upload(path, rng)
+            rag_service.ingest_file(path)
+
+    def delete(rng):
+        name = rng.choice(names)
+        with name_locks[name]:
+            path = os.path.join(docs, name)
+            if os.path.exists(path):
+                os.remove(path)
+                rag_service.remove_document(name)
+
+    def reset(rng):
+        error = rag_service.rebuild_index()
+        if error:
+            raise RuntimeError(error)
+
+    def worker(action, seed, pause):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            try:
+                action(rng)
+                outcome = action.__name__
+            except Exception as e:
+                outcome = f"{action.__name__}_failed"
+                with stats_lock:
+                    failures.append(f"{action.__name__}: {type(e).__name__}: {str(e)}")
+            with stats_lock:
+                counts[outcome] += 1
+            stop.wait(pause)
+
+    plan = [(query, 0)] * args.query_threads + [(upload, 0.05)] * args.upload_threads
+    plan += [(delete, 0.2)] * args.delete_threads + [(reset, args.reset_interval)] * args.reset_threads
+    threads = [
+        threading.Thread(target=worker, args=(action, args.seed + i, pause), name=f"stress-{action.__name__}-{i}")
+        for i, (action, pause) in enumerate(plan)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    problems = check_consistency(rag_service)
+    return {
+        "seconds": round(seconds, 1),
+        "operations": dict(counts),
+        "query_p50_ms": round(latencies[len(latencies) // 2], 1) if latencies else None,
+        "query_p99_ms": round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)], 1) if latencies else None,
+        "chunks": len(rag_service._vector_store),
+        "documents": len(rag_service._catalog.names()),
+        "rebuilds": rag_service._index_manager.rebuilds,
+        "coalesced_rebuilds": rag_service._index_manager.coalesced,
+        "failures": failures[:20],
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run concurrent queries, uploads, deletions and rebuilds against local fake models, then check the index."
+    )
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run the concurrent load")
+    parser.add_argument("--query-threads", type=int, default=8)
+    parser.add_argument("--upload-threads", type=int, default=2)
+    parser.add_argument("--delete-threads", type=int, default=1)
+    parser.add_argument("--reset-threads", type=int, default=1)
+    parser.add_argument("--reset-interval", type=float, default=2, help="seconds between rebuilds per reset thread")
+    parser.add_argument("--timeout", type=float, default=0, help="per-query deadline in seconds (0: none)")
+    parser.add_argument("--embedding-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="genie-stress-") as root:
+        # rag_service reads its directories when it is imported.
+        os.environ["DOCS_DIRECTORY"] = os.path.join(root, "docs")
+        os.environ["STORAGE_DIRECTORY"] = os.path.join(root, "storage")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        generate_corpus(os.environ["DOCS_DIRECTORY"], pdf_pages=50, csv_rows=2000, xlsx_rows=500, seed=args.seed)
+        result = run(args)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["failures"] or result["problems"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+import os
+import re
+import csv
+import json
+import uuid
+import sqlite3
+import hashlib
+from contextlib import closing
+
+_INSERT_BATCH = 5000
+# Rows copied per transaction when a staged table is converted to its column types.
+_COPY_BATCH = 50000
+# Plain decimal numbers without leading zeros; "02134" or "1_000" stay text.
+_INTEGER = re.compile(r"[+-]?(0|[1-9]\d{0,17})")
+# Longer digit strings are identifiers such as account numbers, too long for a 64-bit integer.
+_DIGITS = re.compile(r"[+-]?\d+")
+_REAL = re.compile(r"[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?")
+_SQL_TYPES = {"integer": "INTEGER", "real": "REAL", "text": "TEXT"}
+_SAMPLE_VALUES = 5
+# Aggregates, rankings and numeric filters over rows: what only a SQL query answers exactly.
+_TABLE_QUESTION = re.compile(
+    r"\b(how (many|much)|count|number of|totals?|sum|average|avg|mean|median|min(imum)?|max(imum)?"
+    r"|highest|lowest|largest|smallest|biggest|most|least|top|bottom|rank\w*|sort\w*|(order|group)(ed)? by"
+    r"|per|breakdown|distinct|unique|percent\w*|ratio|(list|show) (all|every)|all (rows|records|entries))\b"
+    r"|\b((more|less|fewer|greater|higher|lower|bigger|smaller) than|at (least|most)"
+    r"|above|below|over|under|between|exceed\w*|equals?( to)?)\s+[$€£]?\d"
+    r"|[<>]=?\s*\d",
+    re.IGNORECASE,
+)
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+
+def _identifier(name, fallback):
+    """Turn a header into a lowercase SQL identifier."""
+    identifier = re.sub(r"\W+", "_", str(name).strip().lower()).strip("_")
+    if not identifier:
+        identifier = fallback
+    if identifier[0].isdigit():
+        identifier = f"c_{identifier}"
+    return identifier
+
+
+def _column_names(headers):
+    names = []
+    for i, header in enumerate(headers):
+        name = _identifier(header, f"column_{i + 1}")
+        base, suffix = name, 2
+        while name in names:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        names.append(name)
+    return names
+
+
+def _clean(value):
+    """Return a cell as a number (from Excel) or stripped text; empty cells become None."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return None if value != value else value
+    text = str(value).strip()
+    return text or None
+
+
+def _parse(value):
+    """Return (kind, number) for a cleaned cell: integer, real, or text with a None number."""
+    if isinstance(value, (int, float)):
+        return ("integer" if isinstance(value, int) else "real"), value
+    if _INTEGER.fullmatch(value):
+        return "integer", int(value)
+    if _DIGITS.fullmatch(value):
+        return "text", None
+    if _REAL.fullmatch(value):
+        return "real", float(value)
+    return "text", None
+
+
+class _ColumnProfile:
+    """Type, range, null count and a few sample values of a column, gathered while rows stream in.
+
+    A column is numeric only if every value in it is; one value with a
+    leading zero or any other text keeps the whole column as text, so codes
+    such as zip codes and padded ids compare as written.
+    """
+
+    def __init__(self, name, header):
+        self.name = name
+        self.header = str(header)
+        self.kind = None
+        self.minimum = None
+        self.maximum = None
+        self.nulls = 0
+        self.samples = []
+
+    def add(self, value):
+        if value is None:
+            self.nulls += 1
+            return
+        kind, number = _parse(value)
+        if self.kind is None or self.kind == kind:
+            self.kind = kind
+        elif {self.kind, kind} == {"integer", "real"}:
+            self.kind = "real"
+        else:
+            self.kind = "text"
+        if kind != "text":
+            self.minimum = number if self.minimum is None else min(self.minimum, number)
+            self.maximum = number if self.maximum is None else max(self.maximum, number)
+        if len(self.samples) < _SAMPLE_VALUES and value not in self.samples:
+            self.samples.append(value)
+
+    @property
+    def sql_type(self):
+        return _SQL_TYPES[self.kind or "text"]
+
+    @staticmethod
+    def _typed(value, kind):
+        if kind == "text":
+            return str(value)
+        number = _parse(value)[1]
+        return float(number) if kind == "real" else number
+
+    def to_dict(self):
+        kind = self.kind or "text"
+        return {
+            "name": self.name,
+            "header": self.header,
+            "type": kind,
+            "min": self.minimum if kind != "text" else None,
+            "max": self.maximum if kind != "text" else None,
+            "nulls": self.nulls,
+            "samples": [self._typed(value, kind) for value in self.samples],
+        }
+
+
+class _Staged(list):
+    """The [staging table, info] pairs of one load, whose staging tables all start with ``prefix``."""
+
+    def __init__(self, prefix):
+        super().__init__()
+        self.prefix = prefix
+
+
+class TableStore:
+    """Local SQLite store for the rows of CSV and Excel files.
+
+    Each CSV file, and each sheet of an Excel file, becomes one table whose
+    columns are typed integer, real or text from all of their values. Loading
+    streams rows in batches, reading CSV and .xlsx files row by row (a legacy
+    .xls sheet, at most 65536 rows, is read whole), and profiles every column
+    on the way, so only a short schema summary per table has to be embedded
+    however many rows the file has, while aggregates and filters are answered
+    exactly by SQL. Rows go into a staging table committed batch by batch, so
+    several loader processes can fill the same database without holding its
+    write lock for a whole file, and the staged tables replace the document's
+    old ones in one short transaction at the end. Queries run on a read-only
+    connection that may only read and compute.
+    """
+
+    def __init__(self, path, max_result_rows=50):
+        self.path = path
+        self.max_result_rows = max_result_rows
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS _tables ("
+                " name TEXT PRIMARY KEY,"
+                " document TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " sheet TEXT,"
+                " row_count INTEGER NOT NULL,"
+                " columns TEXT NOT NULL)"
+            )
+
+    def _connect(self, read_only=False):
+        # Connections are opened per call, so the store can be used from
+        # loader processes as well as the server's threads.
+        if read_only:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _table_name(self, document, sheet=None):
+        key = document if sheet is None else f"{document}#{sheet}"
+        stem = _identifier(os.path.splitext(os.path.basename(document))[0], "table")[:40]
+        if sheet is not None:
+            stem = f"{stem}_{_identifier(sheet, 'sheet')[:20]}"
+        return f"{stem}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+    def _load_rows(self, conn, staged, document, source, sheet, headers, rows):
+        """Stream rows into a new staging table, recorded in ``staged`` with the info of the table it will become."""
+        name = self._table_name(document, sheet)
+        staging = self._staging_name(staged)
+        columns = _column_names(headers)
+        profiles = [_ColumnProfile(column, header) for column, header in zip(columns, headers)]
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        conn.execute(f'CREATE TABLE "{staging}" ({quoted})')
+        conn.commit()
+        staged.append([staging, None])
+        insert = f'INSERT INTO "{staging}" VALUES ({", ".join("?" * len(columns))})'
+        count, batch = 0, []
+        for row in rows:
+            values = [_clean(value) for value in list(row)[:len(columns)]]
+            values += [None] * (len(columns) - len(values))
+            if all(value is None for value in values):
+                continue
+            for profile, value in zip(profiles, values):
+                profile.add(value)
+            batch.append(values)
+            if len(batch) >= _INSERT_BATCH:
+                conn.executemany(insert, batch)
+                conn.commit()
+                count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(insert, batch)
+            conn.commit()
+            count += len(batch)
+        staged[-1][0] = self._typed_copy(conn, staged, staged[-1][0], profiles, count)
+        staged[-1][1] = {
+            "name": name,
+            "document": document,
+            "source": source,
+            "sheet": sheet,
+            "row_count": count,
+            "columns": [profile.to_dict() for profile in profiles],
+        }
+
+    def _staging_name(self, staged):
+        # Named after the load (see load_file) so a failed load can drop everything it created.
+        return f"{staged.prefix}{uuid.uuid4().hex[:8]}"
+
+    def _typed_copy(self, conn, staged, staging, profiles, count):
+        """Copy a staging table into one whose columns carry the profiled types; return the new table's name.
+
+        The column types make SQLite store numeric columns as numbers and
+        text columns as the text that was read.
+        """
+        typed = self._staging_name(staged)
+        declared = ", ".join(f'"{profile.name}" {profile.sql_type}' for profile in profiles)
+        conn.execute(f'CREATE TABLE "{typed}" ({declared})')
+        conn.commit()
+        for start in range(0, count, _COPY_BATCH):
+            conn.execute(
+                f'INSERT INTO "{typed}" SELECT * FROM "{staging}" WHERE rowid > ? AND rowid <= ?',
+                (start, start + _COPY_BATCH),
+            )
+            conn.commit()
+        conn.execute(f'DROP TABLE "{staging}"')
+        conn.commit()
+        return typed
+
+    def _publish(self, conn, document, staged):
+        """Swap the staged tables in for the document's current ones. Callers commit."""
+        self._drop(conn, document)
+        for staging, info in staged:
+            name = info["name"]
+            conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            conn.execute(f'ALTER TABLE "{staging}" RENAME TO "{name}"')
+            conn.execute(
+                "INSERT OR REPLACE INTO _tables (name, document, source, sheet, row_count, columns) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, document, info["source"], info["sheet"], info["row_count"],
+                 json.dumps(info["columns"], default=str)),
+            )
+
+    def load_file(self, document, path, file_type):
+        """Replace the tables of ``document`` with the contents of a CSV or Excel file; return their info."""
+        source = os.path.basename(path)
+        staged = _Staged(f"_staging_{uuid.uuid4().hex[:12]}_")
+        with closing(self._connect()) as conn:
+            try:
+                self._stage_file(conn, document, path, source, file_type, staged)
+                with conn:
+                    self._publish(conn, document, staged)
+            except BaseException:
+                conn.rollback()
+                leftovers = conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+                    (len(staged.prefix), staged.prefix),
+                ).fetchall()
+                for (name,) in leftovers:
+                    conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+                conn.commit()
+                raise
+        return [info for _, info in staged]
+
+    def _stage_file(self, conn, document, path, source, file_type, staged):
+        if file_type == "csv":
+            with open(path, "r", newline="", encoding="utf-8-sig", errors="replace") as f:
+                reader = csv.reader(f)
+                headers = next(reader, None)
+                if headers:
+                    self._load_rows(conn, staged, document, source, None, headers, reader)
+        elif file_type == "excel" and path.lower().endswith(".xls"):
+            # The legacy format cannot be read row by row, but holds at most 65536 rows a sheet.
+            import pandas as pd
+            for sheet, frame in pd.read_excel(path, sheet_name=None, dtype=object).items():
+                if frame.empty and not len(frame.columns):
+                    continue
+                frame = frame.astype(object).where(frame.notna(), None)
+                self._load_rows(
+                    conn, staged, document, source, str(sheet), list(frame.columns), frame.itertuples(index=False)
+                )
+        elif file_type == "excel":
+            from openpyxl import load_workbook
+            workbook = load_workbook(path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    rows = worksheet.iter_rows(values_only=True)
+                    headers = list(next(rows, None) or ())
+                    while headers and headers[-1] is None:
+                        headers.pop()
+                    if headers:
+                        headers = ["" if header is None else header for header in headers]
+                        self._load_rows(conn, staged, document, source, worksheet.title, headers, rows)
+            finally:
+                workbook.close()
+        else:
+            raise ValueError(f"Unsupported table file type: {file_type}")
+
+    def _drop(self, conn, document):
+        names = [name for (name,) in conn.execute("SELECT name FROM _tables WHERE document = ?", (document,))]
+        for name in names:
+            conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+        conn.execute("DELETE FROM _tables WHERE document = ?", (document,))
+        return names
+
+    def drop_document(self, document):
+        """Drop every table loaded from ``document``."""
+        with closing(self._connect()) as conn, conn:
+            return self._drop(conn, document)
+
+    def retain(self, documents):
+        """Drop the tables of every document not in ``documents``."""
+        documents = set(documents)
+        with closing(self._connect()) as conn, conn:
+            stale = {document for (document,) in conn.execute("SELECT DISTINCT document FROM _tables")} - documents
+            for document in stale:
+                self._drop(conn, document)
+        return stale
+
+    def tables(self, names=None):
+        """Return the info of the given tables (default: all)."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT name, document, source, sheet, row_count, columns FROM _tables").fetchall()
+        tables = [
+            {"name": name, "document": document, "source": source, "sheet": sheet,
+             "row_count": row_count, "columns": json.loads(columns)}
+            for name, document, source, sheet, row_count, columns in rows
+        ]
+        if names is not None:
+            tables = [table for table in tables if table["name"] in names]
+        return tables
+
+    def query(self, sql, deadline=None):
+        """Run a read-only SQL query; return (column names, rows, truncated).
+
+        At most ``max_result_rows`` rows are returned. The query is aborted if
+        ``deadline`` passes while it runs.
+        """
+        conn = self._connect(read_only=True)
+        try:
+            conn.set_authorizer(
+                lambda action, *args: sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+            )
+            if deadline is not None:
+                conn.set_progress_handler(lambda: 1 if deadline.expired else 0, 10000)
+            cursor = conn.execute(sql)
+            rows = cursor.fetchmany(self.max_result_rows + 1)
+            columns = [column[0] for column in cursor.description or []]
+        finally:
+            conn.close()
+        return columns, rows[:self.max_result_rows], len(rows) > self.max_result_rows
+
+    def stats(self):
+        tables = self.tables()
+        return {
+            "tables": len(tables),
+            "rows": sum(table["row_count"] for table in tables),
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+def is_table_question(question, tables=()):
+    """Return True if ``question`` needs a SQL query over ``tables`` to be answered.
+
+    That is when it asks for an aggregate, a ranking or a numeric filter, or
+    names a column of one of the tables, as a lookup of row values does. The
+    embedded schemas already answer other questions, such as what a table
+    holds.
+    """
+    if _TABLE_QUESTION.search(question):
+        return True
+    words = set(re.findall(r"\w+", question.lower()))
+    return any(
+        set(column["name"].split("_")) <= words
+        for table in tables for column in table["columns"]
+    )
+
+
+def describe_table(table):
+    """Human-readable schema summary of a table, used as its embedded document and in SQL prompts."""
+    origin = table["source"] if not table["sheet"] else f"sheet {table['sheet']!r} of {table['source']}"
+    lines = [f'Table "{table["name"]}" holds the {table["row_count"]} rows of {origin}.', "Columns:"]
+    for column in table["columns"]:
+        details = column["type"]
+        if column["header"] != column["name"]:
+            details += f", header {column['header']!r}"
+        if column["min"] is not None:
+            details += f", from {column['min']} to {column['max']}"
+        if column["samples"]:
+            details += f", e.g. {', '.join(repr(value) for value in column['samples'])}"
+        if column["nulls"]:
+            details += f", {column['nulls']} empty"
+        lines.append(f'- "{column["name"]}" ({details})')
+    return "\n".join(lines)